@@ -1,28 +1,43 @@
 import streamlit as st
-import pandas as pd
 import json
+import logging
 import os
+import shutil
+import tempfile
+import time
 import numpy as np
-import cv2 # 需安裝: pip install opencv-python-headless
 from PIL import Image
-# 必須安裝: pip install streamlit-cropper
-# 若出現 ModuleNotFoundError，請在終端機執行: pip install streamlit-cropper
-try:
-    from streamlit_cropper import st_cropper
-except ImportError:
-    st.error("⚠️ 缺少必要套件，請執行: pip install streamlit-cropper")
-    st.stop()
+import cardmodel
+import imagecache
+import ingest
+import perf
+import storage
+import battle
+from battle import POKEMON_TYPES, SPECIAL_TAGS, MOVE_CATEGORIES
+# pandas、OpenCV (cv2 / detector / cardindex / videoscan) 與 streamlit-cropper 載入需要數百毫秒，
+# 只在用到的頁面/功能裡才 import (第一次載入後由 Python 快取，之後的重新執行不會再付出成本)。
+# numpy (約 50ms) 與 battle 仍在最上方載入：卡片庫的篩選索引 (cardmodel.InventoryView) 與所有計分都以 numpy 陣列實作，
+# 每個頁面一開始就會用到，延後載入也省不下這段時間。
+# OpenCV 需安裝: pip install opencv-python-headless
 
 # --- 1. 設定頁面與導航 (移至最上方以避免 NameError) ---
 st.set_page_config(page_title="Mezastar 檔案室", layout="wide", page_icon="🗃️")
 
 # 在這裡就定義頁面選單，確保 page 變數一定存在
-page = st.sidebar.radio("模式", ["卡片資料庫管理", "對戰分析", "🛠️ 建立圖示範本"])
+page = st.sidebar.radio("模式", ["卡片資料庫管理", "對戰分析", "🗓️ 多場對戰規劃", "📊 對戰覆蓋分析", "🛠️ 建立圖示範本"])
 
 # --- 2. 設定資料庫與路徑 ---
-DB_FILE = "mezastar_db.json"
+DB_FILE = "mezastar_db.json"      # JSON 匯入/匯出 (舊版格式)
+DB_SQLITE = "mezastar_db.sqlite"  # 實際儲存 (每次只寫入變動的卡片)
 IMG_DIR = "cardinfo"
 ICON_DIR = "att_icon" 
+THUMB_DIR = ".thumbcache"         # 卡片圖片縮圖快取 (可隨時刪除)
+PERF_LOG = "perf_log.jsonl"       # 各階段耗時紀錄 (超過 5MB 自動輪替)
+CROP_BOXES = "crop_boxes.json"    # 依截圖解析度記住的框選範圍
+CARD_INDEX = ".cardindex.sqlite"  # 卡片正面圖的影像索引 (可隨時刪除，會自動重建)
+log = logging.getLogger("mezastar")
+# 圖示比對使用的執行緒數量 (預設 = CPU 核心數，設為 1 則不平行)
+DETECT_WORKERS = os.cpu_count() or 1
 
 # 確保目錄存在
 for d in [IMG_DIR, ICON_DIR]:
@@ -30,127 +45,267 @@ for d in [IMG_DIR, ICON_DIR]:
         os.makedirs(d)
 
 # --- 3. 通用函式 (Helpers) ---
-def sort_inventory(data):
-    if data:
-        data.sort(key=lambda x: x['name'])
-    return data
+def get_store():
+    # 行程內共用同一個連線；第一次啟動時會自動匯入舊的 JSON 檔
+    return storage.open_store(DB_SQLITE, legacy_json=DB_FILE)
 
-def load_db():
-    if os.path.exists(DB_FILE):
-        try:
-            with open(DB_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return sort_inventory(data)
-        except Exception as e:
-            st.error(f"讀取資料庫失敗: {e}")
-            return []
-    return []
+def get_shared():
+    # 所有 session 共用同一份卡片庫 (唯讀快照 + 版本號)
+    return storage.open_shared_inventory(DB_SQLITE, legacy_json=DB_FILE)
+
+def sync_inventory(own_version=None):
+    """
+    讓本 session 的卡片清單跟上共用卡片庫的最新版本 (只換參照，不複製)。
+    其他使用者有變更時顯示提示 (own_version 為自己剛寫入的版本，不計入)，並讓編輯中的選擇繼續指向同一張卡片。
+    """
+    shared = get_shared()
+    old_version = st.session_state.get('inventory_version')
+    if old_version == shared.version: return
+    old_cards = st.session_state.get('inventory') or []
+    idx = st.session_state.get('edit_select_index', 0)
+    selected = old_cards[idx] if idx < len(old_cards) else None
+    changes = shared.changes_since(old_version) if old_version is not None else []
+    version, cards = shared.snapshot()
+    st.session_state['inventory'], st.session_state['inventory_version'] = cards, version
+    if old_version is None: return
+    others = None if changes is None else [c for c in changes if c[0] != own_version]
+    if others is None or any(action == "reload" for _, action, _ in others): st.toast("🔄 卡片庫已被其他使用者重新載入", icon="🔄")
+    elif others: st.toast(f"🔄 其他使用者更新了 {len(others)} 筆卡片資料", icon="🔄")
+    new_idx = next((i for i, c in enumerate(cards) if c is selected), None)
+    st.session_state['edit_select_index'] = new_idx or 0
+    if new_idx is None and selected is not None: st.session_state['edit_name_input'] = ""
 
 def save_db(data):
+    """
+    整個卡片庫重新寫入 (單一交易)，用於手動強制存檔。
+    本 session 的清單落後時 (其他使用者已有變更) 不寫入，避免蓋掉他人的變更。
+    """
     try:
-        sort_inventory(data)
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        sync_inventory(own_version=get_shared().replace_all(data, st.session_state['inventory_version']))
         st.toast("✅ 資料庫已自動存檔！", icon="💾")
+    except storage.StaleWriteError as e:
+        st.error(f"⚠️ {e}，已載入最新資料，請確認後再存檔。")
+        sync_inventory()
     except Exception as e:
         st.error(f"寫入資料庫失敗: {e}")
 
+def save_card(action, *cards):
+    """
+    只把單張卡片的變更寫入共用卡片庫 (並存檔)：
+    action = "insert" (新卡片) / "update" (舊卡片, 新卡片) / "delete" (要刪除的卡片)。
+    卡片已被其他使用者修改或刪除時不寫入，回傳 False。
+    """
+    shared = get_shared()
+    try:
+        version = getattr(shared, action)(st.session_state['inventory_version'], *cards)
+    except storage.StaleWriteError as e:
+        st.session_state['msg_area'] = ""
+        st.error(f"⚠️ {e}，請重新選擇後再試一次。")
+        sync_inventory()
+        return False
+    except Exception as e:
+        st.error(f"寫入資料庫失敗: {e}")
+        return False
+    sync_inventory(own_version=version)
+    st.toast("✅ 資料庫已自動存檔！", icon="💾")
+    return True
+
+def card_image(card_name, side, variant=None):
+    """
+    卡片圖檔路徑 (side = "前"/"後")，沒有圖檔時回傳 None。
+    variant 為 "thumb"/"preview" 時回傳快取的縮圖，只有需要原圖時才讀取原始 PNG。
+    """
+    path = os.path.join(IMG_DIR, f"{card_name}_{side}.png")
+    if not os.path.exists(path): return None
+    if variant is None: return path
+    try:
+        return imagecache.get_thumbnail_cache(THUMB_DIR).get(path, variant)
+    except Exception:
+        return path # 無法產生縮圖時退回原圖
+
 def save_card_images(name):
+    """把新增表單上傳的正/背面圖送到背景匯入 (不等待解碼與寫檔)。"""
     current_key = st.session_state.get('uploader_key', 0)
     front = st.session_state.get(f"u_front_{current_key}")
     back = st.session_state.get(f"u_back_{current_key}")
-    
-    if front:
-        Image.open(front).save(os.path.join(IMG_DIR, f"{name}_前.png"), "PNG")
-    if back:
-        Image.open(back).save(os.path.join(IMG_DIR, f"{name}_後.png"), "PNG")
+    items = [ingest.IngestItem(name, side, f) for side, f in (("前", front), ("後", back)) if f]
+    if items: start_ingest(items)
+
+def on_image_stored(result):
+    """(匯入的工作執行緒) 正面圖寫入後更新影像索引。"""
+    if result.side != "前": return
+    try:
+        get_card_index().add(result.path)
+    except Exception:
+        log.exception("更新影像索引失敗: %s", result.path) # 不影響存檔 (下次啟動時會重新同步)
+
+def start_ingest(items):
+    """送出背景匯入，進度由 ingest_progress 顯示。"""
+    batch = ingest.get_ingest_pipeline(IMG_DIR).submit(items, on_stored=on_image_stored)
+    st.session_state['ingest_batches'].append(batch)
+
+@st.fragment(run_every=1)
+def ingest_progress():
+    """背景匯入圖片的進度 (每秒只更新這一區，不影響表單操作)；全部完成後重新整理頁面一次。"""
+    batches = st.session_state['ingest_batches']
+    done, total = sum(b.done for b in batches), sum(b.total for b in batches)
+    if done < total:
+        st.progress(done / total, text=f"🖼️ 背景處理圖片中... {done}/{total}")
+        return
+    st.session_state['ingest_report'] = (sum(len(b.results()) for b in batches), [e for b in batches for e in b.errors()])
+    st.session_state['ingest_batches'] = []
+    ingest.get_ingest_pipeline(IMG_DIR).store.prune()
+    st.rerun()
+
+def get_card_index():
+    import cardindex
+    return cardindex.get_card_index(CARD_INDEX, IMG_DIR)
+
+def identify_card(uploaded_file):
+    """
+    以影像索引辨識上傳的正面圖，回傳 cardindex.CardMatch 清單。
+    圖檔無法讀取時回傳空清單；其他錯誤 (索引或 OpenCV 問題) 記錄到 log 並提示，同樣回傳空清單。
+    """
+    try:
+        uploaded_file.seek(0)
+        with st.spinner("比對卡片圖片..."):
+            return get_card_index().match(uploaded_file)
+    except (OSError, ValueError):
+        return []
+    except Exception as e:
+        log.exception("卡片圖片比對失敗")
+        st.warning(f"⚠️ 無法比對卡片圖片: {e}")
+        return []
+    finally:
+        uploaded_file.seek(0)
+
+# --- 框選 (縮小顯示，原圖座標) ---
+def crop_proxy(uploaded_file, slot):
+    """上傳的截圖只解碼一次：回傳該檔案的 imagecache.CropProxy (存在 session_state，換檔時重建)。"""
+    key = f"crop_proxy_{slot}"
+    cached = st.session_state.get(key)
+    if cached is None or cached[0] != uploaded_file.file_id:
+        img = Image.open(uploaded_file)
+        img.load()
+        cached = st.session_state[key] = (uploaded_file.file_id, imagecache.CropProxy(img))
+    return cached[1]
+
+def load_cropper():
+    # 必須安裝: pip install streamlit-cropper
+    # 若出現 ModuleNotFoundError，請在終端機執行: pip install streamlit-cropper
+    try:
+        from streamlit_cropper import st_cropper
+    except ImportError:
+        st.error("⚠️ 缺少必要套件，請執行: pip install streamlit-cropper")
+        st.stop()
+    return st_cropper
+
+def crop_on_proxy(proxy, key, box=None):
+    """
+    在縮小影像上顯示紅框讓使用者框選 (拖曳時只傳送縮小影像)，
+    回傳 (從原圖裁切的圖片, 原圖座標 (x, y, w, h))。box 為原圖座標的預設紅框。
+    """
+    st_cropper = load_cropper()
+    default_coords = None
+    if box:
+        x, y, w, h = proxy.to_display(box)
+        default_coords = (x, x + w, y, y + h)
+    rect = st_cropper(proxy.display, realtime_update=True, default_coords=default_coords, box_color='#FF0000',
+                      aspect_ratio=None, return_type="box", should_resize_image=False, key=key)
+    box = proxy.to_original((rect['left'], rect['top'], rect['width'], rect['height']))
+    return proxy.crop(box), box
 
 # --- 核心辨識邏輯 (裁切區域 + 原圖解析度) ---
-def detect_attribute_icons_from_crop(cropped_image_pil):
+def detect_attribute_icons_from_crop(cropped_image_pil, mode="roi", timer=None, features="bgr", prefilter=False):
     """
     接收使用者裁切好的 PIL 圖片 (Scanner 選取範圍)。
     直接使用原圖解析度進行比對，不做任何縮放。
+    範本由 detector 的共用範本庫提供 (已預先載入並縮放好)。
+    回傳 detector.IconHit 清單 (含屬性、分數、所屬欄位與框選位置)。
+    timer (perf.StageTimer) 會記錄 convert / templates / detect 各階段耗時。
     """
-    if not cropped_image_pil: return [[], [], []]
+    if not cropped_image_pil: return []
+    import cv2
+    import detector
 
     # 1. 轉為 BGR (OpenCV 格式)
-    img_bgr = cv2.cvtColor(np.array(cropped_image_pil), cv2.COLOR_RGB2BGR)
+    with perf.timed(timer, "convert"):
+        img_bgr = cv2.cvtColor(np.array(cropped_image_pil), cv2.COLOR_RGB2BGR)
     
     # 【關鍵修改】：不再縮放，直接使用原始裁切圖
     # 這樣能確保跟 "建立範本" 時的解析度是 1:1 的 (因為建立範本也是用原圖)
     img_target = img_bgr
 
-    # 2. 載入範本 (Templates)
-    template_groups = {}
-    if os.path.exists(ICON_DIR):
-        for filename in os.listdir(ICON_DIR):
-            if filename.endswith(".png"):
-                type_name = filename.split("_")[0]
-                icon_path = os.path.join(ICON_DIR, filename)
-                t_img = cv2.imread(icon_path)
-                if t_img is not None:
-                    # 範本也不縮放，直接使用原圖
-                    if type_name not in template_groups:
-                        template_groups[type_name] = []
-                    template_groups[type_name].append(t_img)
-
+    # 2. 取得範本 (Templates)：行程內只讀檔一次，資料夾變動時自動重新載入
+    with perf.timed(timer, "templates"):
+        template_groups = detector.get_template_bank(ICON_DIR).groups
     if not template_groups:
-        return [[], [], []]
+        return []
 
     # 3. 比對流程
-    detected_results = [set(), set(), set()]
-    
-    # 定義三個區域 (左/中/右)
-    col_w = img_target.shape[1] // 3
-    
-    # 建立 ROI (Region of Interest)
-    # 格式: (影像切片, 結果索引)
-    rois = [
-        (img_target[:, 0:col_w], 0),           # 左
-        (img_target[:, col_w:col_w*2], 1),     # 中
-        (img_target[:, col_w*2:], 2)           # 右
-    ]
-
     progress_bar = st.progress(0, text="正在分析選取區域 (100% 原圖)...")
-    total_types = len(template_groups)
-    current_step = 0
+    def on_progress(done_jobs, total_jobs, type_name):
+        progress_bar.progress(int(done_jobs / total_jobs * 100), text=f"比對: {type_name}")
 
-    for type_name, templ_list in template_groups.items():
-        current_step += 1
-        progress_bar.progress(int(current_step / total_types * 100), text=f"比對: {type_name}")
-
-        for templ in templ_list:
-            # 多尺度比對：只做微幅調整 (0.9 ~ 1.1)
-            # 因為範本和截圖都來自同一支手機/螢幕，大小應該極為接近
-            scales = np.linspace(0.9, 1.1, 3) 
-            
-            for scale in scales:
-                t_h, t_w = templ.shape[:2]
-                curr_tw, curr_th = int(t_w * scale), int(t_h * scale)
-                
-                # 範本比目標區域還大就跳過
-                if curr_th > img_target.shape[0] or curr_tw > col_w: continue
-                
-                resized_templ = cv2.resize(templ, (curr_tw, curr_th))
-                
-                # 在三個區域中分別尋找
-                for roi_img, idx in rois:
-                    if curr_tw > roi_img.shape[1] or curr_th > roi_img.shape[0]: continue
-                    
-                    res = cv2.matchTemplate(roi_img, resized_templ, cv2.TM_CCOEFF_NORMED)
-                    if np.max(res) >= 0.70: # 信心門檻
-                        detected_results[idx].add(type_name)
-    
+    hits = detector.detect_icons(img_target, template_groups, mode=mode, workers=DETECT_WORKERS, progress=on_progress, timings=timer,
+                                 features=features, prefilter=prefilter)
     progress_bar.empty()
-    return [list(s) for s in detected_results]
+    return hits
+
+def suggest_crop_box(img_pil, timer=None):
+    """
+    對戰截圖的預設框選範圍 (x, y, w, h) 與來源："remembered" = 同解析度上次成功掃描的框選，
+    "located" = 在整張截圖中自動定位到的圖示列。都沒有時回傳 (None, None)。
+    """
+    import cv2
+    import detector
+    box = detector.get_crop_box_memory(CROP_BOXES).get(img_pil.size)
+    if box: return box, "remembered"
+    groups = detector.get_template_bank(ICON_DIR).groups
+    with perf.timed(timer, "locate"):
+        box = detector.locate_icon_strip(cv2.cvtColor(np.array(img_pil.convert("RGB")), cv2.COLOR_RGB2BGR), groups)
+    return (box, "located") if box else (None, None)
+
+# --- 效能量測 ---
+def record_timings(event, timer, **extra):
+    """保存最近一次 event 的各階段耗時 (效能面板顯示用)，並附加到 PERF_LOG。"""
+    st.session_state['perf_timings'][event] = timer
+    try:
+        perf.append_log(PERF_LOG, timer.to_record(event, **extra))
+    except OSError:
+        pass # 紀錄失敗不影響主要功能
+
+def render_perf_panel():
+    """側邊欄的效能面板：顯示本 session 最近一次掃描/計算的各階段耗時。"""
+    if not st.sidebar.toggle("⏱️ 效能面板", key="perf_panel"): return
+    if not st.session_state['perf_timings']:
+        st.sidebar.caption("尚無紀錄 (執行掃描或計算隊伍後顯示)")
+        return
+    import pandas as pd
+    depth = None if st.sidebar.checkbox("顯示每個範本", key="perf_detail") else 2
+    for event, timer in st.session_state['perf_timings'].items():
+        st.sidebar.markdown(f"**{event}**")
+        st.sidebar.dataframe(pd.DataFrame(timer.rows(max_depth=depth)), hide_index=True, use_container_width=True)
 
 # --- 4. 初始化 Session State ---
-if 'inventory' not in st.session_state:
-    st.session_state['inventory'] = load_db()
+try:
+    sync_inventory()
+except Exception as e:
+    st.error(f"讀取資料庫失敗: {e}")
+    st.session_state.setdefault('inventory', storage.CardList())
+    st.session_state.setdefault('inventory_version', None)
 if 'uploader_key' not in st.session_state:
     st.session_state['uploader_key'] = 0
 if 'last_battle_img' not in st.session_state:
     st.session_state['last_battle_img'] = None
+if 'last_scan_hits' not in st.session_state:
+    st.session_state['last_scan_hits'] = []
+if 'crop_suggestion' not in st.session_state:
+    st.session_state['crop_suggestion'] = {}
+if 'perf_timings' not in st.session_state:
+    st.session_state['perf_timings'] = {}
+if 'ingest_batches' not in st.session_state:
+    st.session_state['ingest_batches'] = []
 
 # 初始化預設值
 defaults = {
@@ -161,6 +316,7 @@ defaults = {
     "edit_tag_input": "無", "edit_t1_input": "一般", "edit_t2_input": "無", "edit_m1_name_input": "",
     "edit_m1_type_input": "一般", "edit_m1_cat_input": "攻擊", "edit_m2_name_input": "",
     "edit_m2_type_input": "一般", "edit_m2_cat_input": "攻擊", "manage_sub_mode": "➕ 新增卡片",
+    "detect_mode": "roi", "detect_features": "bgr", "detect_prefilter": False, "detect_compare": False, "auto_scan": True, "team_top_k": 1,
     "battle_config": [
         {"name": "對手 1 (左)", "manual_t1": "無", "manual_t2": "無", "detected_weakness": []},
         {"name": "對手 2 (中)", "manual_t1": "無", "manual_t2": "無", "detected_weakness": []},
@@ -171,38 +327,85 @@ for key, val in defaults.items():
     if key not in st.session_state:
         st.session_state[key] = val
 
-POKEMON_TYPES = ["一般", "火", "水", "草", "電", "冰", "格鬥", "毒", "地面", "飛行", "超能力", "蟲", "岩石", "幽靈", "龍", "惡", "鋼", "妖精", "無"]
-SPECIAL_TAGS = ["無", "Mega進化", "Z招式", "極巨化", "太晶化", "特別聯手對戰", "雙重招式"]
-MOVE_CATEGORIES = ["攻擊", "特攻"]
-
 # --- 5. 頁面功能實作 ---
 
 @st.dialog("卡片影像預覽", width="large")
 def show_card_image_modal(card_name):
     st.subheader(card_name)
     col_img, _ = st.columns([1, 0.1])
-    f_path, b_path = os.path.join(IMG_DIR, f"{card_name}_前.png"), os.path.join(IMG_DIR, f"{card_name}_後.png")
+    # 預設顯示縮小版，需要時才載入原始檔
+    variant = None if st.checkbox("顯示原始解析度", key="modal_full_res") else "preview"
+    f_path, b_path = card_image(card_name, "前", variant), card_image(card_name, "後", variant)
     with col_img:
-        if os.path.exists(f_path): st.image(f_path, caption="正面", use_container_width=True)
+        if f_path: st.image(f_path, caption="正面", use_container_width=True)
         else: st.warning("無正面影像")
-        if os.path.exists(b_path): st.image(b_path, caption="背面", use_container_width=True)
+        if b_path: st.image(b_path, caption="背面", use_container_width=True)
         else: st.warning("無背面影像")
 
+def fill_card_fields(prefix, c):
+    """把卡片 c 的內容填入 prefix ("add"/"edit") 表單的欄位。"""
+    m1, m2 = c.moves[0], c.moves[1]
+    st.session_state.update({
+        f'{prefix}_name_input': c.name, f'{prefix}_attack_input': c.attack, f'{prefix}_sp_attack_input': c.sp_attack,
+        f'{prefix}_tag_input': c.tag_name, f'{prefix}_t1_input': c.type_name, f'{prefix}_t2_input': c.type2_name,
+        f'{prefix}_m1_name_input': m1.name, f'{prefix}_m1_type_input': m1.type_name, f'{prefix}_m1_cat_input': m1.category_name or '攻擊',
+        f'{prefix}_m2_name_input': m2.name, f'{prefix}_m2_type_input': m2.type_name, f'{prefix}_m2_cat_input': m2.category_name or '攻擊'
+    })
+
 def fill_edit_fields():
     if not st.session_state['inventory']: return
     idx = st.session_state.get('edit_select_index', 0)
     if idx >= len(st.session_state['inventory']): idx = 0
-    c = st.session_state['inventory'][idx]
-    st.session_state.update({
-        'edit_name_input': c['name'], 'edit_attack_input': c.get('attack', 100), 'edit_sp_attack_input': c.get('sp_attack', 100),
-        'edit_tag_input': c['tag'], 'edit_t1_input': c['type'], 'edit_t2_input': c.get('type2', '無'),
-        'edit_m1_name_input': c['moves'][0]['name'], 'edit_m1_type_input': c['moves'][0]['type'], 'edit_m1_cat_input': c['moves'][0].get('category', '攻擊'),
-        'edit_m2_name_input': c['moves'][1]['name'], 'edit_m2_type_input': c['moves'][1]['type'], 'edit_m2_cat_input': c['moves'][1].get('category', '攻擊')
-    })
+    fill_card_fields("edit", st.session_state['inventory'][idx])
+
+def encoded_inventory():
+    """
+    本 session 卡片清單的編碼 (battle.EncodedInventory)：與共用卡片庫同版本時取用共用編碼的唯讀快照
+    (所有 session 共用一份，卡片變更時由卡片庫增量更新；只在取快照時持有鎖，計算期間其他 session 仍可寫入)，
+    本 session 的清單落後時才臨時建立。
+    """
+    version, enc = get_shared().attached_snapshot("encoded", battle.EncodedInventory)
+    if version == st.session_state['inventory_version']: return enc
+    return battle.EncodedInventory(st.session_state['inventory'])
+
+def inventory_view():
+    """
+    本 session 卡片清單的索引 (cardmodel.InventoryView)：與共用卡片庫同版本時直接共用 (每個版本只建立一次)，
+    本 session 的清單落後時才臨時建立。
+    """
+    view = get_shared().view()
+    if view.cards is st.session_state['inventory']: return view
+    return cardmodel.InventoryView(st.session_state['inventory'])
+
+def inventory_frame(view):
+    """卡片清單的顯示表格 (依版本快取在 view 上，篩選時只取出符合的列)。"""
+    import pandas as pd
+    return pd.DataFrame({
+        "名稱": [c.name for c in view.cards],
+        "數值": [f"{c.attack}/{c.sp_attack}" for c in view.cards],
+        "屬性": [f"{c.type_name}/{c.type2_name}" for c in view.cards],
+        "招式": [f"{c.moves[0].name}/{c.moves[1].name}" for c in view.cards],
+    }, index=pd.RangeIndex(1, len(view.cards) + 1))
+
+def inventory_filters(view):
+    """卡片清單的篩選/搜尋控制項，回傳符合的卡片位置。"""
+    c_q, c_t, c_m, c_g = st.columns([2, 2, 2, 2])
+    text = c_q.text_input("🔍 搜尋名稱/招式", key="inv_filter_text")
+    types = c_t.multiselect("屬性", list(view.by_type), format_func=cardmodel.TYPES.__getitem__, key="inv_filter_types")
+    move_types = c_m.multiselect("招式屬性", list(view.by_move_type), format_func=cardmodel.TYPES.__getitem__, key="inv_filter_move_types")
+    tags = c_g.multiselect("特殊能力", list(view.by_tag), format_func=cardmodel.TAGS.__getitem__, key="inv_filter_tags")
+    ranges = {}
+    for col, (field, label) in zip(st.columns(2), (("attack", "攻擊"), ("sp_attack", "特攻"))):
+        lo, hi = view.bounds(field)
+        if lo >= hi: continue
+        # 範圍隨卡片庫變動時換一個元件，避免保留超出範圍的舊值
+        picked = col.slider(label, lo, hi, (lo, hi), key=f"inv_filter_{field}_{lo}_{hi}")
+        if picked != (lo, hi): ranges[field] = picked
+    return view.filter(text, types, move_types, tags, **ranges)
 
 def common_save(is_new=False):
     key_prefix = "add" if is_new else "edit"
-    card = {
+    card = cardmodel.Card.from_dict({
         "name": st.session_state[f"{key_prefix}_name_input"],
         "attack": st.session_state[f"{key_prefix}_attack_input"],
         "sp_attack": st.session_state[f"{key_prefix}_sp_attack_input"],
@@ -213,29 +416,28 @@ def common_save(is_new=False):
             {"name": st.session_state[f"{key_prefix}_m1_name_input"], "type": st.session_state[f"{key_prefix}_m1_type_input"], "category": st.session_state[f"{key_prefix}_m1_cat_input"]},
             {"name": st.session_state[f"{key_prefix}_m2_name_input"], "type": st.session_state[f"{key_prefix}_m2_type_input"], "category": st.session_state[f"{key_prefix}_m2_cat_input"]}
         ]
-    }
+    })
     if is_new:
-        save_card_images(card['name'])
-        st.session_state['inventory'].append(card)
-        msg = f"✅ 已新增並存檔：{card['name']}"
+        if not save_card("insert", card): return # 沒有寫入時也不匯入圖片 (否則會蓋掉同名卡片的圖)
+        save_card_images(card.name)
+        msg = f"✅ 已新增並存檔：{card.name}"
         st.session_state.update({k: v for k, v in defaults.items() if k.startswith("add_")})
         st.session_state['uploader_key'] += 1
     else:
         idx = st.session_state['edit_select_index']
-        st.session_state['inventory'][idx] = card
-        msg = f"✅ 已更新並存檔：{card['name']}"
-    
-    sort_inventory(st.session_state['inventory'])
-    save_db(st.session_state['inventory'])
+        if idx >= len(st.session_state['inventory']) or not save_card("update", st.session_state['inventory'][idx], card): return
+        # 依名稱排序後位置可能改變，讓選擇跟著這張卡片 (存檔後隨即被其他使用者修改/刪除時改選第一張)
+        st.session_state['edit_select_index'] = next((i for i, c in enumerate(st.session_state['inventory']) if c is card), 0)
+        msg = f"✅ 已更新並存檔：{card.name}"
     st.session_state['msg_area'] = msg
     if not is_new: fill_edit_fields()
 
 def delete_card_callback():
     idx = st.session_state['edit_select_index']
     if idx < len(st.session_state['inventory']):
-        removed = st.session_state['inventory'].pop(idx)
-        save_db(st.session_state['inventory'])
-        st.session_state['msg_area'] = f"🗑️ 已刪除：{removed['name']}"
+        removed = st.session_state['inventory'][idx]
+        if not save_card("delete", removed): return
+        st.session_state['msg_area'] = f"🗑️ 已刪除：{removed.name}"
         st.session_state['edit_select_index'] = 0
         fill_edit_fields()
 
@@ -248,11 +450,13 @@ def page_template_creator():
     uploaded_file = st.file_uploader("上傳含有屬性圖示的照片", type=["jpg", "png", "jpeg"], key="template_uploader")
     
     if uploaded_file:
-        img = Image.open(uploaded_file)
+        import cv2
+        import detector
+        proxy = crop_proxy(uploaded_file, "template")
         st.markdown("👇 **直接在下方圖片上用滑鼠拖曳框選一個圖示：**")
         
-        # aspect_ratio=None 允許自由調整長寬
-        cropped_img = st_cropper(img, realtime_update=True, box_color='#FF0000', aspect_ratio=None, key="cropper")
+        # 框選在縮小影像上進行，裁切結果仍取自原圖
+        cropped_img, _ = crop_on_proxy(proxy, key=f"cropper_{uploaded_file.file_id}")
         
         st.markdown("---")
         col_preview, col_save = st.columns([1, 2])
@@ -262,9 +466,18 @@ def page_template_creator():
             
         with col_save:
             icon_type = st.selectbox("這是什麼屬性？", POKEMON_TYPES, key="icon_type_selector")
-            if st.button("💾 儲存此範本"):
+            # 與現有範本幾乎相同時提醒 (重複的範本只會讓掃描變慢)
+            dups = []
+            if cropped_img and min(cropped_img.size) > 1:
+                dups = detector.find_near_duplicates(cv2.cvtColor(np.array(cropped_img), cv2.COLOR_RGB2BGR), detector.get_template_bank(ICON_DIR).groups)
+            if dups:
+                t, fn, score = dups[0]
+                note = "" if t == icon_type else f"，但屬性是「{t}」，請確認是否選錯屬性"
+                st.warning(f"⚠️ 與現有範本 {fn} 幾乎相同 (相似度 {score:.2f}，共 {len(dups)} 個){note}。")
+                force = st.checkbox("仍要儲存", key="template_force_save")
+            if st.button("💾 儲存此範本", disabled=bool(dups) and not force):
                 if cropped_img:
-                    timestamp = int(pd.Timestamp.now().timestamp())
+                    timestamp = int(time.time())
                     save_name = f"{icon_type}_{timestamp}.png"
                     save_path = os.path.join(ICON_DIR, save_name)
                     
@@ -272,6 +485,7 @@ def page_template_creator():
                     img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
                     
                     cv2.imwrite(save_path, img_bgr)
+                    detector.get_template_bank(ICON_DIR).invalidate()
                     st.success(f"✅ 已儲存範本：{save_name}")
                 else:
                     st.error("裁切無效")
@@ -285,26 +499,98 @@ def page_template_creator():
             img_files = [f for f in files if f.endswith(".png")]
             if img_files:
                 st.write(f"總計 {len(img_files)} 個範本。")
+                template_compaction()
                 cols = st.columns(8)
                 for i, f in enumerate(img_files):
                     with cols[i % 8]:
                         st.image(os.path.join(ICON_DIR, f), caption=f.split("_")[0])
                         if st.button("🗑️", key=f"del_{f}"):
                             os.remove(os.path.join(ICON_DIR, f))
+                            import detector
+                            detector.get_template_bank(ICON_DIR).invalidate()
                             st.rerun() 
             else:
                 st.info("資料夾內無 PNG 圖片。")
         else:
             st.info("目前沒有範本。")
 
+def template_compaction():
+    """範本整理：同屬性中幾乎相同的範本只保留代表，其餘移到 _archive (不影響召回率)。"""
+    import detector
+    with st.expander("🧹 範本整理 (去除重複範本)"):
+        st.caption("同屬性的範本依相似度分群，每群只保留代表；若有範本只靠被移除的範本才偵測得到，會自動加回保留。")
+        threshold = st.slider("視為重複的相似度", 0.80, 0.99, detector.DUPLICATE_THRESHOLD, 0.01, key="compact_threshold")
+        if st.button("🔍 分析", key="compact_plan"):
+            with st.spinner("分析中..."):
+                st.session_state['compaction_plan'] = detector.plan_compaction(detector.get_template_bank(ICON_DIR).groups, threshold)
+        plan = st.session_state.get('compaction_plan')
+        if not plan: return
+        import pandas as pd
+        removable = sum(len(v['remove']) for v in plan.values())
+        st.dataframe(pd.DataFrame([{
+            "屬性": t, "範本數": len(v['keep']) + len(v['remove']), "保留": len(v['keep']), "移除": "、".join(v['remove'])
+        } for t, v in plan.items() if v['remove']]), use_container_width=True, hide_index=True)
+        if not removable: st.info("沒有可移除的重複範本。"); return
+        if st.button(f"🧹 移除 {removable} 個重複範本 (移到 {ICON_DIR}/_archive)", type="primary", key="compact_apply"):
+            moved = detector.apply_compaction(ICON_DIR, plan)
+            detector.get_template_bank(ICON_DIR).invalidate()
+            st.session_state['compaction_plan'] = None
+            st.toast(f"🧹 已移除 {moved} 個範本", icon="✅")
+            st.rerun()
+
 # --- Page 2: Manage Cards ---
+def bulk_image_import():
+    """一次匯入多張卡片圖片 (多檔上傳或本機資料夾)，依檔名對應卡片，在背景處理。"""
+    st.caption("檔名格式：名稱_前.png / 名稱_後.png (也接受 _front / _back，未標示時視為正面)。圖片在背景處理，可繼續操作其他功能。")
+    key = st.session_state['uploader_key']
+    files = st.file_uploader("選擇圖片 (可多選)", type=["jpg", "jpeg", "png", "webp"], accept_multiple_files=True, key=f"bulk_images_{key}")
+    folder = st.text_input("或輸入本機資料夾路徑", key="bulk_folder")
+    items = [ingest.IngestItem(*ingest.parse_image_name(f.name), f) for f in files or []]
+    if folder:
+        if os.path.isdir(folder): items += ingest.folder_items(folder)
+        else: st.warning(f"找不到資料夾：{folder}")
+    if not items: return
+    import pandas as pd
+    names = {c.name for c in st.session_state['inventory']}
+    st.dataframe(pd.DataFrame([{
+        "卡片": i.name, "面": i.side, "來源": os.path.basename(getattr(i.source, "name", i.source)),
+        "資料庫": "✅" if i.name in names else "尚無卡片資料"
+    } for i in items]), use_container_width=True, hide_index=True)
+    if st.button(f"📥 匯入 {len(items)} 張圖片", type="primary", key="bulk_start"):
+        start_ingest(items)
+        st.session_state['uploader_key'] += 1
+        st.rerun()
+
 def page_manage_cards():
     st.header("🗃️ 卡片資料庫管理")
     st.sidebar.markdown("---")
     if st.sidebar.button("手動強制存檔", type="secondary"): save_db(st.session_state['inventory'])
+    with st.sidebar.expander("JSON 匯入/匯出"):
+        if st.button("📤 寫出 mezastar_db.json", use_container_width=True):
+            try:
+                get_store().export_json(DB_FILE)
+                st.success(f"已寫出 {DB_FILE}")
+            except Exception as e:
+                st.error(f"匯出失敗: {e}")
+        st.download_button("⬇️ 下載 JSON", json.dumps([c.to_dict() for c in st.session_state['inventory']], ensure_ascii=False, indent=4),
+                           file_name=DB_FILE, mime="application/json", use_container_width=True)
+        imported = st.file_uploader("匯入 JSON (會取代目前資料)", type=["json"], key="db_import")
+        if imported and st.button("📥 確認匯入", use_container_width=True):
+            try:
+                sync_inventory(own_version=get_shared().replace_all(json.load(imported)))
+                st.session_state['edit_select_index'] = 0
+                st.success("匯入完成")
+            except Exception as e:
+                st.error(f"匯入失敗: {e}")
     if st.session_state['msg_area']: st.success(st.session_state['msg_area']); st.session_state['msg_area'] = ""
+    if st.session_state['ingest_batches']: ingest_progress()
+    report = st.session_state.pop('ingest_report', None)
+    if report:
+        stored, errors = report
+        if stored: st.success(f"🖼️ 已匯入 {stored} 張圖片")
+        for name, side, err in errors: st.error(f"圖片匯入失敗：{name}_{side} ({err})")
     
-    sub = st.radio("功能", ["➕ 新增卡片", "✏️ 編輯與刪除"], horizontal=True, key="manage_sub_mode")
+    sub = st.radio("功能", ["➕ 新增卡片", "✏️ 編輯與刪除", "📦 批次匯入圖片"], horizontal=True, key="manage_sub_mode")
     st.markdown("---")
     
     if sub == "➕ 新增卡片":
@@ -319,6 +605,16 @@ def page_manage_cards():
                     n = os.path.splitext(f.name)[0].replace("_前", "").replace("_front", "")
                     st.session_state['add_name_input'] = n
                     st.session_state['last_p'] = f.name
+                    st.session_state['card_matches'] = identify_card(f)
+                # 影像索引找到的已知卡片：重複上傳時提醒，否則可一鍵套用該卡片的資料
+                for m in st.session_state.get('card_matches', []):
+                    known = next((c for c in st.session_state['inventory'] if c.name == m.name), None)
+                    if m.duplicate:
+                        st.warning(f"⚠️ 與「{m.name}」的正面圖幾乎相同，可能是重複上傳。")
+                    else:
+                        st.caption(f"🔍 看起來是「{m.name}」(相符特徵點 {m.inliers})")
+                    if known:
+                        st.button(f"📋 套用「{m.name}」的資料", key=f"apply_match_{m.name}", on_click=fill_card_fields, args=("add", known))
             if b: st.image(b, caption="背面預覽", use_container_width=True)
         with c2:
             with st.form("add"):
@@ -341,11 +637,13 @@ def page_manage_cards():
                 m2c.selectbox("分類", MOVE_CATEGORIES, key="add_m2_cat_input")
                 st.form_submit_button("💾 新增並存檔", type="primary", on_click=lambda: common_save(True))
 
+    elif sub == "📦 批次匯入圖片":
+        bulk_image_import()
+
     else: # Edit
         if not st.session_state['inventory']: st.info("無資料"); return
-        sort_inventory(st.session_state['inventory'])
-        opts = [f"{i+1}. {c['name']}" for i, c in enumerate(st.session_state['inventory'])]
-        st.selectbox("選擇卡片", range(len(opts)), format_func=lambda x: opts[x], key="edit_select_index", on_change=fill_edit_fields)
+        labels = inventory_view().labels
+        st.selectbox("選擇卡片", range(len(labels)), format_func=labels.__getitem__, key="edit_select_index", on_change=fill_edit_fields)
         if not st.session_state['edit_name_input']: fill_edit_fields()
         
         c1, c2 = st.columns([3, 1])
@@ -373,51 +671,91 @@ def page_manage_cards():
             st.button("🗑️ 刪除", type="secondary", on_click=delete_card_callback)
             cn = st.session_state['edit_name_input']
             if cn:
-                fp, bp = os.path.join(IMG_DIR, f"{cn}_前.png"), os.path.join(IMG_DIR, f"{cn}_後.png")
-                if os.path.exists(fp): st.image(fp, caption="正")
-                if os.path.exists(bp): st.image(bp, caption="背")
+                fp, bp = card_image(cn, "前", "thumb"), card_image(cn, "後", "thumb")
+                if fp: st.image(fp, caption="正")
+                if bp: st.image(bp, caption="背")
 
     if st.session_state['inventory']:
         st.markdown("---")
-        with st.expander("資料庫清單", expanded=True):
-            df = pd.DataFrame([{
-                "名稱": i['name'], "數值": f"{i.get('attack')}/{i.get('sp_attack')}", "屬性": f"{i['type']}/{i.get('type2','無')}",
-                "招式": f"{i['moves'][0]['name']}/{i['moves'][1]['name']}"
-            } for i in st.session_state['inventory']])
-            df.index += 1
-            ev = st.dataframe(df, use_container_width=True, on_select="rerun", selection_mode="single-row")
-            if len(ev.selection.rows): show_card_image_modal(st.session_state['inventory'][ev.selection.rows[0]]['name'])
+        inventory_list()
+
+@st.fragment
+def inventory_list():
+    """資料庫清單。篩選、搜尋與點選只重新執行這一區，不會重畫上方的表單與圖片。"""
+    with st.expander("資料庫清單", expanded=True):
+        # 表格與索引每個卡片庫版本只建立一次，篩選只取出符合的列
+        view = inventory_view()
+        pos = inventory_filters(view)
+        df = view.memo("frame", inventory_frame)
+        if len(pos) < len(view): df = df.iloc[pos]; st.caption(f"符合 {len(pos)} / {len(view)} 張")
+        ev = st.dataframe(df, use_container_width=True, on_select="rerun", selection_mode="single-row")
+        if len(ev.selection.rows): show_card_image_modal(view.cards[pos[ev.selection.rows[0]]].name)
 
 # --- Page 3: Battle Analysis ---
-TYPE_CHART = {
-    "一般": {"岩石": 0.5, "幽靈": 0, "鋼": 0.5},
-    "火": {"草": 2, "冰": 2, "蟲": 2, "鋼": 2, "水": 0.5, "火": 0.5, "岩石": 0.5, "龍": 0.5},
-    "水": {"火": 2, "地面": 2, "岩石": 2, "水": 0.5, "草": 0.5, "龍": 0.5},
-    "電": {"水": 2, "飛行": 2, "地面": 0, "電": 0.5, "草": 0.5, "龍": 0.5},
-    "草": {"水": 2, "地面": 2, "岩石": 2, "火": 0.5, "草": 0.5, "毒": 0.5, "飛行": 0.5, "蟲": 0.5, "龍": 0.5, "鋼": 0.5},
-    "冰": {"草": 2, "地面": 2, "飛行": 2, "龍": 2, "火": 0.5, "冰": 0.5, "鋼": 0.5, "水": 0.5},
-    "格鬥": {"一般": 2, "冰": 2, "岩石": 2, "惡": 2, "鋼": 2, "幽靈": 0, "毒": 0.5, "飛行": 0.5, "超能力": 0.5, "蟲": 0.5, "妖精": 0.5},
-    "毒": {"草": 2, "妖精": 2, "毒": 0.5, "地面": 0.5, "幽靈": 0.5, "岩石": 0.5, "鋼": 0},
-    "地面": {"火": 2, "電": 2, "毒": 2, "岩石": 2, "鋼": 2, "飛行": 0, "草": 0.5, "蟲": 0.5},
-    "飛行": {"草": 2, "格鬥": 2, "蟲": 2, "電": 0.5, "岩石": 0.5, "鋼": 0.5},
-    "超能力": {"格鬥": 2, "毒": 2, "超能力": 0.5, "惡": 0, "鋼": 0.5},
-    "蟲": {"草": 2, "超能力": 2, "惡": 2, "火": 0.5, "飛行": 0.5, "幽靈": 0.5, "格鬥": 0.5, "毒": 0.5, "鋼": 0.5, "妖精": 0.5},
-    "岩石": {"火": 2, "冰": 2, "飛行": 2, "蟲": 2, "格鬥": 0.5, "地面": 0.5, "鋼": 0.5},
-    "幽靈": {"超能力": 2, "幽靈": 2, "一般": 0, "惡": 0.5},
-    "龍": {"龍": 2, "鋼": 0.5, "妖精": 0},
-    "惡": {"幽靈": 2, "超能力": 2, "格鬥": 0.5, "妖精": 0.5, "惡": 0.5},
-    "鋼": {"冰": 2, "岩石": 2, "妖精": 2, "火": 0.5, "水": 0.5, "電": 0.5, "鋼": 0.5},
-    "妖精": {"格鬥": 2, "龍": 2, "惡": 2, "毒": 0.5, "鋼": 0.5, "火": 0.5}
-}
+def apply_video_event(event):
+    """把時間軸上某個時間點的偵測結果套用到對手設定。"""
+    for i, weak in enumerate(event['detected']):
+        st.session_state['battle_config'][i]['detected_weakness'] = weak
+    st.session_state['last_scan_hits'] = []
 
-def get_effectiveness(atk, deff):
-    if deff == "無" or atk == "無": return 1.0
-    return TYPE_CHART.get(atk, {}).get(deff, 1.0)
+def battle_video_timeline():
+    """
+    對戰錄影：逐格讀取 (只在圖示列換了新內容時辨識)，列出有利屬性與推薦隊伍的時間軸，
+    可把任一時間點套用到下方的對手設定。框選範圍沿用同解析度記住的紅框，否則自動定位。
+    """
+    vf = st.file_uploader("對戰錄影", type=["mp4", "mov", "avi", "mkv", "webm"], key="battle_video")
+    if not vf: return
+    import detector
+    import videoscan
+    if st.button("🎞️ 掃描影片", key="video_scan"):
+        # OpenCV 只能讀檔案，先把上傳的影片寫到暫存檔
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(vf.name)[1], delete=False) as tmp:
+            vf.seek(0)
+            shutil.copyfileobj(vf, tmp)
+        timer = perf.StageTimer()
+        bar = st.progress(0, text="掃描影片中...")
+        def on_progress(t, duration):
+            if duration: bar.progress(min(1.0, t / duration), text=f"掃描影片中... {videoscan.format_time(t)} / {videoscan.format_time(duration)}")
+        try:
+            size = videoscan.video_size(tmp.name)
+            box = detector.get_crop_box_memory(CROP_BOXES).get(size) if size else None
+            # 影片可能很長，使用本 session 清單建立的編碼，避免長時間占用共用卡片庫的鎖
+            table = battle.EncodedInventory(st.session_state['inventory'])
+            config = {"mode": st.session_state['detect_mode'], "features": st.session_state['detect_features'],
+                      "prefilter": st.session_state['detect_prefilter']}
+            stats = {}
+            events = list(videoscan.scan_video(tmp.name, detector.get_template_bank(ICON_DIR).groups, table, box=box, detect_config=config,
+                                               workers=DETECT_WORKERS, progress=on_progress, timings=timer, stats=stats))
+            st.session_state['video_timeline'] = {"file": vf.file_id, "events": events, "stats": stats}
+            record_timings("影片掃描", timer, **stats)
+        except OSError as e:
+            st.error(f"無法讀取影片: {e}")
+        finally:
+            bar.empty()
+            os.remove(tmp.name)
+
+    timeline = st.session_state.get('video_timeline')
+    if not timeline or timeline['file'] != vf.file_id: return
+    events, stats = timeline['events'], timeline['stats']
+    st.caption(f"共 {stats['frames']} 格，取樣 {stats['samples']} 次，圖示列變化後辨識 {stats['analyzed']} 次。")
+    if not events: st.warning("⚠️ 影片中沒有找到屬性圖示列。可先用截圖框選一次同解析度的紅框後再掃描。"); return
+    import pandas as pd
+    ev = st.dataframe(pd.DataFrame([{
+        "時間": videoscan.format_time(e['t']),
+        **{f"對手 {i + 1}": "/".join(d) or "-" for i, d in enumerate(e['detected'])},
+        "推薦陣容": " / ".join(f"{m['name']} [{m['move']}]" for m in e['teams'][0]['members']) if e['teams'] else "-",
+        "總分": round(e['teams'][0]['score'], 1) if e['teams'] else None,
+    } for e in events]), use_container_width=True, hide_index=True, on_select="rerun", selection_mode="single-row", key="video_timeline_table")
+    if len(ev.selection.rows):
+        event = events[ev.selection.rows[0]]
+        st.button(f"📋 套用 {videoscan.format_time(event['t'])} 的有利屬性到對手設定", key="video_apply", on_click=apply_video_event, args=(event,))
 
 def page_battle():
     st.header("⚔️ 對戰分析 (3 vs 3)")
     st.info("請上傳螢幕截圖，並使用紅框選取「整排有利屬性圖示」，程式會自動將其切分為 左/中/右 進行掃描。")
     st.caption("提示：程式會使用原圖解析度進行比對，請確保「圖示範本」也是從原圖截取的。")
+    with st.expander("🎞️ 分析對戰錄影"):
+        battle_video_timeline()
     
     # 1. 圖片上傳與裁切區域 (全寬顯示)
     bf = st.file_uploader("對戰截圖", type=["jpg", "png"], key="battle_uploader")
@@ -427,22 +765,35 @@ def page_battle():
     if current_file_name != st.session_state.get('last_battle_img', ""):
         for i in range(3):
             st.session_state['battle_config'][i]['detected_weakness'] = []
+        st.session_state['last_scan_hits'] = []
         st.session_state['last_battle_img'] = current_file_name
 
     cropped_result = None
+    scan_timer = perf.StageTimer()
     if bf:
-        img_file = Image.open(bf)
+        import cv2
+        import detector
+        with scan_timer.stage("upload"):
+            proxy = crop_proxy(bf, "battle")
+            img_file = proxy.original
+        # 每張截圖只定位一次：同解析度記住的框選優先，否則自動找出圖示列
+        suggestion = st.session_state['crop_suggestion']
+        if suggestion.get('file') != bf.file_id:
+            box, source = suggest_crop_box(img_file, timer=scan_timer)
+            suggestion = st.session_state['crop_suggestion'] = {"file": bf.file_id, "box": box, "source": source, "scanned": False}
+        box = suggestion['box']
+
         st.markdown("### 1. 截取屬性區域")
-        st.markdown("👇 **請用滑鼠調整紅框，使其包住三個對手的有利屬性區域：**")
+        if suggestion['source'] == "remembered":
+            st.markdown("📌 **已套用此解析度上次使用的紅框，必要時再用滑鼠調整：**")
+        elif suggestion['source'] == "located":
+            st.markdown("🎯 **已自動框出屬性圖示列，必要時再用滑鼠調整：**")
+        else:
+            st.markdown("👇 **請用滑鼠調整紅框，使其包住三個對手的有利屬性區域：**")
         
-        # 使用 st_cropper 讓使用者選擇範圍
-        cropped_box_img = st_cropper(
-            img_file, 
-            realtime_update=True, 
-            box_color='#FF0000', 
-            aspect_ratio=None,
-            key="battle_cropper"
-        )
+        # 在縮小影像上框選，裁切結果取自原圖 (每張截圖各自一個元件，才會套用新的預設紅框)
+        with scan_timer.stage("crop"):
+            cropped_box_img, crop_rect = crop_on_proxy(proxy, key=f"battle_cropper_{bf.file_id}", box=box)
         
         if cropped_box_img:
             # 轉 BGR
@@ -467,17 +818,56 @@ def page_battle():
                 
                 st.image(cv2.cvtColor(preview_img_small, cv2.COLOR_BGR2RGB), caption="系統將會這樣分割 (預覽)", use_container_width=True)
             
-            if st.button("📸 掃描此區域", type="primary", use_container_width=True):
+            c_mode, c_cmp = st.columns([3, 1])
+            c_mode.radio("比對模式", list(detector.DETECT_MODES), format_func=lambda m: detector.DETECT_MODES[m], horizontal=True, key="detect_mode")
+            c_mode.radio("比對特徵", list(detector.MATCH_FEATURES), format_func=lambda f: detector.MATCH_FEATURES[f], horizontal=True, key="detect_features",
+                         help="灰階/邊緣較快但較容易誤判，建議搭配色相預篩")
+            c_cmp.checkbox("🎨 色相預篩", key="detect_prefilter", help="先排除畫面中沒有該屬性顏色的圖示，再進行比對")
+            c_cmp.checkbox("⏱️ 與原始搜尋比較", key="detect_compare", help="額外執行原始三區完整搜尋，比較耗時與結果是否一致")
+            c_cmp.checkbox("⚡ 上傳後自動掃描", key="auto_scan", help="有預設紅框 (記住的或自動定位的) 時，上傳後直接掃描")
+            detect_config = {"mode": st.session_state['detect_mode'], "features": st.session_state['detect_features'], "prefilter": st.session_state['detect_prefilter']}
+            auto_scan = st.session_state['auto_scan'] and box is not None and not suggestion['scanned']
+            if st.button("📸 掃描此區域", type="primary", use_container_width=True) or auto_scan:
+                suggestion['scanned'] = True
                 # 呼叫新的裁切辨識函式 (傳入的是 PIL 格式的裁切圖，函式內會用原圖解析度)
-                detected = detect_attribute_icons_from_crop(cropped_box_img) 
+                hits = detect_attribute_icons_from_crop(cropped_box_img, timer=scan_timer, **detect_config)
+                record_timings("掃描", scan_timer, **detect_config, size=list(cropped_box_img.size), hits=len(hits))
+                detected = detector.hits_to_columns(hits)
                 for i in range(3):
                     st.session_state['battle_config'][i]['detected_weakness'] = detected[i]
+                st.session_state['last_scan_hits'] = hits
+                if any(detected): # 記住這次成功的框選，下次同解析度的截圖直接套用
+                    detector.get_crop_box_memory(CROP_BOXES).put(img_file.size, crop_rect)
+
+                if st.session_state['detect_compare']:
+                    import pandas as pd
+                    groups = detector.get_template_bank(ICON_DIR).groups
+                    report = detector.compare_modes(cropped_result, groups, modes=("roi", detect_config), workers=DETECT_WORKERS)
+                    st.dataframe(pd.DataFrame([{
+                        "模式": r['label'], "耗時 (秒)": round(r['seconds'], 3),
+                        "左": "/".join(r['columns'][0]), "中": "/".join(r['columns'][1]), "右": "/".join(r['columns'][2]),
+                        "Precision": round(r['precision'], 3), "Recall": round(r['recall'], 3)
+                    } for r in report]), use_container_width=True, hide_index=True)
                 
                 if not any(detected):
                     st.warning("⚠️ 未偵測到圖示。請檢查範本是否已建立，或是紅框是否準確。")
                 else:
                     st.success("掃描完成！")
 
+            # 標示命中位置 (綠框 + 分數)
+            if st.session_state['last_scan_hits']:
+                annotated = cropped_result.copy()
+                for hit in st.session_state['last_scan_hits']:
+                    x, y, w, h = hit.box
+                    cv2.rectangle(annotated, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                    cv2.putText(annotated, f"{hit.score:.2f}", (x, max(12, y - 4)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+                st.image(cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB), caption="命中位置 (分數)", use_container_width=True)
+
+    battle_teams()
+
+@st.fragment
+def battle_teams():
+    """對手設定與隊伍計算。調整對手屬性或計算時只重新執行這一區 (不重畫截圖、紅框與影片時間軸)。"""
     st.markdown("---")
     st.markdown("### 2. 對手資訊設定")
     
@@ -506,102 +896,25 @@ def page_battle():
     st.markdown("---")
     
     # 3. 計算按鈕與結果
+    st.number_input("列出前幾組最佳隊伍", min_value=1, max_value=10, step=1, key="team_top_k")
     if st.button("🚀 計算最佳隊伍", type="primary", use_container_width=True):
         if not st.session_state['inventory']: st.error("無卡片資料"); return
         
-        is_manual_mode = False
-        for i in range(3):
-            if cfg[i]['manual_t1'] != "無" or cfg[i]['manual_t2'] != "無":
-                is_manual_mode = True
-                break
+        is_manual_mode = battle.is_manual_mode(cfg)
         
         mode_text = "手動屬性優先模式" if is_manual_mode else "自動偵測有利屬性模式"
         st.info(f"💡 目前使用：**{mode_text}**")
         
-        cands = []
-        for card in st.session_state['inventory']:
-            atk_v = card.get('attack', 100)
-            sp_atk_v = card.get('sp_attack', 100)
-            
-            # Mode A: Special
-            max_dmg_s = 0
-            best_move_s = ""
-            for idx, m in enumerate(card['moves']):
-                if not m['name']: continue
-                eff_total = 0
-                for i in range(3):
-                    if is_manual_mode:
-                        eff = get_effectiveness(m['type'], cfg[i]['manual_t1']) * get_effectiveness(m['type'], cfg[i]['manual_t2'])
-                    else:
-                        if m['type'] in cfg[i]['detected_weakness']:
-                            eff = 2.5
-                        else:
-                            eff = 1.0
-                    
-                    eff_total += eff
-                
-                base = atk_v if m.get('category') == '攻擊' else sp_atk_v
-                mult = 1.2 if idx == 1 else 1.0
-                dmg = base * mult * eff_total
-                if dmg > max_dmg_s:
-                    max_dmg_s = dmg
-                    best_move_s = f"{m['name']}({m['type']})"
-            
-            score_s = max_dmg_s
-            tag = card['tag']
-            if tag in ["極巨化", "Z招式"]: score_s *= 1.3
-            elif tag != "無": score_s *= 1.15
-            
-            cands.append({
-                "name": card['name'], 
-                "mode": "special", 
-                "tag": tag, 
-                "original_tag": tag,
-                "move": best_move_s, 
-                "score": score_s, 
-                "dmg": max_dmg_s
-            })
-
-            # Mode B: Normal
-            if tag != "無":
-                m = card['moves'][0] # Force 1st move
-                if m['name']:
-                    eff_total = 0
-                    for i in range(3):
-                        if is_manual_mode:
-                            eff = get_effectiveness(m['type'], cfg[i]['manual_t1']) * get_effectiveness(m['type'], cfg[i]['manual_t2'])
-                        else:
-                            if m['type'] in cfg[i]['detected_weakness']:
-                                eff = 2.5
-                            else:
-                                eff = 1.0
-                        
-                        eff_total += eff
-                    
-                    base = atk_v if m.get('category') == '攻擊' else sp_atk_v
-                    dmg = base * 1.0 * eff_total
-                    
-                    cands.append({
-                        "name": card['name'], 
-                        "mode": "normal", 
-                        "tag": "無", 
-                        "original_tag": tag, 
-                        "move": f"{m['name']}({m['type']})", 
-                        "score": dmg, 
-                        "dmg": dmg
-                    })
-
-        cands.sort(key=lambda x: x['score'], reverse=True)
-        
-        team, used_names, used_tags = [], set(), set()
-        for c in cands:
-            if len(team) >= 3: break
-            if c['name'] in used_names: continue
-            if c['tag'] != "無" and c['tag'] in used_tags: continue
-            
-            team.append(c)
-            used_names.add(c['name'])
-            if c['tag'] != "無": used_tags.add(c['tag'])
+        # 使用預先編碼好的卡片庫，一次算完所有卡片的 special / normal 候選 (結果與逐張計算相同)
+        calc_timer = perf.StageTimer()
+        table = encoded_inventory()
+        with calc_timer.stage("score"):
+            cands = battle.score_candidates(table, cfg, manual=is_manual_mode)
+        # 精確求解 (branch-and-bound)，取代逐一貪婪挑選
+        with calc_timer.stage("solve"):
+            teams, nodes = battle.solve_teams(cands, size=3, top_k=st.session_state['team_top_k'])
+        record_timings("計算隊伍", calc_timer, cards=len(st.session_state['inventory']), candidates=len(cands), nodes=nodes, manual=is_manual_mode)
+        team = teams[0]['members'] if teams else []
             
         st.subheader("🏆 推薦出戰陣容")
         cols = st.columns(3)
@@ -620,8 +933,134 @@ def page_battle():
                 
                 st.success(f"**第 {i+1} 棒**\n\n### {p['name']}\n* **模式**: {t_txt}\n* **建議**: {p['move']}\n* **預估火力**: {int(p['dmg'])}")
 
+        st.caption(f"精確搜尋：共檢查 {nodes} 個節點")
+        if len(teams) > 1:
+            with st.expander(f"其他高分組合 (前 {len(teams)} 名)"):
+                import pandas as pd
+                st.dataframe(pd.DataFrame([{
+                    "名次": rank, "總分": round(t['score'], 1),
+                    "陣容": " / ".join(f"{m['name']} [{m['move']}]" for m in t['members'])
+                } for rank, t in enumerate(teams, start=1)]), use_container_width=True, hide_index=True)
+
+# --- Page 4: Coverage Report ---
+def page_coverage():
+    st.header("📊 對戰覆蓋分析 (所有對手陣容)")
+    st.info("一次計算所有可能的對手陣容下，目前卡片庫的最佳隊伍與預估總火力，找出我們打不好的對手組合。")
+    if not st.session_state['inventory']: st.error("無卡片資料"); return
+
+    kind = st.radio("對手設定方式", ["pair", "weakness"], horizontal=True,
+                    format_func=lambda k: "手動雙屬性 (每位對手任意雙屬性)" if k == "pair" else "偵測有利屬性組合")
+    if kind == "pair":
+        types = st.multiselect("納入的屬性", POKEMON_TYPES, default=POKEMON_TYPES)
+        options = battle.defender_pair_options([t for t in POKEMON_TYPES if t in types])
+    else:
+        types = st.multiselect("納入的有利屬性", POKEMON_TYPES[:-1], default=POKEMON_TYPES[:-1])
+        max_size = st.slider("每位對手最多幾個有利屬性", 1, 3, 1)
+        options = battle.weakness_set_options([t for t in POKEMON_TYPES[:-1] if t in types], max_size)
+    same_only = st.checkbox("三位對手使用相同設定", value=False)
+    use_pool = st.checkbox(f"使用多行程計算 ({os.cpu_count()} 核心)", value=False)
+
+    n = len(options)
+    n_lineups = n if same_only else n * (n + 1) * (n + 2) // 6
+    st.caption(f"對手選項 {n} 種，共 {n_lineups:,} 種陣容。")
+
+    if st.button("📊 開始分析", type="primary", use_container_width=True) and n:
+        import pandas as pd
+        start = time.perf_counter()
+        with st.spinner("計算中..."):
+            lineups = battle.enumerate_lineups(n, same_only=same_only)
+            report = battle.coverage_report(encoded_inventory(), options, kind, lineups,
+                                            workers=(os.cpu_count() or 1) if use_pool else 1)
+        elapsed = time.perf_counter() - start
+        st.success(f"完成 {len(lineups):,} 種陣容，耗時 {elapsed:.2f} 秒。")
+
+        df = pd.DataFrame({
+            "對手 1": report['opp1'], "對手 2": report['opp2'], "對手 3": report['opp3'],
+            "預估總火力": report['total_dmg'].round(1), "總分": report['total_score'].round(1),
+            "第 1 棒": report['card1'], "招式 1": report['move1'],
+            "第 2 棒": report['card2'], "招式 2": report['move2'],
+            "第 3 棒": report['card3'], "招式 3": report['move3'],
+        }).sort_values("預估總火力", kind="stable")
+        st.markdown("### 😰 最難應付的 50 種陣容")
+        st.dataframe(df.head(50), use_container_width=True, hide_index=True)
+        st.download_button("⬇️ 匯出完整報告 (CSV)", df.to_csv(index=False).encode("utf-8-sig"),
+                           file_name=f"coverage_{kind}.csv", mime="text/csv")
+
+# --- Page 5: Session Planner ---
+PLAN_OPPONENT_COLUMNS = [(f"對手{k} 屬性1", f"對手{k} 屬性2", f"對手{k} 有利屬性") for k in (1, 2, 3)]
+
+def plan_round_row(cfg):
+    """一場的對手設定 (battle_config 格式) → 規劃表的一列。"""
+    row = {}
+    for (c1, c2, cw), c in zip(PLAN_OPPONENT_COLUMNS, cfg):
+        row.update({c1: c['manual_t1'], c2: c['manual_t2'], cw: "/".join(c['detected_weakness'])})
+    return row
+
+def plan_round_cfg(row):
+    """規劃表的一列 → 一場的對手設定 (有利屬性以 / 分隔，不認得的屬性略過)。"""
+    return [{"manual_t1": row[c1] or "無", "manual_t2": row[c2] or "無",
+             "detected_weakness": [t for t in (t.strip() for t in str(row[cw] or "").replace("、", "/").split("/")) if t in POKEMON_TYPES[:-1]]}
+            for c1, c2, cw in PLAN_OPPONENT_COLUMNS]
+
+def set_plan_rounds(rows):
+    import pandas as pd
+    st.session_state['plan_rounds'] = pd.DataFrame(rows, columns=[c for cols in PLAN_OPPONENT_COLUMNS for c in cols])
+    st.session_state['plan_editor_key'] = st.session_state.get('plan_editor_key', 0) + 1 # 換一個編輯器，才會顯示新的內容
+
+def page_session_planner():
+    import pandas as pd
+    st.header("🗓️ 多場對戰規劃")
+    st.info("一次規劃連續多場對戰的出戰隊伍：每場沿用相同的評分方式，並限制每張卡片與每種特殊能力在整個系列中可使用的次數，讓所有場次的預估總分最高。")
+    if not st.session_state['inventory']: st.error("無卡片資料"); return
+    if 'plan_rounds' not in st.session_state: set_plan_rounds([plan_round_row(defaults['battle_config'])] * 3)
+
+    c_add, c_video, c_clear = st.columns(3)
+    if c_add.button("➕ 加入「對戰分析」目前的對手設定", use_container_width=True):
+        set_plan_rounds(st.session_state['plan_rounds'].to_dict("records") + [plan_round_row(st.session_state['battle_config'])])
+    timeline = st.session_state.get('video_timeline')
+    events = [e for e in (timeline or {}).get('events', []) if any(e['detected'])]
+    if c_video.button(f"🎞️ 從對戰錄影匯入 ({len(events)} 場)", use_container_width=True, disabled=not events):
+        set_plan_rounds([plan_round_row([{"manual_t1": "無", "manual_t2": "無", "detected_weakness": d} for d in e['detected']]) for e in events])
+    if c_clear.button("🗑️ 清空", use_container_width=True): set_plan_rounds([])
+
+    type_col = lambda label: st.column_config.SelectboxColumn(label, options=POKEMON_TYPES, default="無", required=True)
+    edited = st.data_editor(st.session_state['plan_rounds'], num_rows="dynamic", use_container_width=True, key=f"plan_editor_{st.session_state['plan_editor_key']}",
+                            column_config={**{c: type_col(c) for c1, c2, _ in PLAN_OPPONENT_COLUMNS for c in (c1, c2)},
+                                           **{cw: st.column_config.TextColumn(cw, help="偵測到的有利屬性，以 / 分隔 (例如 火/水)") for _, _, cw in PLAN_OPPONENT_COLUMNS}})
+    edited.index = pd.RangeIndex(1, len(edited) + 1)
+    cfgs = [plan_round_cfg(row) for row in edited.to_dict("records")]
+
+    st.markdown("#### 使用限制 (整個系列)")
+    c_limit, c_unlimited = st.columns([3, 1])
+    unlimited = c_unlimited.checkbox("不限次數", key="plan_card_unlimited", help="同一張卡片可以在每一場都出場")
+    card_limit = c_limit.number_input("每張卡片最多出場次數", min_value=1, value=1, step=1, key="plan_card_limit", disabled=unlimited)
+    if unlimited: card_limit = None
+    tag_cols = st.columns(len(SPECIAL_TAGS) - 1)
+    tag_limits = {t: col.number_input(t, min_value=0, value=None, step=1, placeholder="不限", key=f"plan_tag_limit_{t}")
+                  for t, col in zip(SPECIAL_TAGS[1:], tag_cols)}
+
+    if st.button(f"🗓️ 規劃 {len(cfgs)} 場", type="primary", use_container_width=True, disabled=not cfgs):
+        timer = perf.StageTimer()
+        with st.spinner("規劃中..."), timer.stage("plan"):
+            plan = battle.plan_session(encoded_inventory(), cfgs, card_limit=card_limit, tag_limits=tag_limits)
+        record_timings("多場規劃", timer, rounds=len(cfgs), cards=len(st.session_state['inventory']), iterations=plan['iterations'])
+        st.session_state['session_plan'] = plan
+
+    plan = st.session_state.get('session_plan')
+    if not plan: return
+    gap = (plan['bound'] - plan['total']) / plan['bound'] if plan['bound'] > 0 else 0.0
+    st.success(f"預估總分 {plan['total']:,.1f}")
+    st.caption("已證明為最佳解" if gap < 1e-9 else f"與理論上界 {plan['bound']:,.1f} 相差 {gap:.2%} (次梯度迭代 {plan['iterations']} 次)")
+    st.dataframe(pd.DataFrame([{
+        "場次": r, **{f"第 {k + 1} 棒": f"{m['name']} [{m['move']}]" for k, m in enumerate(t['members'])}, "預估分數": round(t['score'], 1)
+    } for r, t in enumerate(plan['rounds'], start=1)]), use_container_width=True, hide_index=True)
+
 # --- Main Logic Router ---
 # 根據最上方的 page 變數決定顯示哪個函式
 if page == "卡片資料庫管理": page_manage_cards()
 elif page == "🛠️ 建立圖示範本": page_template_creator()
-else: page_battle()
\ No newline at end of file
+elif page == "📊 對戰覆蓋分析": page_coverage()
+elif page == "🗓️ 多場對戰規劃": page_session_planner()
+else: page_battle()
+
+render_perf_panel()
\ No newline at end of file
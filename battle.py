@@ -0,0 +1,741 @@
+"""
+對戰計算核心 (屬性相剋表、候選卡片評分、隊伍挑選)，不依賴 Streamlit。
+"""
+import copy
+import heapq
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import cardmodel
+from cardmodel import POKEMON_TYPES, SPECIAL_TAGS, MOVE_CATEGORIES
+
+TYPE_CHART = {
+    "一般": {"岩石": 0.5, "幽靈": 0, "鋼": 0.5},
+    "火": {"草": 2, "冰": 2, "蟲": 2, "鋼": 2, "水": 0.5, "火": 0.5, "岩石": 0.5, "龍": 0.5},
+    "水": {"火": 2, "地面": 2, "岩石": 2, "水": 0.5, "草": 0.5, "龍": 0.5},
+    "電": {"水": 2, "飛行": 2, "地面": 0, "電": 0.5, "草": 0.5, "龍": 0.5},
+    "草": {"水": 2, "地面": 2, "岩石": 2, "火": 0.5, "草": 0.5, "毒": 0.5, "飛行": 0.5, "蟲": 0.5, "龍": 0.5, "鋼": 0.5},
+    "冰": {"草": 2, "地面": 2, "飛行": 2, "龍": 2, "火": 0.5, "冰": 0.5, "鋼": 0.5, "水": 0.5},
+    "格鬥": {"一般": 2, "冰": 2, "岩石": 2, "惡": 2, "鋼": 2, "幽靈": 0, "毒": 0.5, "飛行": 0.5, "超能力": 0.5, "蟲": 0.5, "妖精": 0.5},
+    "毒": {"草": 2, "妖精": 2, "毒": 0.5, "地面": 0.5, "幽靈": 0.5, "岩石": 0.5, "鋼": 0},
+    "地面": {"火": 2, "電": 2, "毒": 2, "岩石": 2, "鋼": 2, "飛行": 0, "草": 0.5, "蟲": 0.5},
+    "飛行": {"草": 2, "格鬥": 2, "蟲": 2, "電": 0.5, "岩石": 0.5, "鋼": 0.5},
+    "超能力": {"格鬥": 2, "毒": 2, "超能力": 0.5, "惡": 0, "鋼": 0.5},
+    "蟲": {"草": 2, "超能力": 2, "惡": 2, "火": 0.5, "飛行": 0.5, "幽靈": 0.5, "格鬥": 0.5, "毒": 0.5, "鋼": 0.5, "妖精": 0.5},
+    "岩石": {"火": 2, "冰": 2, "飛行": 2, "蟲": 2, "格鬥": 0.5, "地面": 0.5, "鋼": 0.5},
+    "幽靈": {"超能力": 2, "幽靈": 2, "一般": 0, "惡": 0.5},
+    "龍": {"龍": 2, "鋼": 0.5, "妖精": 0},
+    "惡": {"幽靈": 2, "超能力": 2, "格鬥": 0.5, "妖精": 0.5, "惡": 0.5},
+    "鋼": {"冰": 2, "岩石": 2, "妖精": 2, "火": 0.5, "水": 0.5, "電": 0.5, "鋼": 0.5},
+    "妖精": {"格鬥": 2, "龍": 2, "惡": 2, "毒": 0.5, "鋼": 0.5, "火": 0.5}
+}
+
+# 招式倍率：第 2 招 (強力招式) x1.2
+MOVE_MULT = (1.0, 1.2)
+DETECTED_WEAKNESS_EFF = 2.5
+
+def get_effectiveness(atk, deff):
+    if deff == "無" or atk == "無": return 1.0
+    return TYPE_CHART.get(atk, {}).get(deff, 1.0)
+
+def tag_multiplier(tag):
+    if tag in ["極巨化", "Z招式"]: return 1.3
+    elif tag != "無": return 1.15
+    return 1.0
+
+
+# --- 屬性相剋矩陣 ---
+def build_type_matrix(types):
+    """
+    把 TYPE_CHART 編譯成 [攻擊屬性, 防禦屬性] 的倍率矩陣。
+    「無」以及不在 TYPE_CHART 中的屬性 (例如資料中的未知字串) 皆為全 1 的單位列/行，
+    與 get_effectiveness 的結果完全一致。
+    """
+    n = len(types)
+    matrix = np.ones((n, n), dtype=np.float64)
+    for a, atk in enumerate(types):
+        for d, deff in enumerate(types):
+            matrix[a, d] = get_effectiveness(atk, deff)
+    return matrix
+
+TYPE_INDEX = {t: i for i, t in enumerate(POKEMON_TYPES)}
+TYPE_MATRIX = build_type_matrix(POKEMON_TYPES)
+
+
+# --- 卡片庫編碼 ---
+class EncodedInventory:
+    """
+    將卡片庫 (cardmodel.Card 清單) 編碼成整數/浮點陣列，供批次計算使用。
+    vocab 即 cardmodel.TYPES 的代碼表：以 POKEMON_TYPES 開頭，資料中出現的其他屬性字串接在後面 (倍率視同「無」)，
+    因此卡片上的屬性代碼可以直接當作索引。
+    支援 insert / update / delete 單張卡片 (只重算該列)，卡片庫變動時不必整個重建。
+    更新一律換成新的陣列/清單 (不修改既有的)，因此 snapshot() 取得的唯讀副本之後不會再被改動。
+    """
+    # 每張卡片對應的一列欄位 (名稱, dtype)
+    COLUMNS = (
+        ("attack", np.float64), ("sp_attack", np.float64), ("has_tag", bool), ("tag_mult", np.float64),
+        ("move_type", np.int32), ("move_is_atk", bool), ("move_valid", bool),
+    )
+
+    def __init__(self, inventory):
+        self._build(inventory)
+
+    def _build(self, inventory):
+        self.cards = list(inventory)
+        self.n_moves = max([len(c.moves) for c in self.cards] + [len(MOVE_MULT)])
+        self.vocab = list(cardmodel.TYPES.values)
+        rows = [self._encode(card) for card in self.cards]
+        for k, (col, dtype) in enumerate(self.COLUMNS):
+            shape = (0, self.n_moves) if col.startswith("move_") else (0,)
+            values = [r[k] for r in rows]
+            setattr(self, col, np.array(values, dtype=dtype) if values else np.zeros(shape, dtype=dtype))
+        self.move_mult = np.ones(self.n_moves, dtype=np.float64)
+        self.move_mult[:len(MOVE_MULT)] = MOVE_MULT
+        self._on_vocab_changed()
+        self._derive()
+
+    def _encode(self, card):
+        """把一張卡片編碼成 COLUMNS 順序的一列。"""
+        moves = card.moves
+        pad = self.n_moves - len(moves)
+        return (
+            card.attack, card.sp_attack, card.has_tag, tag_multiplier(card.tag_name),
+            [m.type for m in moves] + [0] * pad,
+            [m.is_attack for m in moves] + [False] * pad,
+            [bool(m.name) for m in moves] + [False] * pad,
+        )
+
+    def _on_vocab_changed(self):
+        self.type_matrix = TYPE_MATRIX if len(self.vocab) == len(POKEMON_TYPES) else build_type_matrix(self.vocab)
+
+    def _derive(self):
+        # 各招式的基礎攻擊值 (依分類取攻擊 or 特攻)
+        self.move_base = np.where(self.move_is_atk, self.attack[:, None], self.sp_attack[:, None])
+
+    # --- 單張卡片增量更新 ---
+    def _apply(self, card, fn):
+        if len(card.moves) > self.n_moves: return False # 招式數超出目前欄位，交由呼叫端重建
+        if len(cardmodel.TYPES) != len(self.vocab): # 出現了新的屬性字串
+            self.vocab = list(cardmodel.TYPES.values)
+            self._on_vocab_changed()
+        row = self._encode(card)
+        for (col, _), value in zip(self.COLUMNS, row):
+            setattr(self, col, fn(getattr(self, col), value))
+        self._derive()
+        return True
+
+    # insert / update / delete 回傳 True 表示只更新了該列；False 表示已整個重建
+    def insert(self, idx, card):
+        """在位置 idx 插入一張卡片。"""
+        if not self._apply(card, lambda arr, v: np.insert(arr, idx, v, axis=0)):
+            self._build(self.cards[:idx] + [card] + self.cards[idx:])
+            return False
+        self.cards = self.cards[:idx] + [card] + self.cards[idx:]
+        return True
+
+    def update(self, idx, card):
+        """以新資料取代位置 idx 的卡片。"""
+        def assign(arr, v):
+            arr = arr.copy()
+            arr[idx] = v
+            return arr
+        if not self._apply(card, assign):
+            self._build(self.cards[:idx] + [card] + self.cards[idx + 1:])
+            return False
+        self.cards = self.cards[:idx] + [card] + self.cards[idx + 1:]
+        return True
+
+    def delete(self, idx):
+        """刪除位置 idx 的卡片。"""
+        for col, _ in self.COLUMNS:
+            setattr(self, col, np.delete(getattr(self, col), idx, axis=0))
+        self.cards = self.cards[:idx] + self.cards[idx + 1:]
+        self._derive()
+        return True
+
+    def snapshot(self):
+        """目前內容的唯讀副本 (只複製參照)：之後的 insert / update / delete 不會影響它。"""
+        return copy.copy(self)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def type_code(self, t):
+        """屬性字串 → vocab 索引 (不存在則回傳 None)。"""
+        code = cardmodel.TYPES.lookup(t)
+        return code if code is not None and code < len(self.vocab) else None
+
+
+def is_manual_mode(cfg):
+    """任一對手有手動設定屬性時，使用手動屬性優先模式。"""
+    return any(c['manual_t1'] != "無" or c['manual_t2'] != "無" for c in cfg)
+
+
+def move_type_eff(enc, cfg, manual):
+    """
+    回傳長度為 len(vocab) 的向量：每種招式屬性對三位對手的倍率總和。
+    手動模式：雙屬性相乘；自動模式：屬於偵測到的有利屬性則 2.5，否則 1.0。
+    加總順序與原本逐一累加相同 (左 → 中 → 右)，確保浮點結果一致。
+    這個向量就是本場的對戰表：每張卡片每招只需查表一次 (eff_by_type[move_type])。
+    不另外為每張卡片預先建立「對每種雙屬性組合 (19×19) 的傷害表」：1 萬張卡片要 55MB、查三次比現在慢，
+    而且三位對手的傷害分別算好再相加會改變浮點結果。
+    """
+    eff_total = np.zeros(len(enc.vocab), dtype=np.float64)
+    for c in cfg:
+        if manual:
+            d1 = enc.type_code(c['manual_t1'])
+            d2 = enc.type_code(c['manual_t2'])
+            e1 = enc.type_matrix[:, d1] if d1 is not None else 1.0
+            e2 = enc.type_matrix[:, d2] if d2 is not None else 1.0
+            eff = e1 * e2
+        else:
+            detected = set(c['detected_weakness'])
+            eff = np.array([DETECTED_WEAKNESS_EFF if t in detected else 1.0 for t in enc.vocab])
+        eff_total = eff_total + eff
+    return eff_total
+
+
+def _score_arrays(enc, cfg, manual):
+    """
+    所有卡片兩種出戰方式的分數 (陣列)：
+    - special: 兩招中傷害最高者，乘上特殊能力加成。
+    - normal: 有特殊能力的卡片保留特殊、強制使用第 1 招。
+    回傳 (best_idx, has_best, max_dmg_s, score_s, has_normal, dmg_n)。
+    """
+    eff_by_type = move_type_eff(enc, cfg, manual)
+    eff = eff_by_type[enc.move_type]                                 # (n, moves)
+    dmg = enc.move_base * enc.move_mult * eff
+    dmg = np.where(enc.move_valid, dmg, -np.inf)
+
+    # Mode A: Special — 取第一個「嚴格大於 0 且最大」的招式 (與原本 dmg > max_dmg_s 的判斷一致)
+    best_idx = np.argmax(dmg, axis=1)
+    best_dmg = dmg[np.arange(len(enc)), best_idx]
+    has_best = best_dmg > 0
+    max_dmg_s = np.where(has_best, best_dmg, 0.0)
+    score_s = max_dmg_s * enc.tag_mult
+
+    # Mode B: Normal (Force 1st move)
+    has_normal = enc.has_tag & enc.move_valid[:, 0]
+    dmg_n = enc.move_base[:, 0] * 1.0 * eff[:, 0]
+    return best_idx, has_best, max_dmg_s, score_s, has_normal, dmg_n
+
+
+def _candidate(card, mode, move, score, dmg):
+    """一個候選出戰方式 (score_candidates / plan_session 的輸出格式)。"""
+    tag = card.tag_name
+    return {
+        "name": card.name,
+        "mode": mode,
+        "tag": tag if mode == "special" else "無",
+        "original_tag": tag,
+        "move": move,
+        "score": float(score),
+        "dmg": float(dmg)
+    }
+
+
+def score_candidates(enc, cfg, manual=None):
+    """
+    以批次陣列運算計算所有卡片的候選出戰方式 (結果與逐張計算完全相同，見 _score_arrays)。
+    回傳依分數由高到低排序 (同分保持卡片順序) 的候選清單。
+    """
+    if manual is None: manual = is_manual_mode(cfg)
+    if not len(enc): return []
+    best_idx, has_best, max_dmg_s, score_s, has_normal, dmg_n = _score_arrays(enc, cfg, manual)
+
+    cands = []
+    for i, card in enumerate(enc.cards):
+        cands.append(_candidate(card, "special", card.moves[best_idx[i]].label if has_best[i] else "", score_s[i], max_dmg_s[i]))
+        if has_normal[i]:
+            cands.append(_candidate(card, "normal", card.moves[0].label, dmg_n[i], dmg_n[i]))
+
+    cands.sort(key=lambda x: x['score'], reverse=True)
+    return cands
+
+
+def solve_teams(cands, size=3, top_k=1):
+    """
+    精確求解：在「同名卡片只能出場一次、同一種特殊能力只能使用一次」的限制下，
+    找出總分最高的前 top_k 組不同隊伍 (以 branch-and-bound 搜尋依分數排序的候選)。
+    同名且佔用相同特殊能力的候選可以互換，搜尋前只保留其中分數最高者 (否則上界會被大量同名候選撐大而失去剪枝效果)。
+    上界：剩下的每種特殊能力最多只取該能力分數最高的一張，「無」則可取多張 (忽略同名限制)，
+    不可能超過第 k 名時就剪枝。
+    可用卡片不足以組成 size 人隊伍時，自動縮小隊伍人數。
+    回傳 (teams, nodes)：teams 為 [{"score": 總分, "members": [候選, ...]}, ...] (由高到低)，
+    nodes 為搜尋過的節點數。
+    """
+    ranked, seen = [], set()
+    for c in sorted(cands, key=lambda c: c['score'], reverse=True):
+        key = (c['name'], c['tag'])
+        if key in seen: continue
+        seen.add(key)
+        ranked.append(c)
+    n = len(ranked)
+    scores = [c['score'] for c in ranked]
+
+    # 每種特殊能力從位置 i 之後的最高分 (suffix max)
+    tag_arr = np.array([c['tag'] for c in ranked] + ["無"])
+    score_arr = np.array(scores + [-np.inf], dtype=np.float64)
+    tags = sorted(set(tag_arr.tolist()) - {"無"})
+    tag_best = {}
+    for t in tags:
+        masked = np.where(tag_arr == t, score_arr, -np.inf)
+        tag_best[t] = np.maximum.accumulate(masked[::-1])[::-1].tolist()
+    # 「無」候選：依分數排列的前綴和，以及位置 i 之後第一個「無」候選在清單中的位置
+    none_prefix = [0.0]
+    none_pos = [0] * (n + 1)
+    for i in range(n):
+        none_pos[i] = len(none_prefix) - 1
+        if ranked[i]['tag'] == "無": none_prefix.append(none_prefix[-1] + scores[i])
+    none_pos[n] = len(none_prefix) - 1
+
+    def upper_bound(start, r, used_tags):
+        """從位置 start 之後再選 r 個候選的最高可能總分 (放寬同名限制)。"""
+        if r <= 0: return 0.0
+        p = none_pos[start]
+        k = min(r, len(none_prefix) - 1 - p)
+        values = [none_prefix[p + j + 1] - none_prefix[p + j] for j in range(k)]
+        values += [tag_best[t][start] for t in tags if t not in used_tags and tag_best[t][start] > -np.inf]
+        if len(values) < r: return -np.inf # 候選不足，無法湊滿
+        values.sort(reverse=True)
+        return sum(values[:r])
+
+    nodes = 0
+    for team_size in range(min(size, n), 0, -1):
+        best = [] # min-heap: (總分, 反向索引)，保留前 top_k 名
+        path, used_names, used_tags = [], set(), set()
+
+        def threshold():
+            return best[0][0] if len(best) >= top_k else -np.inf
+
+        def dfs(start, total):
+            nonlocal nodes
+            nodes += 1
+            remaining = team_size - len(path)
+            if remaining == 0:
+                entry = (total, tuple(-i for i in path))
+                if len(best) < top_k: heapq.heappush(best, entry)
+                elif entry > best[0]: heapq.heapreplace(best, entry)
+                return
+            for i in range(start, n - remaining + 1):
+                c = ranked[i]
+                if c['name'] in used_names: continue
+                # 單調的上界 (隨 i 遞減)：不可能更好時後面都不用看了
+                if total + scores[i] + upper_bound(i + 1, remaining - 1, used_tags) <= threshold(): break
+                tag = c['tag']
+                if tag != "無":
+                    if tag in used_tags: continue
+                    # 扣掉自己的特殊能力後再檢查一次上界
+                    used_tags.add(tag)
+                    if total + scores[i] + upper_bound(i + 1, remaining - 1, used_tags) <= threshold():
+                        used_tags.discard(tag)
+                        continue
+
+                path.append(i)
+                used_names.add(c['name'])
+                dfs(i + 1, total + scores[i])
+                path.pop()
+                used_names.discard(c['name'])
+                if tag != "無": used_tags.discard(tag)
+
+        dfs(0, 0.0)
+        if best:
+            teams = [{"score": total, "members": [ranked[-i] for i in neg_path]}
+                     for total, neg_path in sorted(best, reverse=True)]
+            return teams, nodes
+    return [], nodes
+
+# --- 對手陣容批次分析 (Coverage Report) ---
+# 每個候選的分數 = 固定係數 × 該招式屬性在此陣容下的倍率總和，因此：
+# 1. 同一 (特殊能力類別, 招式屬性) 群組內，只有係數最高的 3 張不同卡片可能出現在最佳隊伍中
+#    (隊伍另外兩人最多只佔用 2 個名字，總能換成群組前 3 名中沒被佔用的那張)。
+# 2. 同理，每個類別在每個陣容下只需保留分數前 3 名的卡片，
+#    最佳隊伍一定是這些格子 (最多 7 類 × 3 格) 中的某個合法三人組合。
+# 以上都與陣容無關或可批次計算，因此可以一次評估數十萬種陣容。
+
+def defender_pair_options(types=POKEMON_TYPES):
+    """所有不分順序的防守方雙屬性組合 (含「無」)，回傳 [(t1, t2), ...]。"""
+    idx = [POKEMON_TYPES.index(t) for t in types]
+    return [(POKEMON_TYPES[a], POKEMON_TYPES[b]) for k, a in enumerate(idx) for b in idx[k:]]
+
+def weakness_set_options(types=POKEMON_TYPES[:-1], max_size=1):
+    """所有大小 1 ~ max_size 的偵測有利屬性組合，回傳 [(t, ...), ...]。"""
+    return [combo for size in range(1, max_size + 1) for combo in itertools.combinations(types, size)]
+
+def opponent_eff_matrix(enc, options, kind):
+    """
+    每個對手選項對各招式屬性 (enc.vocab) 的倍率，形狀 (選項數, len(vocab))。
+    kind="pair": 選項為 (t1, t2) 手動雙屬性；kind="weakness": 選項為偵測到的有利屬性組合。
+    """
+    eff = np.ones((len(options), len(enc.vocab)), dtype=np.float64)
+    for o, opt in enumerate(options):
+        if kind == "pair":
+            eff[o] = enc.type_matrix[:, TYPE_INDEX[opt[0]]] * enc.type_matrix[:, TYPE_INDEX[opt[1]]]
+        else:
+            for t in opt:
+                code = enc.type_code(t)
+                if code is not None: eff[o, code] = DETECTED_WEAKNESS_EFF
+    return eff
+
+def enumerate_lineups(n_options, same_only=False):
+    """三位對手的陣容 (不分順序、可重複)，回傳 (陣容數, 3) 的選項索引。"""
+    if same_only:
+        return np.repeat(np.arange(n_options, dtype=np.int32)[:, None], 3, axis=1)
+    combos = itertools.combinations_with_replacement(range(n_options), 3)
+    return np.fromiter(itertools.chain.from_iterable(combos), dtype=np.int32).reshape(-1, 3)
+
+
+def build_coverage_plan(enc):
+    """
+    由編碼後的卡片庫建立批次分析用的精簡候選集 (與陣容無關，只需建立一次)。
+    候選 = 每張卡片每個可用招式的 special，以及有特殊能力卡片的 normal (第 1 招)。
+    回傳可 pickle 的 dict (供多行程使用)。
+    """
+    coef = enc.move_base * enc.move_mult
+    tag_codes = {cardmodel.NO_TAG: 0}
+    name_ids = {}
+    cands = [] # (類別, 招式屬性, 係數×加成, 名稱編號, 卡片, 招式, 是否 normal)
+    for i, card in enumerate(enc.cards):
+        cls = tag_codes.setdefault(card.tag, len(tag_codes))
+        nid = name_ids.setdefault(card.name, len(name_ids)) # 同名卡片只能出場一次，以名稱為單位
+        for j in range(enc.n_moves):
+            if enc.move_valid[i, j]:
+                cands.append((cls, int(enc.move_type[i, j]), coef[i, j] * enc.tag_mult[i], nid, i, j, False))
+        if enc.has_tag[i] and enc.move_valid[i, 0]:
+            cands.append((0, int(enc.move_type[i, 0]), coef[i, 0], nid, i, 0, True))
+
+    # 每個 (類別, 招式屬性) 群組保留係數前 3 名的不同名稱
+    cands.sort(key=lambda c: (c[0], c[1], -c[2], c[4], c[5]))
+    kept, group, seen = [], None, set()
+    for c in cands:
+        if (c[0], c[1]) != group:
+            group, seen = (c[0], c[1]), set()
+        if c[3] in seen or len(seen) >= 3: continue
+        seen.add(c[3])
+        kept.append(c)
+
+    # 依 (類別, 名稱, 卡片, 招式) 排序，同一 (類別, 名稱) 的候選相鄰 = 一個 unit
+    kept.sort(key=lambda c: (c[0], c[3], c[4], c[6], c[5]))
+    units, unit_starts = [], []
+    for r, c in enumerate(kept):
+        if not units or units[-1] != (c[0], c[3]):
+            units.append((c[0], c[3]))
+            unit_starts.append(r)
+    unit_cls = np.array([u[0] for u in units], dtype=np.int32)
+    n_classes = len(tag_codes)
+    class_bounds = [(int(np.searchsorted(unit_cls, k)), int(np.searchsorted(unit_cls, k, side="right"))) for k in range(n_classes)]
+
+    # 格子：每個類別 3 格；合法三人組合 = 任兩格不屬於同一個特殊能力類別 (「無」除外)
+    slot_cls = np.repeat(np.arange(n_classes), 3)
+    triples = np.array([t for t in itertools.combinations(range(len(slot_cls)), 3)
+                        if all(slot_cls[a] == 0 or slot_cls[a] != slot_cls[b] for a, b in itertools.combinations(t, 2))],
+                       dtype=np.int32).reshape(-1, 3)
+
+    def move_label(c):
+        return enc.cards[c[4]].moves[c[5]].label + (" [一般]" if c[6] else "")
+
+    return {
+        "cand_type": np.array([c[1] for c in kept], dtype=np.int32),
+        "cand_coef": np.array([coef[c[4], c[5]] for c in kept], dtype=np.float64),
+        "cand_tag_mult": np.array([1.0 if c[6] else enc.tag_mult[c[4]] for c in kept], dtype=np.float64),
+        "cand_normal": np.array([c[6] for c in kept], dtype=bool),
+        "cand_card": np.array([enc.cards[c[4]].name for c in kept] + [""], dtype=object),
+        "cand_move": np.array([move_label(c) for c in kept] + [""], dtype=object),
+        "unit_starts": np.array(unit_starts, dtype=np.int64),
+        "unit_sizes": np.diff(np.array(unit_starts + [len(kept)], dtype=np.int64)),
+        "unit_card": np.array([u[1] for u in units], dtype=np.int64),
+        "class_bounds": class_bounds,
+        "triples": triples,
+    }
+
+
+def _coverage_chunk(plan, opp_eff, lineups):
+    """計算一批陣容的最佳隊伍 (模組層級函式，可交給行程池執行)。"""
+    n = len(lineups)
+    n_cand = len(plan["cand_type"])
+    empty = {"total_score": np.zeros(n), "total_dmg": np.zeros(n), "members": np.full((n, 3), n_cand)}
+    if not n_cand: return empty
+
+    eff = opp_eff[lineups[:, 0]] + opp_eff[lineups[:, 1]] + opp_eff[lineups[:, 2]]   # (n, vocab)
+    dmg = plan["cand_coef"] * eff[:, plan["cand_type"]]                             # (n, 候選)
+    if (plan["cand_coef"] < 0).any():
+        dmg = np.where(plan["cand_normal"] | (dmg > 0), dmg, 0.0) # special 傷害 <= 0 時視為 0
+    score = dmg * plan["cand_tag_mult"]
+    # unit 分數 = unit 內候選的最高分 (unit 最多只有幾個候選，逐欄取 max 比 reduceat 快)
+    starts, sizes = plan["unit_starts"], plan["unit_sizes"]
+    unit_score = score[:, starts]                                                     # (n, unit)
+    for k in range(1, int(sizes.max())):
+        has_k = np.nonzero(sizes > k)[0]
+        unit_score[:, has_k] = np.maximum(unit_score[:, has_k], score[:, starts[has_k] + k])
+
+    # 每個類別取前 3 名 unit 放進格子 (不足 3 個時補空格：分數 0、不與任何人衝突)
+    n_slots = 3 * len(plan["class_bounds"])
+    slot_unit = np.full((n, n_slots), -1, dtype=np.int64)
+    slot_score = np.zeros((n, n_slots))
+    rows = np.arange(n)[:, None]
+    for k, (a, b) in enumerate(plan["class_bounds"]):
+        size = b - a
+        if size == 0: continue
+        if size <= 3:
+            top = np.broadcast_to(np.arange(a, b), (n, size))
+        else:
+            top = np.argpartition(-unit_score[:, a:b], 2, axis=1)[:, :3] + a
+        # 類別內依分數由高到低排列，格子 3k 即為該類別第 1 名
+        top = np.take_along_axis(top, np.argsort(-unit_score[rows, top], axis=1, kind="stable"), axis=1)
+        slot_unit[:, 3*k:3*k + top.shape[1]] = top
+        slot_score[:, 3*k:3*k + top.shape[1]] = unit_score[rows, top]
+
+    slot_card = np.where(slot_unit >= 0, plan["unit_card"][slot_unit], -1 - np.arange(n_slots))
+
+    # 快速解：忽略同名限制時，最佳隊伍 = {「無」前 3 名, 各特殊能力第 1 名} 中分數最高的 3 格；
+    # 若這 3 格名稱不重複即為最佳解，否則該列改用所有合法三人組合逐一比較
+    relax = np.array([0, 1, 2] + [3 * k for k in range(1, len(plan["class_bounds"]))])
+    pick = relax[np.argsort(-slot_score[:, relax], axis=1, kind="stable")[:, :3]]    # (n, 3) 格子位置
+    pc = np.take_along_axis(slot_card, pick, axis=1)
+    conflict = (pc[:, 0] == pc[:, 1]) | (pc[:, 0] == pc[:, 2]) | (pc[:, 1] == pc[:, 2])
+    if conflict.any():
+        tri = plan["triples"]
+        a, b, c = tri[:, 0], tri[:, 1], tri[:, 2]
+        sc, cc = slot_score[conflict], slot_card[conflict]
+        total = sc[:, a] + sc[:, b] + sc[:, c]
+        valid = (cc[:, a] != cc[:, b]) & (cc[:, a] != cc[:, c]) & (cc[:, b] != cc[:, c])
+        pick[conflict] = tri[np.argmax(np.where(valid, total, -np.inf), axis=1)]
+    total_score = np.take_along_axis(slot_score, pick, axis=1).sum(axis=1)
+
+    # 把勝出的 unit 換回實際候選 (unit 內分數最高、同分取較前者)
+    chosen_units = np.take_along_axis(slot_unit, pick, axis=1)                        # (n, 3)
+    members = np.full((n, 3), n_cand, dtype=np.int64)
+    member_dmg = np.zeros((n, 3))
+    member_score = np.full((n, 3), -np.inf)
+    for k in range(int(sizes.max())):
+        u = np.maximum(chosen_units, 0)
+        cand = starts[u] + k
+        ok = (chosen_units >= 0) & (k < sizes[u])
+        cand = np.where(ok, cand, 0)
+        s = np.where(ok, score[rows, cand], -np.inf)
+        better = s > member_score
+        member_score = np.where(better, s, member_score)
+        members = np.where(better, cand, members)
+        member_dmg = np.where(better, dmg[rows, cand], member_dmg)
+    return {"total_score": total_score, "total_dmg": member_dmg.sum(axis=1), "members": members}
+
+
+def coverage_report(enc, options, kind="pair", lineups=None, workers=1, chunk_size=2000):
+    """
+    批次計算每種對手陣容的最佳隊伍與預估總火力 (總分與 solve_teams 的最佳解相同)。
+    options: 對手選項 (見 defender_pair_options / weakness_set_options)；
+    lineups: (陣容數, 3) 選項索引，預設為所有不分順序的組合。
+    workers > 1 時以行程池分批計算。
+    回傳 dict：opp1~3 (對手說明)、total_dmg、total_score、card1~3、move1~3，皆為等長陣列。
+    """
+    if lineups is None: lineups = enumerate_lineups(len(options))
+    plan = build_coverage_plan(enc)
+    opp_eff = opponent_eff_matrix(enc, options, kind)
+    chunks = [lineups[i:i + chunk_size] for i in range(0, len(lineups), chunk_size)]
+
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_coverage_chunk, itertools.repeat(plan), itertools.repeat(opp_eff), chunks))
+    else:
+        parts = [_coverage_chunk(plan, opp_eff, c) for c in chunks]
+
+    members = np.concatenate([p["members"] for p in parts]) if parts else np.zeros((0, 3), dtype=np.int64)
+    labels = np.array(["/".join(opt) if kind == "pair" else "弱:" + "+".join(opt) for opt in options], dtype=object)
+    report = {f"opp{k + 1}": labels[lineups[:, k]] for k in range(3)}
+    report["total_dmg"] = np.concatenate([p["total_dmg"] for p in parts]) if parts else np.zeros(0)
+    report["total_score"] = np.concatenate([p["total_score"] for p in parts]) if parts else np.zeros(0)
+    for k in range(3):
+        report[f"card{k + 1}"] = plan["cand_card"][members[:, k]]
+        report[f"move{k + 1}"] = plan["cand_move"][members[:, k]]
+    return report
+
+
+# --- 多場對戰規劃 (Session Planner) ---
+# 每場仍是「同名卡片只能出場一次、同一種特殊能力只能使用一次」的隊伍，分數沿用 _score_arrays；
+# 跨場次的限制：每張卡片 (同名視為同一張) 最多出場 card_limit 次、特殊能力 t 最多使用 tag_limits[t] 次。
+# 1. 候選縮減：同一場、同一類別 (某種特殊能力，或不佔用特殊能力的「無」/normal) 的同名卡片可以互換，只保留分數最高的一張；
+#    之後只需保留分數前 size×場次數 名 (皆不同名) — 其他場次最多用掉 size×(場次數-1) 張卡片，
+#    前幾名中一定有可換入的卡片 (類別相同，限制的使用量不變)，總分不會變差。
+#    (若不先去除同名，前幾名可能全是同一張卡片的複本，可換入的卡片就被刪掉了)
+# 2. 拉格朗日鬆弛：把跨場次限制以乘數 (每張卡片 μ、每種特殊能力 λ) 移入目標函數，各場就互相獨立；
+#    每場只需看各類別調整後分數前 size 名 (同理可換；同名的乘數相同，去除同名後這幾名也都不同名)，所有場次的所有組合一次以陣列列舉。
+#    以次梯度法調整乘數，鬆弛解的值為總分上界。
+# 3. 定期把鬆弛解依分數修補成符合限制的方案 (再以剩餘候選補滿空位)，保留最佳者；上下界相同即為最佳解。
+PLAN_MAX_ITER = 300     # 次梯度法最多迭代次數
+PLAN_TIME_BUDGET = 2.0  # 規劃時間上限 (秒)，到時回傳目前最佳方案與上界
+PLAN_REPAIR_EVERY = 5   # 每隔幾次迭代修補一次可行方案
+
+
+def _plan_candidates(enc, cfgs, keep, banned_tags):
+    """
+    各場次縮減後的候選，回傳扁平陣列的 dict：round / row (卡片位置) / mode (0 special, 1 normal) /
+    tag (佔用的特殊能力代碼，-1 表示不佔用) / score / dmg / move (招式索引，-1 表示沒有可用招式)。
+    每個 (場次, 類別, 卡片名稱) 只保留分數最高的一筆，再取分數前 keep 名；banned_tags 的特殊能力不產生 special 候選。
+    """
+    n = len(enc)
+    card_tag = np.array([c.tag if c.has_tag else -1 for c in enc.cards], dtype=np.int64)
+    _, name_of_row = np.unique([c.name for c in enc.cards], return_inverse=True)
+    keys = ("round", "row", "mode", "tag", "score", "dmg", "move")
+    parts = []
+    for r, cfg in enumerate(cfgs):
+        best_idx, has_best, max_dmg_s, score_s, has_normal, dmg_n = _score_arrays(enc, cfg, is_manual_mode(cfg))
+        normal = np.flatnonzero(has_normal)
+        row = np.concatenate([np.arange(n), normal])
+        mode = np.concatenate([np.zeros(n, np.int8), np.ones(len(normal), np.int8)])
+        tag = np.concatenate([card_tag, np.full(len(normal), -1)])
+        score = np.concatenate([score_s, dmg_n[normal]])
+        dmg = np.concatenate([max_dmg_s, dmg_n[normal]])
+        move = np.concatenate([np.where(has_best, best_idx, -1), np.zeros(len(normal), np.int64)])
+        allowed = ~np.isin(tag, list(banned_tags))
+        kept = []
+        for t in np.unique(tag[allowed]):
+            sel = np.flatnonzero(allowed & (tag == t))
+            sel = sel[np.argsort(-score[sel], kind="stable")]
+            _, first = np.unique(name_of_row[row[sel]], return_index=True) # 每個名稱分數最高的一筆
+            kept.append(sel[np.sort(first)][:keep])
+        k = np.sort(np.concatenate(kept)) if kept else np.zeros(0, np.int64)
+        parts.append((np.full(len(k), r), row[k], mode[k], tag[k], score[k], dmg[k], move[k]))
+    return {key: np.concatenate([p[i] for p in parts]) for i, key in enumerate(keys)}
+
+
+def plan_session(enc, cfgs, card_limit=1, tag_limits=None, size=3, max_iter=PLAN_MAX_ITER, time_budget=PLAN_TIME_BUDGET):
+    """
+    多場對戰的出戰規劃 (見上方說明)。cfgs 為每場的對手設定 (與 score_candidates 相同格式)；
+    card_limit 為每張卡片最多出場次數 (None 為不限)，tag_limits 為 {特殊能力: 最多使用次數} (沒列出的不限)。
+    回傳 dict：rounds ([{"score", "members"}, ...]，與 solve_teams 的隊伍格式相同)、total (總分)、
+    bound (總分上界，與 total 相同時為最佳解)、iterations (次梯度迭代數)。
+    可用卡片不足時，部分場次的隊伍人數會少於 size。
+    """
+    start = time.perf_counter()
+    n_rounds = len(cfgs)
+    if not n_rounds or not len(enc):
+        return {"rounds": [{"score": 0.0, "members": []} for _ in cfgs], "total": 0.0, "bound": 0.0, "iterations": 0}
+
+    # 特殊能力上限 (依代碼)；上限為 0 的特殊能力直接排除 special 候選
+    tag_cap = np.full(len(cardmodel.TAGS), np.inf)
+    for t, limit in (tag_limits or {}).items():
+        code = cardmodel.TAGS.lookup(t)
+        if code is not None and limit is not None: tag_cap[code] = limit
+    banned = {t for t in range(len(tag_cap)) if tag_cap[t] <= 0}
+    cand = _plan_candidates(enc, cfgs, size * n_rounds, banned)
+
+    # 同名視為同一張卡片；類別編號 0 為不佔用特殊能力，其餘依序為出現的特殊能力
+    _, card_of_row = np.unique([c.name for c in enc.cards], return_inverse=True)
+    card = card_of_row[cand["row"]]
+    n_cards = int(card_of_row.max()) + 1
+    group_tags, group = np.unique(cand["tag"], return_inverse=True)
+    if group_tags[0] != -1: group_tags, group = np.concatenate([[-1], group_tags]), group + 1
+    n_groups = len(group_tags)
+    card_cap = np.full(n_cards, np.inf if card_limit is None else float(card_limit))
+    group_cap = np.concatenate([[np.inf], tag_cap[group_tags[1:]]])
+    score, rnd = cand["score"], cand["round"]
+
+    # 每場的候選格子：每個類別 size 格 + size 個空位 (分數 0)
+    width = n_groups * size + size
+    combos = np.array(list(itertools.combinations(range(width), size)), dtype=np.int64)
+    pairs = list(itertools.combinations(range(size), 2))
+    rows_idx = np.arange(n_rounds)[:, None]
+
+    def relaxed(mu, lam):
+        """各場調整後分數最高的隊伍：回傳 (各場值, (場次數, size) 候選索引，-1 為空位)。"""
+        adj = score - mu[card] - lam[group]
+        order = np.lexsort((-adj, group, rnd))
+        seg = rnd[order] * n_groups + group[order]
+        first = np.r_[True, seg[1:] != seg[:-1]]
+        rank = np.arange(len(order)) - np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+        take = order[rank < size]
+        slot = group[take] * size + rank[rank < size]
+        values = np.full((n_rounds, width), -np.inf)
+        values[:, n_groups * size:] = 0.0
+        cards = np.broadcast_to(-1 - np.arange(width), (n_rounds, width)).copy()
+        groups = np.zeros((n_rounds, width), dtype=np.int64)
+        index = np.full((n_rounds, width), -1, dtype=np.int64)
+        values[rnd[take], slot], cards[rnd[take], slot] = adj[take], card[take]
+        groups[rnd[take], slot], index[rnd[take], slot] = group[take], take
+        total = values[:, combos].sum(axis=2)
+        c, g = cards[:, combos], groups[:, combos]
+        for a, b in pairs:
+            total[(c[:, :, a] == c[:, :, b]) | ((g[:, :, a] == g[:, :, b]) & (g[:, :, a] != 0))] = -np.inf
+        best = np.argmax(total, axis=1)
+        return total[np.arange(n_rounds), best], index[rows_idx, combos[best]]
+
+    # 修補時補空位用：各場候選依分數排序
+    by_round = [np.flatnonzero(rnd == r) for r in range(n_rounds)]
+    by_round = [idx[np.argsort(-score[idx], kind="stable")] for idx in by_round]
+
+    def repair(chosen):
+        """把鬆弛解修補成符合所有限制的方案，回傳 (總分, 各場候選索引清單)。"""
+        members = [[] for _ in range(n_rounds)]
+        used_card, used_group = np.zeros(n_cards), np.zeros(n_groups)
+        in_round = [set() for _ in range(n_rounds)]
+        def try_add(i):
+            r, c, g = rnd[i], card[i], group[i]
+            if len(members[r]) >= size or used_card[c] >= card_cap[c] or ("c", c) in in_round[r]: return False
+            if g and (used_group[g] >= group_cap[g] or ("g", g) in in_round[r]): return False
+            members[r].append(i)
+            used_card[c] += 1
+            in_round[r].add(("c", c))
+            if g:
+                used_group[g] += 1
+                in_round[r].add(("g", g))
+            return True
+        picked = chosen[chosen >= 0]
+        for i in picked[np.argsort(-score[picked], kind="stable")]: try_add(i)
+        # 空位：每次補上所有場次中分數最高的可用候選
+        heap = [(-score[by_round[r][0]], r, 0) for r in range(n_rounds) if len(members[r]) < size and len(by_round[r])]
+        heapq.heapify(heap)
+        while heap:
+            _, r, pos = heapq.heappop(heap)
+            try_add(by_round[r][pos])
+            if len(members[r]) < size and pos + 1 < len(by_round[r]):
+                heapq.heappush(heap, (-score[by_round[r][pos + 1]], r, pos + 1))
+        return float(sum(score[i] for m in members for i in m)), members
+
+    mu, lam = np.zeros(n_cards), np.zeros(n_groups)
+    card_limited, group_limited = np.isfinite(card_cap), np.isfinite(group_cap)
+    bound, best_total, best_members = np.inf, -np.inf, None
+    theta, stall, it = 2.0, 0, 0
+    while it < max_iter:
+        it += 1
+        values, chosen = relaxed(mu, lam)
+        ub = values.sum() + (mu * np.where(card_limited, card_cap, 0)).sum() + (lam * np.where(group_limited, group_cap, 0)).sum()
+        if ub < bound - 1e-9: bound, stall = ub, 0
+        else: stall += 1
+        if it == 1 or it % PLAN_REPAIR_EVERY == 0:
+            total, members = repair(chosen)
+            if total > best_total: best_total, best_members = total, members
+        if bound - best_total <= 1e-9 * max(1.0, abs(bound)) or time.perf_counter() - start > time_budget: break
+        # 次梯度 (超用為正)；乘數為 0 且未超用的限制不動
+        real = chosen[chosen >= 0]
+        g_card = np.where(card_limited, np.bincount(card[real], minlength=n_cards) - card_cap, 0.0)
+        g_group = np.where(group_limited, np.bincount(group[real], minlength=n_groups) - group_cap, 0.0)
+        g_card[(mu <= 0) & (g_card < 0)] = 0.0
+        g_group[(lam <= 0) & (g_group < 0)] = 0.0
+        norm2 = (g_card ** 2).sum() + (g_group ** 2).sum()
+        if norm2 == 0: # 鬆弛解本身可行且滿足互補鬆弛條件：即為最佳解
+            total, members = repair(chosen)
+            if total > best_total: best_total, best_members = total, members
+            bound = min(bound, best_total)
+            break
+        if stall >= 8: theta, stall = theta / 2, 0
+        if theta < 1e-4: break
+        step = theta * (bound - best_total) / norm2
+        mu = np.maximum(0.0, mu + step * g_card)
+        lam = np.maximum(0.0, lam + step * g_group)
+        lam[0] = 0.0
+
+    rounds = []
+    for members in best_members:
+        team = []
+        for i in sorted(members, key=lambda i: -score[i]):
+            c = enc.cards[cand["row"][i]]
+            if cand["mode"][i] == 0:
+                move = c.moves[cand["move"][i]].label if cand["move"][i] >= 0 else ""
+                team.append(_candidate(c, "special", move, score[i], cand["dmg"][i]))
+            else:
+                team.append(_candidate(c, "normal", c.moves[0].label, score[i], cand["dmg"][i]))
+        rounds.append({"score": sum(m["score"] for m in team), "members": team})
+    return {"rounds": rounds, "total": best_total, "bound": max(float(bound), best_total), "iterations": it}
@@ -0,0 +1,223 @@
+"""
+辨識與隊伍計算的效能測試 (命令列工具，使用合成資料，不需要 Streamlit)。
+- 對戰截圖：把 att_icon 範本以已知位置、微幅縮放貼到雜訊背景上，同時記錄正確答案，
+  因此除了耗時外也會算出 precision / recall，避免加速時偷偷犧牲準確度。
+- 卡片庫：依 mezastar_db.json 的格式產生不同大小的卡片庫。
+輸出各項目的延遲百分位數、吞吐量與記憶體峰值。
+
+用法:
+    python bench.py
+    python bench.py --strips 30 --sizes 100,1000,10000 --modes roi,coarse --json bench.json
+    python bench.py --skip-score --features bgr,gray,edge --prefilter off,on
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import cv2
+
+import battle
+import cardmodel
+import detector
+
+try:
+    import resource # 只有 Unix 有
+except ImportError:
+    resource = None
+
+
+# --- 合成資料 ---
+def make_strip(rng, groups, per_col=(1, 3), scale_range=(0.9, 1.1), noise=255):
+    """
+    產生一張三欄的屬性圖示列：每欄隨機貼 per_col 範圍內數量的不同屬性範本。
+    回傳 (BGR 影像, 各欄正確屬性 [[...], [...], [...]])。
+    """
+    names = sorted(groups)
+    templates = [(t, tpl.image) for t in names for tpl in groups[t]]
+    t_h = max(img.shape[0] for _, img in templates)
+    t_w = max(img.shape[1] for _, img in templates)
+    lo, hi = scale_range
+    pad = 6
+    col_w = int(t_w * hi + pad) * per_col[1] + pad
+    height = int(t_h * hi) + 2 * pad
+    canvas = rng.integers(0, noise + 1, (height, col_w * 3, 3), dtype=np.uint8)
+    canvas = cv2.GaussianBlur(canvas, (7, 7), 0)
+    truth = []
+    for c in range(3):
+        x = c * col_w + pad
+        chosen = rng.choice(len(names), size=rng.integers(per_col[0], per_col[1] + 1), replace=False)
+        col = []
+        for k in chosen:
+            imgs = [img for t, img in templates if t == names[k]]
+            img = imgs[rng.integers(len(imgs))]
+            s = rng.uniform(lo, hi)
+            img = cv2.resize(img, (max(1, int(img.shape[1] * s)), max(1, int(img.shape[0] * s))))
+            h, w = img.shape[:2]
+            y = pad + int(rng.integers(0, height - h - 2 * pad + 1))
+            canvas[y:y + h, x:x + w] = img
+            x += w + pad
+            col.append(names[k])
+        truth.append(sorted(col))
+    return canvas, truth
+
+
+def make_inventory(n, rng):
+    """產生 n 張與 mezastar_db.json 相同格式的卡片 (轉成 cardmodel.Card，與從資料庫載入時相同)。"""
+    types = battle.POKEMON_TYPES[:-1]
+    cards = []
+    for i in range(n):
+        tag = battle.SPECIAL_TAGS[rng.integers(len(battle.SPECIAL_TAGS))]
+        cards.append({
+            "name": f"bench-{i:05d}",
+            "attack": int(rng.integers(60, 200)), "sp_attack": int(rng.integers(60, 200)),
+            "tag": tag,
+            "type": types[rng.integers(len(types))],
+            "type2": battle.POKEMON_TYPES[rng.integers(len(battle.POKEMON_TYPES))],
+            "moves": [
+                {"name": f"招式{i}-{k}", "type": types[rng.integers(len(types))],
+                 "category": battle.MOVE_CATEGORIES[rng.integers(len(battle.MOVE_CATEGORIES))]}
+                for k in range(2)
+            ],
+        })
+    return cardmodel.load_cards(cards)
+
+
+def make_battle_config(rng):
+    """隨機的對手設定：一半為手動屬性，一半為偵測到的有利屬性。"""
+    types = battle.POKEMON_TYPES[:-1]
+    manual = rng.random() < 0.5
+    cfg = []
+    for _ in range(3):
+        if manual:
+            cfg.append({"manual_t1": types[rng.integers(len(types))], "manual_t2": "無", "detected_weakness": []})
+        else:
+            weak = list(rng.choice(types, size=rng.integers(1, 4), replace=False))
+            cfg.append({"manual_t1": "無", "manual_t2": "無", "detected_weakness": weak})
+    return cfg
+
+
+# --- 量測 ---
+def summarize(latencies, items=1):
+    lat = np.asarray(latencies) * 1000
+    return {
+        "n": len(lat),
+        "p50_ms": float(np.percentile(lat, 50)), "p90_ms": float(np.percentile(lat, 90)),
+        "p99_ms": float(np.percentile(lat, 99)), "max_ms": float(lat.max()),
+        "throughput_per_s": items * len(lat) / (lat.sum() / 1000) if lat.sum() else float("inf"),
+    }
+
+
+def peak_memory(fn):
+    """以 tracemalloc 量測 fn() 期間 Python/NumPy 配置的記憶體峰值 (MB)。另外跑一次，不影響計時。"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def max_rss_mb():
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def bench_detection(groups, strips, configs, workers):
+    """configs 為 [(比對模式, 比對特徵, 是否色相預篩), ...]。"""
+    results = []
+    for mode, features, prefilter in configs:
+        opts = dict(mode=mode, workers=workers, features=features, prefilter=prefilter)
+        latencies, tp, n_det, n_truth = [], 0, 0, 0
+        detector.detect_icons(strips[0][0], groups, **opts) # 預熱 (含建立灰階/邊緣範本)
+        for img, truth in strips:
+            start = time.perf_counter()
+            hits = detector.detect_icons(img, groups, **opts)
+            latencies.append(time.perf_counter() - start)
+            found = {(t, i) for i, col in enumerate(detector.hits_to_columns(hits)) for t in col}
+            expected = {(t, i) for i, col in enumerate(truth) for t in col}
+            tp, n_det, n_truth = tp + len(found & expected), n_det + len(found), n_truth + len(expected)
+        case = "/".join([mode, features] + (["hue"] if prefilter else []))
+        row = {"bench": "detect", "case": case, **summarize(latencies)}
+        row.update(precision=tp / n_det if n_det else 1.0, recall=tp / n_truth if n_truth else 1.0,
+                   peak_mb=peak_memory(lambda: detector.detect_icons(strips[0][0], groups, **opts)))
+        results.append(row)
+    return results
+
+
+def bench_scoring(sizes, rounds, top_k, rng):
+    results = []
+    for n in sizes:
+        cards = make_inventory(n, rng)
+        start = time.perf_counter()
+        table = battle.EncodedInventory(cards)
+        build = time.perf_counter() - start
+        cfgs = [make_battle_config(rng) for _ in range(rounds)]
+        latencies = []
+        for cfg in cfgs:
+            start = time.perf_counter()
+            cands = battle.score_candidates(table, cfg)
+            battle.solve_teams(cands, size=3, top_k=top_k)
+            latencies.append(time.perf_counter() - start)
+        row = {"bench": "score", "case": f"{n} cards", **summarize(latencies)}
+        row.update(build_ms=build * 1000,
+                   peak_mb=peak_memory(lambda: battle.solve_teams(battle.score_candidates(battle.EncodedInventory(cards), cfgs[0]), size=3, top_k=top_k)))
+        results.append(row)
+    return results
+
+
+def print_table(rows):
+    cols = ["bench", "case", "n", "p50_ms", "p90_ms", "p99_ms", "throughput_per_s", "precision", "recall", "build_ms", "peak_mb"]
+    fmt = lambda v: "-" if v is None else (f"{v:.3f}" if isinstance(v, float) else str(v))
+    table = [cols] + [[fmt(r.get(c)) for c in cols] for r in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(cols))]
+    for line in table:
+        print("  ".join(v.rjust(w) for v, w in zip(line, widths)))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="辨識與隊伍計算的效能測試 (合成資料)。")
+    ap.add_argument("--icons", default="att_icon", help="圖示範本資料夾")
+    ap.add_argument("--strips", type=int, default=20, help="合成截圖張數")
+    ap.add_argument("--modes", default=",".join(detector.DETECT_MODES), help="要測的比對模式 (逗號分隔)")
+    ap.add_argument("--features", default="bgr", help=f"要測的比對特徵 (逗號分隔，可用 {','.join(detector.MATCH_FEATURES)})")
+    ap.add_argument("--prefilter", default="off", help="色相預篩 (off / on / off,on)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="辨識時的執行緒數")
+    ap.add_argument("--sizes", default="100,1000,10000", help="卡片庫大小 (逗號分隔)")
+    ap.add_argument("--rounds", type=int, default=50, help="每個卡片庫大小的計算次數")
+    ap.add_argument("--top-k", type=int, default=1, help="每次計算的隊伍數")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--skip-detect", action="store_true")
+    ap.add_argument("--skip-score", action="store_true")
+    ap.add_argument("--json", help="另外把結果寫成 JSON 檔 (方便比較不同版本)")
+    args = ap.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    rows = []
+    if not args.skip_detect:
+        groups = detector.get_template_bank(args.icons).groups
+        if not groups: ap.error(f"{args.icons} 內沒有範本")
+        strips = [make_strip(rng, groups) for _ in range(args.strips)]
+        configs = [(m, f, p == "on") for m in args.modes.split(",") if m
+                   for f in args.features.split(",") if f
+                   for p in args.prefilter.split(",") if p]
+        rows += bench_detection(groups, strips, configs, args.workers)
+    if not args.skip_score:
+        sizes = [int(s) for s in args.sizes.split(",") if s]
+        rows += bench_scoring(sizes, args.rounds, args.top_k, rng)
+
+    print_table(rows)
+    rss = max_rss_mb()
+    if rss is not None: print(f"\n行程記憶體峰值 (max RSS): {rss:.1f} MB")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "max_rss_mb": rss, "results": rows}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+卡片正面圖片的影像索引 (不依賴 Streamlit)。
+每張 cardinfo/*_前.png 存一組感知雜湊 (pHash + dHash) 與 ORB 特徵，索引存在 SQLite，
+只重新計算新增或變動的圖檔。上傳的照片可用來：
+- 找出最像的已知卡片：ORB 描述子以多組位元取樣雜湊成「字」，用倒排索引對所有卡片計分，
+  只對前幾名做特徵比對 + RANSAC 幾何驗證 (照片有背景、角度或光線差異也能比對)；
+- 偵測重複上傳 (感知雜湊幾乎相同)。
+"""
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+import numpy as np
+import cv2
+from PIL import Image
+
+FRONT_SUFFIX = "_前.png"
+FEATURE_EDGE = 480     # 計算特徵前把長邊縮到這個大小
+ORB_FEATURES = 300     # 每張圖保留的 ORB 特徵點數
+RATIO = 0.8            # 最近/次近距離比 (Lowe ratio test)
+MIN_INLIERS = 25       # 幾何驗證後至少要有的對應點數，低於此值視為不認識 (卡片共有的版面約 10~20 點)
+VERIFY_CANDIDATES = 8  # 倒排索引計分後取前幾名做幾何驗證
+DUPLICATE_BITS = 6     # pHash 與 dHash 的漢明距離都不超過此值時視為重複的圖
+WORD_TABLES = 4        # 每個描述子雜湊成幾個字 (每組取不同的位元)
+WORD_BITS = 12         # 每個字取描述子的幾個位元
+_WORD_POSITIONS = np.random.default_rng(0).permutation(256)[:WORD_TABLES * WORD_BITS].reshape(WORD_TABLES, WORD_BITS) # 固定不變，索引檔才能沿用
+
+# 比對結果：inliers 為幾何驗證通過的對應點數，hash_distance 為感知雜湊的漢明距離 (pHash + dHash)
+CardMatch = namedtuple("CardMatch", ["name", "path", "inliers", "hash_distance", "duplicate"])
+
+
+# --- 特徵計算 ---
+def load_gray(source, edge=FEATURE_EDGE):
+    """讀取圖檔 (路徑或檔案物件) 為灰階，長邊縮到 edge 以內。透明背景以白色填滿。"""
+    with Image.open(source) as img:
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            bg = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(bg, img)
+        gray = np.array(img.convert("L"))
+    scale = edge / max(gray.shape)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def image_hashes(gray):
+    """回傳 (pHash, dHash)，各為 64 位元整數。"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    dct = cv2.dct(small)[:8, :8].flatten()
+    phash = _pack_bits(dct > np.median(dct[1:]))
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    dhash = _pack_bits((small[:, 1:] > small[:, :-1]).flatten())
+    return phash, dhash
+
+
+def _pack_bits(bits):
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+_orb = threading.local() # cv2.ORB 物件不保證可跨執行緒共用
+
+def orb_features(gray):
+    """回傳 (特徵點座標 N x 2 float32, 描述子 N x 32 uint8)。"""
+    orb = getattr(_orb, "detector", None)
+    if orb is None: orb = _orb.detector = cv2.ORB_create(nfeatures=ORB_FEATURES)
+    keypoints, descriptors = orb.detectAndCompute(gray, None)
+    if descriptors is None: return np.zeros((0, 2), np.float32), np.zeros((0, 32), np.uint8)
+    return np.float32([kp.pt for kp in keypoints]), descriptors
+
+
+def hamming64(values, q):
+    """values (uint64 陣列) 與 q 的漢明距離。"""
+    return _popcount(np.bitwise_xor(values, np.uint64(q))).astype(np.int64)
+
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else: # numpy 2.0 之前沒有 bitwise_count：拆成位元組再數 1 的個數
+    def _popcount(values):
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        return np.unpackbits(values.view(np.uint8).reshape(values.shape + (8,)), axis=-1).sum(axis=-1)
+
+
+def descriptor_words(descriptors):
+    """每個描述子的 WORD_TABLES 個字 (N x WORD_TABLES)，不同組的字編號不重疊。"""
+    bits = np.unpackbits(descriptors, axis=1)[:, _WORD_POSITIONS].astype(np.int64) # N x 組 x 位元
+    words = (bits << np.arange(WORD_BITS)).sum(axis=2)
+    return words + (np.arange(WORD_TABLES) << WORD_BITS)
+
+
+# --- 索引 ---
+class CardImageIndex:
+    """
+    image_dir 內所有卡片正面圖的索引 (存在 db_path)。
+    refresh() 依檔案大小與修改時間只重新計算變動的圖檔；add() / remove() 更新單一圖檔。
+    """
+
+    def __init__(self, db_path, image_dir):
+        self.image_dir = image_dir
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS images (
+            file TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+            phash BLOB NOT NULL, dhash BLOB NOT NULL, points BLOB NOT NULL, descriptors BLOB NOT NULL)""")
+        self._arrays = None # 比對用的陣列，變動後下次比對時重建
+
+    @staticmethod
+    def card_name(file_name):
+        return file_name[:-len(FRONT_SUFFIX)]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def refresh(self):
+        """同步資料夾內容，回傳 (新增或更新數, 移除數)。"""
+        with self._lock:
+            known = {f: (s, m) for f, s, m in self._conn.execute("SELECT file, size, mtime_ns FROM images")}
+        current = {}
+        if os.path.isdir(self.image_dir):
+            for e in os.scandir(self.image_dir):
+                if e.is_file() and e.name.endswith(FRONT_SUFFIX):
+                    st = e.stat()
+                    current[e.name] = (st.st_size, st.st_mtime_ns)
+        changed = [f for f, sig in current.items() if known.get(f) != sig]
+        removed = [f for f in known if f not in current]
+        for f in changed: self.add(os.path.join(self.image_dir, f))
+        for f in removed: self.remove(f)
+        return len(changed), len(removed)
+
+    def add(self, path):
+        """新增或更新一張正面圖 (save_card_images 寫檔後呼叫)。"""
+        st = os.stat(path)
+        gray = load_gray(path)
+        phash, dhash = image_hashes(gray)
+        points, descriptors = orb_features(gray)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                os.path.basename(path), st.st_size, st.st_mtime_ns, phash.to_bytes(8, "big"), dhash.to_bytes(8, "big"),
+                points.tobytes(), descriptors.tobytes()))
+            self._arrays = None
+
+    def remove(self, file_name):
+        with self._lock:
+            self._conn.execute("DELETE FROM images WHERE file = ?", (os.path.basename(file_name),))
+            self._arrays = None
+
+    def _load_arrays(self):
+        with self._lock:
+            if self._arrays is not None: return self._arrays
+            rows = self._conn.execute("SELECT file, phash, dhash, points, descriptors FROM images ORDER BY file").fetchall()
+            files = [r[0] for r in rows]
+            phash = np.array([int.from_bytes(r[1], "big") for r in rows], dtype=np.uint64)
+            dhash = np.array([int.from_bytes(r[2], "big") for r in rows], dtype=np.uint64)
+            points = [np.frombuffer(r[3], np.float32).reshape(-1, 2) for r in rows]
+            descs = [np.frombuffer(r[4], np.uint8).reshape(-1, 32) for r in rows]
+            # 倒排索引：依字排序的 (字, 卡片)，postings[w]:postings[w + 1] 為含有字 w 的卡片
+            n_words = WORD_TABLES << WORD_BITS
+            words = np.concatenate([descriptor_words(d).ravel() for d in descs if len(d)] or [np.zeros(0, np.int64)])
+            owners = np.concatenate([np.full(len(d) * WORD_TABLES, i) for i, d in enumerate(descs) if len(d)] or [np.zeros(0, np.int64)])
+            order = np.argsort(words, kind="stable")
+            counts = np.bincount(words, minlength=n_words)
+            postings = np.concatenate([[0], np.cumsum(counts)])
+            idf = np.log1p(len(rows) / np.maximum(counts, 1)) # 常見的字權重低
+            norm = np.sqrt(np.maximum([len(d) for d in descs], 1)) if descs else np.ones(0)
+            self._arrays = (files, phash, dhash, points, descs, owners[order], postings, idf, norm)
+            return self._arrays
+
+    def _verify(self, q_points, q_desc, candidates, points, descs):
+        """
+        與候選卡片的特徵一起比對：每個查詢特徵找最近的兩個，通過 ratio test (或兩個都屬於同一張卡片)
+        才算數，因此各卡片共有的版面 (外框、文字欄) 不會被當成證據。回傳 {卡片: RANSAC 後的對應點數}。
+        """
+        candidates = [c for c in candidates if len(descs[c])]
+        if not candidates: return {}
+        train = np.concatenate([descs[c] for c in candidates])
+        owner = np.repeat(candidates, [len(descs[c]) for c in candidates])
+        offset = dict(zip(candidates, np.cumsum([0] + [len(descs[c]) for c in candidates[:-1]])))
+        pairs = {}
+        for m in cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(q_desc, train, k=2):
+            if not m: continue
+            best = m[0]
+            card = int(owner[best.trainIdx])
+            if len(m) == 1 or best.distance < RATIO * m[1].distance or card == owner[m[1].trainIdx]:
+                pairs.setdefault(card, []).append((best.queryIdx, best.trainIdx - offset[card]))
+        found = {}
+        for card, matched in pairs.items():
+            if len(matched) < MIN_INLIERS: continue
+            src = q_points[[q for q, _ in matched]]
+            dst = points[card][[t for _, t in matched]]
+            _, mask = cv2.findHomography(src, dst, cv2.RANSAC, 8.0)
+            if mask is not None and mask.sum() >= MIN_INLIERS: found[card] = int(mask.sum())
+        return found
+
+    def match(self, source, top_k=3):
+        """
+        找出與上傳圖片 (路徑或檔案物件) 最像的卡片，回傳依可信度排序的 CardMatch 清單 (最多 top_k 筆)。
+        重複的圖 (感知雜湊幾乎相同) 一定會列在最前面；其餘需通過幾何驗證。
+        """
+        files, phash, dhash, points, descs, posting_cards, postings, idf, norm = self._load_arrays()
+        if not files: return []
+        gray = load_gray(source)
+        q_phash, q_dhash = image_hashes(gray)
+        dist_p, dist_d = hamming64(phash, q_phash), hamming64(dhash, q_dhash)
+        duplicate = (dist_p <= DUPLICATE_BITS) & (dist_d <= DUPLICATE_BITS)
+
+        inliers = {}
+        q_points, q_desc = orb_features(gray)
+        if len(q_desc) >= 2:
+            # 以倒排索引對所有卡片計分 (共同的字越多、越少見，分數越高)，只驗證前幾名
+            words, n = np.unique(descriptor_words(q_desc), return_counts=True)
+            starts, ends = postings[words], postings[words + 1]
+            hit = np.concatenate([posting_cards[a:b] for a, b in zip(starts, ends)])
+            weight = np.repeat(idf[words] * n, ends - starts)
+            scores = np.bincount(hit, weights=weight, minlength=len(files)) / norm
+            shortlist = [int(c) for c in np.argsort(-scores)[:VERIFY_CANDIDATES] if scores[c] > 0]
+            inliers = self._verify(q_points, q_desc, shortlist, points, descs)
+
+        candidates = set(inliers) | set(np.flatnonzero(duplicate).tolist())
+        ranked = sorted(candidates, key=lambda i: (not duplicate[i], -inliers.get(i, 0), dist_p[i] + dist_d[i]))
+        return [CardMatch(self.card_name(files[i]), os.path.join(self.image_dir, files[i]), inliers.get(i, 0),
+                          int(dist_p[i] + dist_d[i]), bool(duplicate[i])) for i in ranked[:top_k]]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_card_index(db_path, image_dir):
+    """取得共用的卡片圖片索引 (每個索引檔在行程中只開啟一次，開啟時同步資料夾內容)。"""
+    key = os.path.abspath(db_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = CardImageIndex(db_path, image_dir)
+            index.refresh()
+        return index
@@ -0,0 +1,283 @@
+"""
+卡片資料模型 (不依賴 Streamlit)。
+卡片在載入/匯入時驗證一次並轉成 Card (__slots__ 物件)：屬性、特殊能力、招式分類存成整數代碼，
+選填欄位的預設值 (攻擊/特攻 100、屬性2「無」) 也在這時補上，之後的程式不必再對 dict 與字串做處理。
+to_dict() 還原成與 mezastar_db.json 相同的格式 (原本缺少的欄位與未知欄位都會照原樣保留)。
+"""
+import threading
+
+import numpy as np
+
+POKEMON_TYPES = ["一般", "火", "水", "草", "電", "冰", "格鬥", "毒", "地面", "飛行", "超能力", "蟲", "岩石", "幽靈", "龍", "惡", "鋼", "妖精", "無"]
+SPECIAL_TAGS = ["無", "Mega進化", "Z招式", "極巨化", "太晶化", "特別聯手對戰", "雙重招式"]
+MOVE_CATEGORIES = ["攻擊", "特攻"]
+
+
+class CardFormatError(ValueError):
+    """卡片資料的格式不正確 (缺少必要欄位或型別錯誤)。"""
+
+
+class Codebook:
+    """
+    字串 ↔ 整數代碼。已知的值依清單順序編號，資料中出現的其他字串依序接在後面
+    (只會增加不會改號，因此代碼可以長期保存在陣列中)。
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+        self.index = {v: i for i, v in enumerate(self.values)}
+        self.known = len(self.values)
+        self._lock = threading.Lock()
+
+    def code(self, value):
+        """
+        字串 → 代碼 (沒看過的字串會加入)。
+        新字串先加進 values 再寫入 index：不持有 lock 的讀取端從 index 拿到的代碼一定查得到 values。
+        """
+        code = self.index.get(value)
+        if code is None:
+            with self._lock:
+                code = self.index.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(value)
+                    self.index[value] = code
+        return code
+
+    def lookup(self, value):
+        """字串 → 代碼 (沒看過的字串回傳 None)。"""
+        return self.index.get(value)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+TYPES = Codebook(POKEMON_TYPES)
+TAGS = Codebook(SPECIAL_TAGS)
+CATEGORIES = Codebook(MOVE_CATEGORIES)
+NO_TYPE = TYPES.lookup("無")
+NO_TAG = TAGS.lookup("無")
+ATTACK = CATEGORIES.lookup("攻擊")
+
+DEFAULT_STAT = 100
+_NO_ABSENT = frozenset()
+
+
+def _require(d, key, kinds, what):
+    value = d.get(key)
+    if not isinstance(value, kinds) or isinstance(value, bool):
+        raise CardFormatError(f"{what}的「{key}」格式不正確: {value!r}")
+    return value
+
+
+class Move:
+    """一個招式。type / category 為代碼；category 為 None 表示原始資料沒有分類。"""
+    __slots__ = ("name", "type", "category", "extra")
+
+    def __init__(self, name, type, category, extra=None):
+        self.name = name
+        self.type = type
+        self.category = category
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d, what="招式"):
+        if not isinstance(d, dict): raise CardFormatError(f"{what}不是物件: {d!r}")
+        name = _require(d, "name", str, what)
+        type_code = TYPES.code(_require(d, "type", str, what))
+        category = CATEGORIES.code(_require(d, "category", str, what)) if "category" in d else None
+        extra = {k: v for k, v in d.items() if k not in ("name", "type", "category")} or None
+        return cls(name, type_code, category, extra)
+
+    def to_dict(self):
+        d = {"name": self.name, "type": TYPES[self.type]}
+        if self.category is not None: d["category"] = CATEGORIES[self.category]
+        if self.extra: d.update(self.extra)
+        return d
+
+    @property
+    def type_name(self):
+        return TYPES[self.type]
+
+    @property
+    def category_name(self):
+        return None if self.category is None else CATEGORIES[self.category]
+
+    @property
+    def is_attack(self):
+        return self.category == ATTACK
+
+    @property
+    def label(self):
+        return f"{self.name}({TYPES[self.type]})"
+
+
+class Card:
+    """
+    一張卡片。tag / type / type2 為代碼，moves 為 Move 的 tuple。
+    卡片庫以物件身分辨識卡片 (見 storage.SharedInventory)，修改卡片時請建立新的 Card。
+    """
+    __slots__ = ("name", "attack", "sp_attack", "tag", "type", "type2", "moves", "absent", "extra")
+    OPTIONAL = ("attack", "sp_attack", "type2")     # 可省略的欄位 (載入時補上預設值)
+    FIELDS = ("name", "attack", "sp_attack", "tag", "type", "type2", "moves")
+
+    def __init__(self, name, attack, sp_attack, tag, type, type2, moves, absent=_NO_ABSENT, extra=None):
+        self.name = name
+        self.attack = attack
+        self.sp_attack = sp_attack
+        self.tag = tag
+        self.type = type
+        self.type2 = type2
+        self.moves = moves
+        self.absent = absent # 原始資料沒有的選填欄位 (to_dict 時不輸出)
+        self.extra = extra   # 不認識的欄位，照原樣保留
+
+    @classmethod
+    def from_dict(cls, d):
+        """驗證並轉換一筆 JSON 卡片資料；格式不正確時拋出 CardFormatError。"""
+        if not isinstance(d, dict): raise CardFormatError(f"卡片不是物件: {d!r}")
+        name = _require(d, "name", str, "卡片")
+        what = f"卡片「{name}」"
+        moves = d.get("moves")
+        if not isinstance(moves, list): raise CardFormatError(f"{what}的「moves」格式不正確: {moves!r}")
+        absent = frozenset(k for k in cls.OPTIONAL if k not in d) or _NO_ABSENT
+        return cls(
+            name,
+            DEFAULT_STAT if "attack" in absent else _require(d, "attack", (int, float), what),
+            DEFAULT_STAT if "sp_attack" in absent else _require(d, "sp_attack", (int, float), what),
+            TAGS.code(_require(d, "tag", str, what)),
+            TYPES.code(_require(d, "type", str, what)),
+            NO_TYPE if "type2" in absent else TYPES.code(_require(d, "type2", str, what)),
+            tuple(Move.from_dict(m, f"{what}的招式") for m in moves),
+            absent,
+            {k: v for k, v in d.items() if k not in cls.FIELDS} or None,
+        )
+
+    def to_dict(self):
+        """還原成 JSON 格式的 dict (與載入前的資料相同)。"""
+        d = {"name": self.name}
+        if "attack" not in self.absent: d["attack"] = self.attack
+        if "sp_attack" not in self.absent: d["sp_attack"] = self.sp_attack
+        d["tag"] = TAGS[self.tag]
+        d["type"] = TYPES[self.type]
+        if "type2" not in self.absent: d["type2"] = TYPES[self.type2]
+        d["moves"] = [m.to_dict() for m in self.moves]
+        if self.extra: d.update(self.extra)
+        return d
+
+    def __reduce__(self):
+        # 以 JSON 格式傳給其他行程，代碼在對方行程重新編號 (未知字串的代碼各行程可能不同)
+        return (Card.from_dict, (self.to_dict(),))
+
+    def __repr__(self):
+        return f"Card({self.name!r})"
+
+    @property
+    def tag_name(self):
+        return TAGS[self.tag]
+
+    @property
+    def type_name(self):
+        return TYPES[self.type]
+
+    @property
+    def type2_name(self):
+        return TYPES[self.type2]
+
+    @property
+    def has_tag(self):
+        return self.tag != NO_TAG
+
+
+def as_card(card):
+    """Card 原樣回傳；dict 則驗證並轉換。"""
+    return card if isinstance(card, Card) else Card.from_dict(card)
+
+
+def load_cards(data):
+    """把 JSON 卡片清單轉成 Card 清單；格式錯誤時拋出 CardFormatError (指出第幾張)。"""
+    cards = []
+    for i, d in enumerate(data):
+        try:
+            cards.append(as_card(d))
+        except CardFormatError as e:
+            raise CardFormatError(f"第 {i + 1} 張: {e}") from None
+    return cards
+
+
+# --- 卡片庫檢視 (篩選/搜尋用的索引) ---
+class InventoryView:
+    """
+    唯讀卡片清單的索引 (清單不可再被修改，見 storage.SharedInventory)，每個卡片庫版本只建立一次：
+    - by_type / by_move_type / by_tag: 代碼 -> 含該屬性 (屬性1或2) / 招式屬性 / 特殊能力的卡片位置 (遞增的 int 陣列)。
+    - 攻擊 / 特攻各依數值排序，範圍查詢只需二分搜尋。
+    filter() 回傳符合條件的卡片位置；memo() 可讓呼叫端把衍生資料 (例如顯示用的表格) 一起快取。
+    """
+
+    def __init__(self, cards, version=None):
+        self.cards = cards
+        self.version = version
+        self.labels = [f"{i + 1}. {c.name}" for i, c in enumerate(cards)] # 選單顯示文字
+        # 搜尋用文字：名稱與招式名稱 (不分大小寫)
+        self._text = ["\t".join([c.name] + [m.name for m in c.moves]).casefold() for c in cards]
+        by_type, by_move_type, by_tag = {}, {}, {}
+        for i, c in enumerate(cards):
+            by_type.setdefault(c.type, []).append(i)
+            if c.type2 not in (NO_TYPE, c.type): by_type.setdefault(c.type2, []).append(i)
+            for t in {m.type for m in c.moves}: by_move_type.setdefault(t, []).append(i)
+            by_tag.setdefault(c.tag, []).append(i)
+        as_index = lambda d: {k: np.array(v, dtype=np.int32) for k, v in sorted(d.items())}
+        self.by_type, self.by_move_type, self.by_tag = as_index(by_type), as_index(by_move_type), as_index(by_tag)
+        self._ranges = {}
+        for field in ("attack", "sp_attack"):
+            values = np.array([getattr(c, field) for c in cards]) # 全為整數時維持整數 (滑桿以整數顯示)
+            order = np.argsort(values, kind="stable").astype(np.int32)
+            self._ranges[field] = (order, values[order])
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cards)
+
+    def bounds(self, field):
+        """field ("attack"/"sp_attack") 的 (最小值, 最大值)；沒有卡片時為 None。"""
+        _, values = self._ranges[field]
+        return (values[0].item(), values[-1].item()) if len(values) else None
+
+    def _in_range(self, field, lo, hi):
+        order, values = self._ranges[field]
+        return np.sort(order[np.searchsorted(values, lo, "left"):np.searchsorted(values, hi, "right")])
+
+    @staticmethod
+    def _union(index, codes):
+        hits = [index[c] for c in codes if c in index]
+        return np.unique(np.concatenate(hits)) if hits else np.empty(0, dtype=np.int32)
+
+    def filter(self, text="", types=(), move_types=(), tags=(), attack=None, sp_attack=None):
+        """
+        回傳符合條件的卡片位置 (遞增)。同一條件內的多個代碼為「或」，不同條件之間為「且」；
+        attack / sp_attack 為 (最小值, 最大值) (含兩端)；text 比對名稱與招式名稱 (不分大小寫)。
+        """
+        result = None
+        def narrow(pos):
+            nonlocal result
+            result = pos if result is None else np.intersect1d(result, pos, assume_unique=True)
+        for index, codes in ((self.by_type, types), (self.by_move_type, move_types), (self.by_tag, tags)):
+            if codes: narrow(self._union(index, codes))
+        for field, rng in (("attack", attack), ("sp_attack", sp_attack)):
+            if rng is not None: narrow(self._in_range(field, *rng))
+        if result is None: result = np.arange(len(self.cards), dtype=np.int32)
+        text = text.strip().casefold()
+        if text: # 只在前面條件篩剩的卡片中搜尋
+            result = np.array([i for i in result.tolist() if text in self._text[i]], dtype=np.int32)
+        return result
+
+    def memo(self, name, factory):
+        """取得 (第一次時以 factory(self) 建立) 依這個版本快取的衍生資料。"""
+        with self._lock:
+            value = self._memo.get(name)
+            if value is None: value = self._memo[name] = factory(self)
+            return value
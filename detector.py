@@ -0,0 +1,735 @@
+"""
+屬性圖示辨識核心 (不依賴 Streamlit，可供 app.py 與其他工具共用)。
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import cv2
+
+# 多尺度比對：只做微幅調整 (0.9 ~ 1.1)
+# 因為範本和截圖都來自同一支手機/螢幕，大小應該極為接近
+SCALES = tuple(float(s) for s in np.linspace(0.9, 1.1, 3))
+MATCH_THRESHOLD = 0.70 # 信心門檻
+
+# 由粗到細 (coarse-to-fine) 搜尋參數
+COARSE_FACTOR = 0.5       # 粗搜尋時影像與範本的縮小比例
+COARSE_THRESHOLD = 0.55   # 粗搜尋門檻 (較寬鬆，只用來產生候選位置)
+COARSE_MIN_SIZE = 8       # 縮小後範本邊長低於此值時，直接用原圖解析度比對
+
+# 比對特徵：通道越少越快，但分數分布不同，各自有門檻 (比對門檻, 粗搜尋門檻)
+# 灰階/邊緣的門檻以 bench.py 的合成截圖校正，讓召回率接近彩色比對 (精確度較低，建議搭配色相預篩)
+MATCH_FEATURES = {
+    "bgr": "彩色 (原始)",
+    "gray": "灰階",
+    "edge": "邊緣 (梯度強度)",
+}
+FEATURE_THRESHOLDS = {
+    "bgr": (MATCH_THRESHOLD, COARSE_THRESHOLD),
+    "gray": (0.65, 0.50),
+    "edge": (0.45, 0.35),
+}
+
+# 色相預篩：屬性圖示以顏色區分，先用色相直方圖排除畫面中沒有該顏色的屬性，再做比對
+HUE_BINS = 18           # OpenCV 色相 0~179，每格 10 度
+HUE_MIN_SAT = 80        # 飽和度/亮度高於此值的像素才算有顏色
+HUE_MIN_VAL = 60
+HUE_SIGNATURE_SHARE = 0.10 # 占範本有色像素 10% 以上的色相格視為該範本的顏色特徵
+HUE_MIN_COLORED = 0.15  # 有色像素少於範本面積的 15% (例如一般、惡) 時無法預篩，一律保留
+PREFILTER_RATIO = 0.5   # 畫面中特徵色相的像素需達到 (最小尺度下) 範本的一半以上
+
+
+# --- 範本庫 (Template Bank) ---
+RESCAN_INTERVAL = 2.0 # 距離上次檢查範本資料夾不到這麼多秒時，直接沿用已載入的範本 (本程式的變更會呼叫 invalidate())
+class IconTemplate:
+    """單一範本：原圖 + 各尺度縮放後的版本 (載入時預先算好)。"""
+    __slots__ = ("filename", "type_name", "image", "scaled", "coarse", "_variants", "_hue")
+
+    def __init__(self, filename, type_name, image, scales=SCALES):
+        self.filename = filename
+        self.type_name = type_name
+        self.image = image
+        self._variants = {} # 比對特徵 -> 轉換後的 IconTemplate (第一次使用時建立)
+        self._hue = None
+        # 格式: [(scale, resized_image), ...]
+        self.scaled = []
+        t_h, t_w = image.shape[:2]
+        for scale in scales:
+            curr_tw, curr_th = int(t_w * scale), int(t_h * scale)
+            if curr_tw <= 0 or curr_th <= 0: continue
+            self.scaled.append((scale, cv2.resize(image, (curr_tw, curr_th))))
+        # 粗搜尋用的縮小版本，與 scaled 一一對應 (太小則為 None)
+        self.coarse = []
+        for _, resized in self.scaled:
+            r_h, r_w = resized.shape[:2]
+            c_w, c_h = int(r_w * COARSE_FACTOR), int(r_h * COARSE_FACTOR)
+            if min(c_w, c_h) < COARSE_MIN_SIZE:
+                self.coarse.append(None)
+            else:
+                self.coarse.append(cv2.resize(resized, (c_w, c_h), interpolation=cv2.INTER_AREA))
+
+    def variant(self, features):
+        """回傳以指定比對特徵 (見 MATCH_FEATURES) 轉換後的範本，各尺度同樣預先縮放。"""
+        if features == "bgr": return self
+        templ = self._variants.get(features)
+        if templ is None:
+            templ = self._variants[features] = IconTemplate(self.filename, self.type_name, to_features(self.image, features))
+        return templ
+
+    def hue_signature(self):
+        """回傳 (特徵色相格 bool 陣列, 這些色相格的像素數)；有色像素太少時回傳 None (無法預篩)。"""
+        if self._hue is None:
+            hist = hue_histogram(self.image)
+            total = hist.sum()
+            self._hue = False # 無法預篩
+            if total >= HUE_MIN_COLORED * self.image.shape[0] * self.image.shape[1]:
+                bins = hist >= HUE_SIGNATURE_SHARE * total
+                self._hue = (bins, float(hist[bins].sum()))
+        return self._hue or None
+
+
+def to_features(img, features):
+    """把 BGR 影像轉為比對特徵：bgr 不變、gray 為灰階、edge 為梯度強度 (float32)。"""
+    if features == "bgr": return img
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if features == "gray": return gray
+    if features == "edge":
+        blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+        gx = cv2.Sobel(blurred, cv2.CV_32F, 1, 0, ksize=3)
+        gy = cv2.Sobel(blurred, cv2.CV_32F, 0, 1, ksize=3)
+        return cv2.magnitude(gx, gy)
+    raise ValueError(f"未知的比對特徵: {features}")
+
+
+def hue_histogram(img):
+    """有色像素 (飽和度/亮度夠高) 的色相直方圖 (HUE_BINS 格)。"""
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    mask = ((hsv[..., 1] >= HUE_MIN_SAT) & (hsv[..., 2] >= HUE_MIN_VAL)).astype(np.uint8)
+    return cv2.calcHist([hsv], [0], mask, [HUE_BINS], [0, 180]).ravel()
+
+
+class TemplateBank:
+    """
+    整個行程共用的範本庫。
+    第一次使用時讀取 ICON_DIR 內所有 PNG 並預先縮放，之後常駐記憶體；
+    資料夾內容 (檔名/大小/修改時間) 改變或呼叫 invalidate() 時才重新載入；
+    資料夾最多每 RESCAN_INTERVAL 秒檢查一次 (其他程式修改範本時最晚在這段時間後生效)。
+    """
+
+    def __init__(self, icon_dir):
+        self.icon_dir = icon_dir
+        self._lock = threading.Lock()
+        self._signature = None
+        self._groups = {}
+        self._checked = 0.0 # 上次檢查資料夾的時間 (time.monotonic)
+
+    def _scan_signature(self):
+        if not os.path.isdir(self.icon_dir):
+            return ()
+        entries = []
+        with os.scandir(self.icon_dir) as it:
+            for e in it:
+                if e.name.endswith(".png") and e.is_file():
+                    info = e.stat()
+                    entries.append((e.name, info.st_size, info.st_mtime_ns))
+        entries.sort()
+        return tuple(entries)
+
+    def _load(self, signature):
+        groups = {}
+        for filename, _, _ in signature:
+            # 檔名格式: {屬性}.png 或 {屬性}_{timestamp}.png
+            type_name = os.path.splitext(filename)[0].split("_")[0]
+            t_img = cv2.imread(os.path.join(self.icon_dir, filename))
+            if t_img is None: continue
+            groups.setdefault(type_name, []).append(IconTemplate(filename, type_name, t_img))
+        return groups
+
+    def invalidate(self):
+        """範本新增/刪除後呼叫，下次取用時會重新載入。"""
+        with self._lock:
+            self._signature = None
+            self._groups = {}
+            self._checked = 0.0
+
+    @property
+    def groups(self):
+        """回傳 {屬性名稱: [IconTemplate, ...]}，必要時自動重新載入。"""
+        with self._lock:
+            if self._signature is not None and time.monotonic() - self._checked < RESCAN_INTERVAL: return self._groups
+        signature = self._scan_signature()
+        with self._lock:
+            if signature != self._signature:
+                self._groups = self._load(signature)
+                self._signature = signature
+            self._checked = time.monotonic()
+            return self._groups
+
+
+_banks = {}
+_banks_lock = threading.Lock()
+
+def get_template_bank(icon_dir):
+    """取得指定資料夾的共用範本庫 (每個資料夾在行程中只會有一份)。"""
+    key = os.path.abspath(icon_dir)
+    with _banks_lock:
+        bank = _banks.get(key)
+        if bank is None:
+            bank = _banks[key] = TemplateBank(icon_dir)
+        return bank
+
+
+# --- 比對流程 ---
+# 單一命中結果：box 為在裁切圖中的 (x, y, w, h)，column 為 0=左 / 1=中 / 2=右
+IconHit = namedtuple("IconHit", ["type_name", "score", "column", "box"])
+
+DETECT_MODES = {
+    "roi": "分三區比對 (原始)",
+    "whole": "整張單次比對 + NMS",
+    "coarse": "由粗到細 + 提早結束",
+}
+NMS_IOU = 0.3 # 重疊超過此比例的命中視為同一個圖示
+
+
+def _box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0: return 0.0
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def non_max_suppression(hits, iou=NMS_IOU):
+    """依分數由高到低保留命中，移除與已保留者重疊過多的結果 (不分屬性)。"""
+    kept = []
+    for h in sorted(hits, key=lambda h: h.score, reverse=True):
+        if all(_box_iou(h.box, k.box) <= iou for k in kept):
+            kept.append(h)
+    return kept
+
+
+def hits_to_columns(hits):
+    """把命中結果整理成 [左, 中, 右] 三個屬性名稱清單 (依分數排序、不重複)。"""
+    columns = [[], [], []]
+    for h in sorted(hits, key=lambda h: h.score, reverse=True):
+        if h.type_name not in columns[h.column]:
+            columns[h.column].append(h.type_name)
+    return columns
+
+
+def _build_jobs(template_groups):
+    """展開成 (屬性, 縮放後範本) 工作清單，順序固定 (屬性 → 範本 → 尺度)。"""
+    return [(type_name, resized_templ)
+            for type_name, templ_list in template_groups.items()
+            for templ in templ_list
+            for _, resized_templ in templ.scaled]
+
+
+def _job_labels(template_groups):
+    """與 _build_jobs 同順序的範本檔名 (計時用)。"""
+    return [templ.filename
+            for templ_list in template_groups.values()
+            for templ in templ_list
+            for _ in templ.scaled]
+
+
+def _get_executor(workers):
+    """取得行程共用的執行緒池 (相同 workers 數量只建立一次)。"""
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = _executors[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="icon-match")
+        return executor
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _run_jobs(job_fn, jobs, workers=1, progress=None, timings=None, labels=None):
+    """
+    執行所有比對工作並依「工作順序」回傳結果 (與完成順序無關，確保結果穩定)。
+    OpenCV 的 matchTemplate 會釋放 GIL，因此可用執行緒池平行處理。
+    progress(完成數, 總數, 屬性名稱) 一律在呼叫端的執行緒觸發 (Streamlit 元件需要)。
+    timings (perf.StageTimer) 不為 None 時記錄每個工作的耗時：detect/屬性 與 detect/屬性/範本檔名 (labels)。
+    """
+    total = len(jobs)
+    results = [None] * total
+
+    def run(i):
+        if timings is None: return job_fn(*jobs[i])
+        start = time.perf_counter()
+        try:
+            return job_fn(*jobs[i])
+        finally:
+            seconds = time.perf_counter() - start
+            timings.add(f"detect/{jobs[i][0]}", seconds)
+            if labels: timings.add(f"detect/{jobs[i][0]}/{labels[i]}", seconds)
+
+    if workers <= 1 or total <= 1:
+        for i, job in enumerate(jobs):
+            results[i] = run(i)
+            if progress: progress(i + 1, total, job[0])
+        return results
+
+    executor = _get_executor(workers)
+    futures = {executor.submit(run, i): i for i in range(total)}
+    for done, future in enumerate(as_completed(futures), start=1):
+        i = futures[future]
+        results[i] = future.result()
+        if progress: progress(done, total, jobs[i][0])
+    return results
+
+
+def match_templates_roi(img_target, template_groups, threshold=MATCH_THRESHOLD, workers=1, progress=None, timings=None, columns=None):
+    """
+    原始做法：把裁切圖切成左/中/右三個 ROI，每個範本在每個 ROI 各比對一次。
+    每個 (屬性, 區域) 只回傳分數最高的一筆命中。
+    columns ({屬性: 區域集合}，來自 hue_prefilter) 不為 None 時，只在列出的區域比對。
+    """
+    # 定義三個區域 (左/中/右)
+    col_w = img_target.shape[1] // 3
+
+    # 建立 ROI (Region of Interest)
+    # 格式: (影像切片, 結果索引, x 位移)
+    rois = [
+        (img_target[:, 0:col_w], 0, 0),                # 左
+        (img_target[:, col_w:col_w*2], 1, col_w),      # 中
+        (img_target[:, col_w*2:], 2, col_w*2)          # 右
+    ]
+
+    def job(type_name, resized_templ):
+        found = []
+        curr_th, curr_tw = resized_templ.shape[:2]
+
+        # 範本比目標區域還大就跳過
+        if curr_th > img_target.shape[0] or curr_tw > col_w: return found
+
+        # 在三個區域中分別尋找
+        for roi_img, idx, x_off in rois:
+            if curr_tw > roi_img.shape[1] or curr_th > roi_img.shape[0]: continue
+            if columns is not None and idx not in columns[type_name]: continue
+
+            res = cv2.matchTemplate(roi_img, resized_templ, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(res)
+            if max_val >= threshold:
+                box = (max_loc[0] + x_off, max_loc[1], curr_tw, curr_th)
+                found.append(IconHit(type_name, float(max_val), idx, box))
+        return found
+
+    # 合併：每個 (屬性, 區域) 保留最高分；同分時保留工作順序較前者
+    best = {}
+    for found in _run_jobs(job, _build_jobs(template_groups), workers, progress, timings, _job_labels(template_groups)):
+        for hit in found:
+            key = (hit.type_name, hit.column)
+            if key not in best or hit.score > best[key].score:
+                best[key] = hit
+    return list(best.values())
+
+
+def _peaks(res, threshold, t_w, t_h):
+    """回傳比對結果中高於門檻的局部極大值座標 [(x, y, score), ...]。"""
+    if res.max() < threshold: return []
+    k = max(3, (min(t_w, t_h) // 2) | 1)
+    local_max = cv2.dilate(res, np.ones((k, k), np.uint8))
+    ys, xs = np.nonzero((res >= threshold) & (res >= local_max))
+    return [(int(x), int(y), float(res[y, x])) for y, x in zip(ys, xs)]
+
+
+def match_templates_whole(img_target, template_groups, threshold=MATCH_THRESHOLD, nms_iou=NMS_IOU, workers=1, progress=None, timings=None):
+    """
+    每個縮放後的範本只在整張裁切圖上比對一次 (而非三個 ROI 各一次)，
+    取出所有高於門檻的峰值，經 NMS 去除重複後，再依命中中心點的 x 座標分配到左/中/右。
+    可偵測到跨越分割線的圖示。
+    """
+    img_h, img_w = img_target.shape[:2]
+    col_w = max(1, img_w // 3)
+
+    def job(type_name, resized_templ):
+        curr_th, curr_tw = resized_templ.shape[:2]
+        if curr_th > img_h or curr_tw > img_w: return []
+
+        res = cv2.matchTemplate(img_target, resized_templ, cv2.TM_CCOEFF_NORMED)
+        return [IconHit(type_name, score, min(2, (x + curr_tw // 2) // col_w), (x, y, curr_tw, curr_th))
+                for x, y, score in _peaks(res, threshold, curr_tw, curr_th)]
+
+    candidates = []
+    for found in _run_jobs(job, _build_jobs(template_groups), workers, progress, timings, _job_labels(template_groups)):
+        candidates.extend(found)
+    return non_max_suppression(candidates, nms_iou)
+
+
+def match_templates_coarse(img_target, template_groups, threshold=MATCH_THRESHOLD, workers=1, progress=None, timings=None, coarse_threshold=COARSE_THRESHOLD):
+    """
+    由粗到細搜尋：
+    1. 在縮小的裁切圖上用縮小的範本找出候選位置 (門檻較寬鬆)。
+    2. 只在候選位置附近的原圖區域做精細比對確認。
+    3. 某個 (屬性, 區域) 一旦確認命中，就略過該屬性剩下的範本/尺度在此區域的搜尋。
+    每個屬性為一個工作 (屬性內依序處理才能提早結束)，屬性之間可平行。
+    """
+    img_h, img_w = img_target.shape[:2]
+    col_w = max(1, img_w // 3)
+    start = time.perf_counter()
+    img_small = cv2.resize(img_target, (max(1, int(img_w * COARSE_FACTOR)), max(1, int(img_h * COARSE_FACTOR))), interpolation=cv2.INTER_AREA)
+    if timings is not None: timings.add("detect/resize", time.perf_counter() - start)
+    margin = int(round(1 / COARSE_FACTOR)) + 2 # 候選位置換算回原圖時的容許誤差
+
+    def refine(type_name, resized_templ, x, y):
+        """在原圖 (x, y) 附近的小範圍內精細比對，回傳 IconHit 或 None。"""
+        curr_th, curr_tw = resized_templ.shape[:2]
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(img_w, x + curr_tw + margin), min(img_h, y + curr_th + margin)
+        window = img_target[y0:y1, x0:x1]
+        if window.shape[0] < curr_th or window.shape[1] < curr_tw: return None
+        res = cv2.matchTemplate(window, resized_templ, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(res)
+        if max_val < threshold: return None
+        bx, by = max_loc[0] + x0, max_loc[1] + y0
+        return IconHit(type_name, float(max_val), min(2, (bx + curr_tw // 2) // col_w), (bx, by, curr_tw, curr_th))
+
+    def search(type_name, templ, confirmed):
+        """以單一範本的各尺度搜尋，把確認的命中寫入 confirmed {區域: IconHit}。"""
+        for (_, resized_templ), small_templ in zip(templ.scaled, templ.coarse):
+            if len(confirmed) == 3: return
+            curr_th, curr_tw = resized_templ.shape[:2]
+            if curr_th > img_h or curr_tw > img_w: continue
+
+            if small_templ is None or small_templ.shape[0] > img_small.shape[0] or small_templ.shape[1] > img_small.shape[1]:
+                # 範本太小無法粗搜尋：直接在原圖上找峰值
+                res = cv2.matchTemplate(img_target, resized_templ, cv2.TM_CCOEFF_NORMED)
+                candidates = [IconHit(type_name, score, min(2, (x + curr_tw // 2) // col_w), (x, y, curr_tw, curr_th))
+                              for x, y, score in _peaks(res, threshold, curr_tw, curr_th)]
+            else:
+                res = cv2.matchTemplate(img_small, small_templ, cv2.TM_CCOEFF_NORMED)
+                candidates = []
+                peaks = sorted(_peaks(res, coarse_threshold, small_templ.shape[1], small_templ.shape[0]), key=lambda p: -p[2])
+                for sx, sy, _ in peaks:
+                    x, y = int(sx / COARSE_FACTOR), int(sy / COARSE_FACTOR)
+                    if min(2, (x + curr_tw // 2) // col_w) in confirmed: continue
+                    hit = refine(type_name, resized_templ, x, y)
+                    if hit is not None: candidates.append(hit)
+
+            for hit in candidates:
+                if hit.column not in confirmed or hit.score > confirmed[hit.column].score:
+                    confirmed[hit.column] = hit
+
+    def job(type_name, templ_list):
+        confirmed = {}
+        for templ in templ_list:
+            if len(confirmed) == 3: break # 三個區域都確認了
+            start = time.perf_counter()
+            search(type_name, templ, confirmed)
+            if timings is not None: timings.add(f"detect/{type_name}/{templ.filename}", time.perf_counter() - start)
+        return list(confirmed.values())
+
+    hits = []
+    for found in _run_jobs(job, list(template_groups.items()), workers, progress, timings):
+        hits.extend(found)
+    return hits
+
+
+def hue_prefilter(img_target, template_groups, columns=3):
+    """
+    色相預篩：回傳 {屬性: 可能出現的區域集合 (0=左 / 1=中 / 2=右)}，不在結果中的屬性不必比對。
+    某區域中範本特徵色相 (含相鄰色相格，容許光線造成的偏移) 的像素數達到
+    PREFILTER_RATIO × 範本在最小尺度下的像素數，該屬性才保留在該區域；沒有顏色特徵的範本一律保留。
+    """
+    col_w = max(1, img_target.shape[1] // columns)
+    hists = [hue_histogram(img_target[:, c * col_w:(c + 1) * col_w if c < columns - 1 else None]) for c in range(columns)]
+    min_area = min(SCALES) ** 2
+    allowed = {}
+    for type_name, templ_list in template_groups.items():
+        cols = set()
+        for templ in templ_list:
+            sig = templ.hue_signature()
+            if sig is None:
+                cols = set(range(columns))
+                break
+            bins, count = sig
+            near = bins | np.roll(bins, 1) | np.roll(bins, -1)
+            cols.update(c for c, h in enumerate(hists) if h[near].sum() >= PREFILTER_RATIO * min_area * count)
+        if cols: allowed[type_name] = cols
+    return allowed
+
+
+def config_label(mode="roi", features="bgr", prefilter=False):
+    """比對設定的顯示名稱，例如「由粗到細 + 提早結束 · 灰階 · 色相預篩」。"""
+    parts = [DETECT_MODES[mode]]
+    if features != "bgr": parts.append(MATCH_FEATURES[features])
+    if prefilter: parts.append("色相預篩")
+    return " · ".join(parts)
+
+
+def detect_icons(img_target, template_groups, mode="roi", workers=1, progress=None, timings=None, features="bgr", prefilter=False):
+    """
+    依指定模式 (見 DETECT_MODES) 執行比對，回傳 IconHit 清單。
+    workers > 1 時以執行緒池平行處理 (屬性, 範本, 尺度) 工作。
+    features 為比對特徵 (見 MATCH_FEATURES)；prefilter=True 時先以色相預篩排除不可能出現的屬性 (分三區模式下逐區排除)。
+    timings (perf.StageTimer) 不為 None 時記錄 detect 總耗時與各屬性/範本的耗時。
+    """
+    if not template_groups:
+        return []
+    with nullcontext() if timings is None else timings.stage("detect"):
+        return _detect(img_target, template_groups, mode, workers, progress, timings, features, prefilter)
+
+
+def _detect(img_target, template_groups, mode, workers, progress, timings, features, prefilter):
+    def timed(name, fn, *args):
+        if timings is None: return fn(*args)
+        with timings.stage(f"detect/{name}"):
+            return fn(*args)
+
+    kwargs = {}
+    if prefilter:
+        allowed = timed("prefilter", hue_prefilter, img_target, template_groups)
+        template_groups = {t: l for t, l in template_groups.items() if t in allowed}
+        if not template_groups: return []
+        if mode == "roi": kwargs["columns"] = allowed
+    if features != "bgr":
+        img_target = timed("features", to_features, img_target, features)
+        template_groups = {t: [templ.variant(features) for templ in l] for t, l in template_groups.items()}
+    threshold, coarse_threshold = FEATURE_THRESHOLDS[features]
+    if mode == "coarse": kwargs["coarse_threshold"] = coarse_threshold
+    match = {"whole": match_templates_whole, "coarse": match_templates_coarse}.get(mode, match_templates_roi)
+    hits = match(img_target, template_groups, threshold=threshold, workers=workers, progress=progress, timings=timings, **kwargs)
+    if prefilter and mode != "roi":
+        # 整張比對的模式只能整體排除屬性，命中後再依區域過濾
+        hits = [h for h in hits if h.column in allowed[h.type_name]]
+    return hits
+
+
+def compare_modes(img_target, template_groups, modes=("roi", "coarse"), workers=1):
+    """
+    以第一個設定 (預設為原始的三區完整搜尋) 為基準，比較各設定的耗時與結果。
+    modes 的每一項為比對模式名稱，或 {"mode", "features", "prefilter"} 設定。
+    回傳 [{"mode", "label", "seconds", "columns", "precision", "recall"}, ...]，
+    precision/recall 以 (屬性, 區域) 配對相對於基準計算。
+    """
+    report = []
+    baseline = None
+    for config in modes:
+        config = {"mode": config} if isinstance(config, str) else dict(config)
+        start = time.perf_counter()
+        hits = detect_icons(img_target, template_groups, workers=workers, **config)
+        seconds = time.perf_counter() - start
+        columns = hits_to_columns(hits)
+        pairs = {(t, i) for i, col in enumerate(columns) for t in col}
+        if baseline is None: baseline = pairs
+        matched = len(pairs & baseline)
+        report.append({
+            "mode": config["mode"], "label": config_label(**config), "seconds": seconds, "columns": columns,
+            "precision": matched / len(pairs) if pairs else 1.0,
+            "recall": matched / len(baseline) if baseline else 1.0,
+        })
+    return report
+
+# --- 範本整理 (去除重複 / 壓縮範本庫) ---
+# 每多一個範本，比對時間就多 (尺度數 × 區域數) 次 matchTemplate，因此幾乎相同的範本只需保留一個
+SIMILARITY_SIZE = 32        # 比較兩個範本時統一縮放的邊長
+DUPLICATE_THRESHOLD = 0.92  # 相似度高於此值視為幾乎相同
+MAX_ASPECT_RATIO = 1.3      # 長寬比差異超過此倍數就不視為重複
+
+
+def template_similarity(a, b, size=SIMILARITY_SIZE):
+    """兩個範本縮放到相同大小後的 TM_CCOEFF_NORMED 相似度 (-1 ~ 1)；長寬比差太多時回傳 0。"""
+    ar_a, ar_b = a.shape[1] / a.shape[0], b.shape[1] / b.shape[0]
+    if max(ar_a / ar_b, ar_b / ar_a) > MAX_ASPECT_RATIO: return 0.0
+    ra = cv2.resize(a, (size, size), interpolation=cv2.INTER_AREA)
+    rb = cv2.resize(b, (size, size), interpolation=cv2.INTER_AREA)
+    score = float(cv2.matchTemplate(ra, rb, cv2.TM_CCOEFF_NORMED)[0, 0])
+    return score if np.isfinite(score) else 0.0
+
+
+def find_near_duplicates(image, template_groups, threshold=DUPLICATE_THRESHOLD):
+    """回傳與 image 幾乎相同的現有範本 [(屬性, 檔名, 相似度), ...] (相似度由高到低)。"""
+    found = [(templ.type_name, templ.filename, template_similarity(image, templ.image))
+             for templ_list in template_groups.values() for templ in templ_list]
+    return sorted([f for f in found if f[2] >= threshold], key=lambda f: -f[2])
+
+
+def cluster_templates(templ_list, threshold=DUPLICATE_THRESHOLD):
+    """
+    把同屬性的範本依相似度分群 (相似度 >= threshold 的範本連成同一群)。
+    回傳 [[IconTemplate, ...], ...]，每群第一個為代表 (與群內其他範本相似度總和最高者)。
+    """
+    n = len(templ_list)
+    sim = np.eye(n)
+    for i in range(n):
+        for j in range(i + 1, n):
+            sim[i, j] = sim[j, i] = template_similarity(templ_list[i].image, templ_list[j].image)
+    parent = list(range(n))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, j in zip(*np.nonzero(np.triu(sim >= threshold, 1))):
+        parent[root(i)] = root(j)
+    members = {}
+    for i in range(n): members.setdefault(root(i), []).append(i)
+    clusters = []
+    for idx in members.values():
+        idx.sort(key=lambda i: (-sim[i, idx].sum(), templ_list[i].filename))
+        clusters.append([templ_list[i] for i in idx])
+    return clusters
+
+
+def _pad_sample(image, ratio=0.25):
+    """樣本四周補邊，讓放大 (scale > 1) 的範本也能在上面比對。"""
+    py, px = int(image.shape[0] * ratio) + 1, int(image.shape[1] * ratio) + 1
+    return cv2.copyMakeBorder(image, py, py, px, px, cv2.BORDER_REPLICATE)
+
+
+def _best_score(sample, templ):
+    best = -1.0
+    for _, resized in templ.scaled:
+        if resized.shape[0] > sample.shape[0] or resized.shape[1] > sample.shape[1]: continue
+        best = max(best, float(cv2.minMaxLoc(cv2.matchTemplate(sample, resized, cv2.TM_CCOEFF_NORMED))[1]))
+    return best
+
+
+def plan_compaction(template_groups, threshold=DUPLICATE_THRESHOLD, samples=None, match_threshold=MATCH_THRESHOLD):
+    """
+    規劃範本庫壓縮，回傳 {屬性: {"keep": [檔名, ...], "remove": [檔名, ...]}}。
+    1. 每個屬性的範本依相似度分群，每群先只保留代表。
+    2. 以標註樣本檢查召回率：samples 為 [(屬性, BGR 影像), ...]，預設為所有範本本身。
+       原本用全部範本能偵測到 (分數 >= match_threshold) 的樣本，若只用保留的範本偵測不到，
+       就把能補回最多樣本的範本加回保留清單，直到召回率與原本相同。
+    """
+    plan = {}
+    for type_name, templ_list in template_groups.items():
+        keep = {id(c[0]) for c in cluster_templates(templ_list, threshold)}
+        type_samples = [img for t, img in samples if t == type_name] if samples is not None else [t.image for t in templ_list]
+        padded = [_pad_sample(img) for img in type_samples]
+        scores = np.array([[_best_score(s, templ) for templ in templ_list] for s in padded]).reshape(len(padded), len(templ_list))
+        hit = scores >= match_threshold
+        detectable = hit.any(axis=1)
+        kept_mask = np.array([id(t) in keep for t in templ_list], bool)
+        missed = detectable & ~(hit[:, kept_mask].any(axis=1) if kept_mask.any() else np.zeros(len(padded), bool))
+        while missed.any():
+            gain = (hit & missed[:, None]).sum(axis=0) * ~kept_mask
+            best = int(np.argmax(gain))
+            kept_mask[best] = True
+            missed &= ~hit[:, best]
+        plan[type_name] = {
+            "keep": [t.filename for t, k in zip(templ_list, kept_mask) if k],
+            "remove": [t.filename for t, k in zip(templ_list, kept_mask) if not k],
+        }
+    return plan
+
+
+def apply_compaction(icon_dir, plan, archive_dir="_archive"):
+    """把 plan 中要移除的範本移到 icon_dir/archive_dir (不刪除，可手動移回)，回傳移動的檔案數。"""
+    target = os.path.join(icon_dir, archive_dir)
+    os.makedirs(target, exist_ok=True)
+    moved = 0
+    for entry in plan.values():
+        for filename in entry["remove"]:
+            src = os.path.join(icon_dir, filename)
+            if not os.path.exists(src): continue
+            base, ext = os.path.splitext(filename)
+            dst, k = os.path.join(target, filename), 1
+            while os.path.exists(dst):
+                dst, k = os.path.join(target, f"{base}~{k}{ext}"), k + 1
+            os.replace(src, dst)
+            moved += 1
+    return moved
+
+# --- 自動定位屬性圖示列 ---
+LOCATE_WIDTH = 360        # 定位時把截圖縮小到這個寬度 (範本以相同比例縮小)
+LOCATE_SCALES = (1.0,)    # 定位只需找出圖示所在的列，用單一尺度即可 (約快 3 倍)
+LOCATE_THRESHOLD = 0.60   # 定位用的比對門檻 (只用來找出圖示所在的列)
+LOCATE_MARGIN = 0.35      # 框選範圍上下各多留圖示高度的比例
+
+
+def locate_icon_strip(img_bgr, template_groups, width=LOCATE_WIDTH, threshold=LOCATE_THRESHOLD, scales=LOCATE_SCALES):
+    """
+    在整張截圖中找出屬性圖示所在的那一列，回傳框選範圍 (x, y, w, h) (原圖座標)；找不到時回傳 None。
+    在縮小的灰階截圖上比對所有範本，把命中依垂直位置分列，取命中最多 (同數時總分最高) 的一列。
+    三位對手的圖示橫跨整個畫面寬度，因此框選範圍左右為整張截圖，上下為該列的範圍。
+    """
+    if not template_groups: return None
+    img_h, img_w = img_bgr.shape[:2]
+    factor = min(1.0, width / img_w)
+    small = cv2.resize(to_features(img_bgr, "gray"), (max(1, int(img_w * factor)), max(1, int(img_h * factor))), interpolation=cv2.INTER_AREA)
+    hits = []
+    for templ_list in template_groups.values():
+        for templ in templ_list:
+            gray = templ.variant("gray").image
+            for scale in scales:
+                t_w, t_h = int(gray.shape[1] * scale * factor), int(gray.shape[0] * scale * factor)
+                if min(t_w, t_h) < COARSE_MIN_SIZE or t_w > small.shape[1] or t_h > small.shape[0]: continue
+                res = cv2.matchTemplate(small, cv2.resize(gray, (t_w, t_h), interpolation=cv2.INTER_AREA), cv2.TM_CCOEFF_NORMED)
+                hits.extend(IconHit(templ.type_name, score, 0, (x, y, t_w, t_h)) for x, y, score in _peaks(res, threshold, t_w, t_h))
+    hits = non_max_suppression(hits)
+    if not hits: return None
+
+    # 依垂直中心分列：中心點與該列第一個命中的距離在半個圖示高度內視為同一列
+    rows = []
+    for h in sorted(hits, key=lambda h: h.box[1] + h.box[3] / 2):
+        cy = h.box[1] + h.box[3] / 2
+        if rows and abs(cy - rows[-1][0]) <= rows[-1][1][0].box[3] / 2:
+            rows[-1][1].append(h)
+        else:
+            rows.append((cy, [h]))
+    _, best = max(rows, key=lambda r: (len(r[1]), sum(h.score for h in r[1])))
+    top = min(h.box[1] for h in best)
+    bottom = max(h.box[1] + h.box[3] for h in best)
+    margin = LOCATE_MARGIN * max(h.box[3] for h in best)
+    y0 = max(0, int((top - margin) / factor))
+    y1 = min(img_h, int(np.ceil((bottom + margin) / factor)))
+    return (0, y0, img_w, y1 - y0)
+
+
+class CropBoxMemory:
+    """
+    依截圖解析度記住上次使用的框選範圍 (存成 JSON 檔)。
+    同一支手機的截圖版面固定，記住後下次上傳同解析度的截圖就不必再調整。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._boxes = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._boxes = json.load(f)
+            except (OSError, ValueError):
+                self._boxes = {}
+
+    @staticmethod
+    def _key(size):
+        return f"{size[0]}x{size[1]}"
+
+    def get(self, size):
+        """size 為 (寬, 高)；回傳 (x, y, w, h) 或 None。"""
+        box = self._boxes.get(self._key(size))
+        return tuple(box) if box else None
+
+    def put(self, size, box):
+        with self._lock:
+            self._boxes[self._key(size)] = [int(v) for v in box]
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._boxes, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+_memories = {}
+_memories_lock = threading.Lock()
+
+def get_crop_box_memory(path):
+    """取得指定檔案的共用 CropBoxMemory (每個檔案在行程中只讀取一次)。"""
+    key = os.path.abspath(path)
+    with _memories_lock:
+        memory = _memories.get(key)
+        if memory is None:
+            memory = _memories[key] = CropBoxMemory(path)
+        return memory
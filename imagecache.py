@@ -0,0 +1,160 @@
+"""
+卡片圖片的縮圖快取與框選用的縮小影像 (不依賴 Streamlit)。
+第一次使用時把原圖縮小並重新編碼成 JPEG，以來源檔案內容的雜湊為鍵存在快取資料夾；
+快取總大小超過上限時，刪除最久未使用的檔案。
+CropProxy 讓框選元件只處理縮小後的影像，框選結果再換算回原圖座標。
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# 各尺寸的長邊像素
+VARIANTS = {"thumb": 240, "preview": 960}
+JPEG_QUALITY = 85
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+CROP_DISPLAY_EDGE = 700 # 框選元件顯示的長邊上限 (與 streamlit_cropper 預設的畫布大小相同)
+
+
+class ThumbnailCache:
+    """以 (來源內容雜湊, 尺寸) 為鍵的縮圖快取，依最近使用順序淘汰。"""
+
+    def __init__(self, cache_dir, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hashes = {} # 來源路徑 -> ((大小, mtime_ns), 雜湊)，檔案沒變就不必重新計算
+        os.makedirs(cache_dir, exist_ok=True)
+        # 快取檔名 -> 檔案大小，依最近使用排序 (重新啟動時以修改時間還原順序)
+        files = [e for e in os.scandir(cache_dir) if e.is_file() and e.name.endswith(".jpg")]
+        files.sort(key=lambda e: e.stat().st_mtime_ns)
+        self._entries = OrderedDict((e.name, e.stat().st_size) for e in files)
+        self.total_bytes = sum(self._entries.values())
+        self._evict(keep=None)
+
+    def _source_hash(self, path):
+        st = os.stat(path)
+        sig = (st.st_size, st.st_mtime_ns)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == sig: return cached[1]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+        digest = h.hexdigest()
+        self._hashes[path] = (sig, digest)
+        return digest
+
+    def _render(self, path, edge, out_path):
+        with Image.open(path) as img:
+            img.thumbnail((edge, edge), Image.LANCZOS)
+            if img.mode in ("RGBA", "LA", "P"):
+                # JPEG 沒有透明度，以白底合成
+                img = img.convert("RGBA")
+                bg = Image.new("RGB", img.size, (255, 255, 255))
+                bg.paste(img, mask=img.getchannel("A"))
+                img = bg
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".jpg", dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    img.save(f, "JPEG", quality=JPEG_QUALITY, optimize=True)
+                os.replace(tmp_path, out_path)
+            except BaseException:
+                if os.path.exists(tmp_path): os.remove(tmp_path)
+                raise
+
+    def get(self, path, variant="thumb"):
+        """回傳 path 指定尺寸的快取檔路徑 (必要時產生)；來源不存在時回傳 None。"""
+        if not os.path.exists(path): return None
+        edge = VARIANTS[variant]
+        with self._lock:
+            name = f"{self._source_hash(path)}_{edge}.jpg"
+        out_path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if name in self._entries and os.path.exists(out_path):
+                self._entries.move_to_end(name)
+                os.utime(out_path)
+                return out_path
+        self._render(path, edge, out_path)
+        with self._lock:
+            self.total_bytes += os.path.getsize(out_path) - self._entries.pop(name, 0)
+            self._entries[name] = os.path.getsize(out_path)
+            self._evict(keep=name)
+        return out_path
+
+    def _evict(self, keep):
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = next(iter(self._entries.items()))
+            if name == keep: self._entries.move_to_end(name); continue
+            del self._entries[name]
+            self.total_bytes -= size
+            try: os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError: pass
+
+    def clear(self):
+        with self._lock:
+            for name in self._entries:
+                try: os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError: pass
+            self._entries.clear()
+            self._hashes.clear()
+            self.total_bytes = 0
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_thumbnail_cache(cache_dir, max_bytes=MAX_CACHE_BYTES):
+    """取得指定資料夾的共用縮圖快取 (每個資料夾在行程中只會有一份)。"""
+    key = os.path.abspath(cache_dir)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ThumbnailCache(cache_dir, max_bytes)
+        return cache
+
+
+# --- 框選用的縮小影像 ---
+class CropProxy:
+    """
+    原圖與顯示用的縮小影像 (長邊不超過 max_edge)。
+    框選只在縮小影像上進行，to_original() 把框選換算回原圖座標，crop() 從原圖裁切，
+    因此辨識與儲存範本仍然使用原圖解析度。
+    """
+
+    def __init__(self, image, max_edge=CROP_DISPLAY_EDGE):
+        self.original = image
+        w, h = image.size
+        scale = min(1.0, max_edge / max(w, h))
+        display = image if image.mode in ("RGB", "RGBA") else image.convert("RGBA")
+        if scale < 1.0:
+            display = display.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+        self.display = display
+        self.ratio = (w / display.width, h / display.height) # 原圖 / 顯示 (水平, 垂直)
+
+    def to_display(self, box):
+        """原圖座標 (x, y, w, h) → 顯示影像座標。"""
+        x, y, w, h = box
+        rx, ry = self.ratio
+        x0, y0 = round(x / rx), round(y / ry)
+        return (x0, y0, max(1, round((x + w) / rx) - x0), max(1, round((y + h) / ry) - y0))
+
+    def to_original(self, box):
+        """顯示影像座標 (x, y, w, h) → 原圖座標 (限制在原圖範圍內，至少 1 像素)。"""
+        x, y, w, h = box
+        rx, ry = self.ratio
+        img_w, img_h = self.original.size
+        x0 = min(max(0, round(x * rx)), img_w - 1)
+        y0 = min(max(0, round(y * ry)), img_h - 1)
+        x1 = min(img_w, max(x0 + 1, round((x + w) * rx)))
+        y1 = min(img_h, max(y0 + 1, round((y + h) * ry)))
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def crop(self, box):
+        """以原圖座標 (x, y, w, h) 從原圖裁切。"""
+        x, y, w, h = box
+        return self.original.crop((x, y, x + w, y + h))
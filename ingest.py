@@ -0,0 +1,199 @@
+"""
+卡片圖片的背景匯入 (不依賴 Streamlit)。
+上傳/資料夾中的圖片在工作執行緒中解碼、正規化 (依 EXIF 轉正、統一色彩模式；預設保留原始解析度) 後編碼成 PNG，
+以內容雜湊存成 {圖片資料夾}/.blobs/<sha1>.png (相同內容只存一份)，
+原本的 {名稱}_前.png / {名稱}_後.png 則是指向該檔的硬連結 (不支援時改為複製)，
+因此讀取圖片的程式 (縮圖、影像索引) 不需要任何修改。
+submit() 立即回傳 IngestBatch，呼叫端可隨時查詢進度，不必等待寫檔完成。
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+BLOB_DIR = ".blobs"
+MAX_EDGE = None       # 正規化後的長邊上限 (None 為保留原始解析度；縮圖與框選另有各自的縮小版本)
+WORKERS = min(4, os.cpu_count() or 1)
+PRUNE_AGE = 60        # 沒有任何別名的內容檔超過幾秒才清除 (避免刪到剛寫入、還沒建立別名的檔案)
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+SIDE_SUFFIXES = (("_前", "前"), ("_front", "前"), ("_後", "後"), ("_back", "後"))
+
+IngestItem = namedtuple("IngestItem", "name side source")               # source: bytes、檔案路徑或檔案物件
+IngestResult = namedtuple("IngestResult", "name side path blob reused") # reused: 相同內容的檔案已存在
+
+
+def parse_image_name(file_name):
+    """檔名 → (卡片名稱, "前"/"後")；沒有標示正反面時視為正面。"""
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    for suffix, side in SIDE_SUFFIXES:
+        if stem.lower().endswith(suffix): return stem[:-len(suffix)], side
+    return stem, "前"
+
+
+def folder_items(folder):
+    """資料夾內所有圖片 → [IngestItem, ...] (依檔名排序，不含子資料夾)。"""
+    items = []
+    for e in sorted(os.scandir(folder), key=lambda e: e.name):
+        if e.is_file() and e.name.lower().endswith(IMAGE_EXTS):
+            items.append(IngestItem(*parse_image_name(e.name), e.path))
+    return items
+
+
+def normalize(img, max_edge=MAX_EDGE):
+    """依 EXIF 方向轉正、轉成 RGB (有透明度時 RGBA)；指定 max_edge 時把長邊限制在 max_edge 以內。"""
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    if max_edge and max(img.size) > max_edge: img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return img
+
+
+def encode_png(source, max_edge=MAX_EDGE):
+    if isinstance(source, (bytes, bytearray)): source = io.BytesIO(source)
+    with Image.open(source) as img:
+        img = normalize(img, max_edge)
+        buf = io.BytesIO()
+        img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+class ImageStore:
+    """
+    以內容雜湊存放卡片圖片，{名稱}_{正反面}.png 為別名。
+    put() 的「檢查內容檔 → 建立別名」與 prune() 的掃描在同一把 lock 內進行，
+    不會在建立別名之前刪掉剛判定為可沿用的內容檔；沿用時也會更新修改時間 (其他行程的 prune 同樣會跳過)。
+    """
+
+    def __init__(self, image_dir):
+        self.image_dir = image_dir
+        self.blob_dir = os.path.join(image_dir, BLOB_DIR)
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def alias_path(self, name, side):
+        return os.path.join(self.image_dir, f"{name}_{side}.png")
+
+    def put(self, name, side, data):
+        """寫入 PNG 內容並把別名指向它，回傳 IngestResult。"""
+        digest = hashlib.sha1(data).hexdigest()
+        blob = os.path.join(self.blob_dir, f"{digest}.png")
+        path = self.alias_path(name, side)
+        with self._lock:
+            reused = os.path.exists(blob)
+            if reused:
+                try: os.utime(blob)
+                except FileNotFoundError: reused = False # 其他行程剛好清掉了
+            if not reused: self._write_atomic(blob, data)
+            self._link_atomic(blob, path)
+        return IngestResult(name, side, path, blob, reused)
+
+    def _write_atomic(self, path, data):
+        fd, tmp = tempfile.mkstemp(prefix=".tmp_", suffix=".png", dir=self.blob_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+
+    def _link_atomic(self, blob, path):
+        # 先在同一資料夾建立暫存連結再改名，讀取端不會看到寫到一半的別名
+        tmp = os.path.join(self.image_dir, f".tmp_{os.getpid()}_{threading.get_ident()}.png")
+        if os.path.lexists(tmp): os.remove(tmp)
+        try:
+            try:
+                os.link(blob, tmp)
+            except OSError:
+                shutil.copyfile(blob, tmp) # 檔案系統不支援硬連結
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.lexists(tmp): os.remove(tmp)
+            raise
+
+    def prune(self, min_age=PRUNE_AGE):
+        """刪除已沒有任何別名指向的內容檔 (卡片圖片被換掉後留下的舊內容)，回傳刪除數。"""
+        removed, now = 0, time.time()
+        with self._lock:
+            for e in os.scandir(self.blob_dir):
+                if not e.name.endswith(".png") or e.name.startswith(".tmp_"): continue
+                st = e.stat()
+                if st.st_nlink <= 1 and now - st.st_mtime > min_age:
+                    try: os.remove(e.path); removed += 1
+                    except FileNotFoundError: pass
+        return removed
+
+
+class IngestBatch:
+    """一次送出的圖片 (submit 的回傳值)，可在其他執行緒/重新執行時查詢進度。"""
+
+    def __init__(self, items, futures):
+        self.items = items
+        self.futures = futures
+        self.started = time.time()
+
+    @property
+    def total(self):
+        return len(self.futures)
+
+    @property
+    def done(self):
+        return sum(f.done() for f in self.futures)
+
+    @property
+    def finished(self):
+        return all(f.done() for f in self.futures)
+
+    def results(self):
+        """已完成的 IngestResult 清單。"""
+        return [f.result() for f in self.futures if f.done() and f.exception() is None]
+
+    def errors(self):
+        """[(卡片名稱, 正反面, 錯誤訊息), ...]"""
+        return [(item.name, item.side, f"{type(f.exception()).__name__}: {f.exception()}")
+                for item, f in zip(self.items, self.futures) if f.done() and f.exception() is not None]
+
+
+class IngestPipeline:
+    """在工作執行緒池中解碼、正規化並寫入卡片圖片 (PIL 的解碼/壓縮會釋放 GIL，可以平行)。"""
+
+    def __init__(self, image_dir, workers=WORKERS, max_edge=MAX_EDGE):
+        self.store = ImageStore(image_dir)
+        self.max_edge = max_edge
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+
+    def _ingest(self, item, on_stored):
+        source = item.source
+        if hasattr(source, "seek"): source.seek(0)
+        result = self.store.put(item.name, item.side, encode_png(source, self.max_edge))
+        if on_stored: on_stored(result)
+        return result
+
+    def submit(self, items, on_stored=None):
+        """
+        送出 [IngestItem, ...]，立即回傳 IngestBatch。
+        on_stored(IngestResult) 在每張圖片寫入後於工作執行緒中呼叫 (例如更新影像索引)。
+        """
+        items = list(items)
+        return IngestBatch(items, [self._executor.submit(self._ingest, item, on_stored) for item in items])
+
+
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+def get_ingest_pipeline(image_dir):
+    """取得指定圖片資料夾的共用匯入管線 (每個資料夾在行程中只有一份)。"""
+    key = os.path.abspath(image_dir)
+    with _pipelines_lock:
+        pipeline = _pipelines.get(key)
+        if pipeline is None:
+            pipeline = _pipelines[key] = IngestPipeline(image_dir)
+        return pipeline
@@ -0,0 +1,90 @@
+"""
+各階段耗時的量測與紀錄 (不依賴 Streamlit)。
+StageTimer 收集一次操作 (掃描/計算隊伍) 中各具名階段的耗時，可跨執行緒累加；
+append_log() 把結果以 JSONL 附加到會自動輪替的紀錄檔，用來收集實際使用時的延遲分布。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
+
+LOG_MAX_BYTES = 5 * 1024 * 1024 # 單一紀錄檔上限，超過就輪替
+LOG_BACKUPS = 3                 # 保留的舊紀錄檔數量
+
+
+class StageTimer:
+    """
+    依階段名稱累計耗時與次數。名稱以 "/" 表示層級，例如 "detect/火/火.png"。
+    平行執行的子階段是各執行緒時間的總和，可能大於上層階段的實際時間。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {} # 名稱 -> [秒數, 次數] (依第一次出現的順序)
+        self.started = time.time()
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    @contextmanager
+    def stage(self, name):
+        with self._lock:
+            self.stages.setdefault(name, [0.0, 0]) # 依開始順序排列 (上層階段排在子階段前面)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def rows(self, max_depth=None):
+        """回傳 [{"stage", "ms", "count"}, ...]；max_depth 限制顯示的層級數。"""
+        with self._lock:
+            items = list(self.stages.items())
+        # 最上層依開始順序，同一個上層內依名稱排列 (子階段緊接在上層之後)
+        order = {}
+        for name, _ in items: order.setdefault(name.split("/")[0], len(order))
+        items.sort(key=lambda kv: (order[kv[0].split("/")[0]], kv[0]))
+        return [{"stage": name, "ms": round(sec * 1000, 3), "count": n}
+                for name, (sec, n) in items
+                if max_depth is None or name.count("/") < max_depth]
+
+    def to_record(self, event, **extra):
+        return {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "event": event, **extra,
+            "stages": {r["stage"]: {"ms": r["ms"], "count": r["count"]} for r in self.rows()},
+        }
+
+
+def timed(timer, name):
+    """timer 為 None 時不量測 (給可選擇是否量測的函式使用)。"""
+    return nullcontext() if timer is None else timer.stage(name)
+
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+def _get_logger(path):
+    key = os.path.abspath(path)
+    with _loggers_lock:
+        logger = _loggers.get(key)
+        if logger is None:
+            logger = logging.getLogger(f"mezastar.perf.{len(_loggers)}")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            _loggers[key] = logger
+        return logger
+
+
+def append_log(path, record):
+    """把一筆紀錄以一行 JSON 附加到 path (超過大小上限時自動輪替為 path.1, path.2, ...)。"""
+    _get_logger(path).info(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,174 @@
+"""
+批次掃描對戰截圖 (命令列工具，不需要 Streamlit)。
+對資料夾內每張截圖：依框選範圍裁切 → 辨識有利屬性圖示 → 推薦出戰隊伍，
+結果以 JSONL 逐行輸出 (含各階段耗時)。已處理過的檔案 (依內容雜湊) 會自動略過。
+
+用法:
+    python scan.py screenshots/ --box 120,860,840,90 --out results.jsonl
+    python scan.py screenshots/ --boxes crops.json --workers 8
+crops.json 格式: {"檔名.png": [x, y, w, h], ...}；沒有列出的檔案使用 --box。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import cv2
+from PIL import Image
+
+import battle
+import detector
+import storage
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    return h.hexdigest()
+
+
+def load_done(out_path):
+    """讀取既有的輸出檔，回傳已成功處理的內容雜湊。"""
+    done = set()
+    if not os.path.exists(out_path): return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try: rec = json.loads(line)
+            except ValueError: continue # 上次中斷時寫到一半的行
+            if "error" not in rec and rec.get("sha1"): done.add(rec["sha1"])
+    return done
+
+
+# --- 每個工作行程各自保有一份範本與編碼後的卡片庫 ---
+_worker = {}
+
+def _init_worker(icon_dir, cards, detect_config, top_k):
+    _worker.update(
+        groups=detector.get_template_bank(icon_dir).groups,
+        table=battle.EncodedInventory(cards),
+        detect_config=detect_config, top_k=top_k,
+    )
+
+
+def recommend(table, detected, top_k=1):
+    """依三欄偵測到的有利屬性推薦隊伍，回傳 ([{"score", "members"}, ...], 搜尋節點數)。"""
+    cfg = [{"manual_t1": "無", "manual_t2": "無", "detected_weakness": d} for d in detected]
+    cands = battle.score_candidates(table, cfg, manual=False)
+    teams, nodes = battle.solve_teams(cands, size=3, top_k=top_k)
+    return [{"score": t["score"], "members": [{k: m[k] for k in ("name", "mode", "tag", "move", "dmg")} for m in t["members"]]} for t in teams], nodes
+
+
+def scan_file(path, box, sha1):
+    """處理單一截圖，回傳一筆結果 (dict)。與 app.py 的「掃描此區域」+「計算最佳隊伍」相同流程。"""
+    t0 = time.perf_counter()
+    rec = {"file": path, "sha1": sha1, "box": list(box), **_worker["detect_config"]}
+    try:
+        with Image.open(path) as img:
+            x, y, w, h = box
+            crop = img.convert("RGB").crop((x, y, x + w, y + h))
+        img_bgr = cv2.cvtColor(np.array(crop), cv2.COLOR_RGB2BGR)
+        t1 = time.perf_counter()
+        hits = detector.detect_icons(img_bgr, _worker["groups"], workers=1, **_worker["detect_config"])
+        detected = detector.hits_to_columns(hits)
+        t2 = time.perf_counter()
+        teams, nodes = recommend(_worker["table"], detected, _worker["top_k"])
+        t3 = time.perf_counter()
+    except Exception as e:
+        rec.update(error=f"{type(e).__name__}: {e}", timing={"total": time.perf_counter() - t0})
+        return rec
+    rec.update(
+        detected=detected,
+        hits=[{"type": h.type_name, "score": round(h.score, 4), "column": h.column, "box": list(h.box)} for h in hits],
+        teams=teams,
+        nodes=nodes,
+        timing={"read": t1 - t0, "detect": t2 - t1, "recommend": t3 - t2, "total": t3 - t0},
+    )
+    return rec
+
+
+def collect_jobs(folder, default_box, boxes, done, force=False):
+    """回傳 (待處理 [(路徑, 框選, 雜湊)], 略過數)。"""
+    jobs, skipped = [], 0
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not name.lower().endswith(IMAGE_EXTS) or not os.path.isfile(path): continue
+        box = boxes.get(name, default_box)
+        if box is None:
+            print(f"略過 {name}: 沒有指定框選範圍", file=sys.stderr)
+            skipped += 1
+            continue
+        sha1 = file_sha1(path)
+        if sha1 in done and not force:
+            skipped += 1
+            continue
+        done.add(sha1) # 同一批內容重複的檔案只處理一次
+        jobs.append((path, tuple(int(v) for v in box), sha1))
+    return jobs, skipped
+
+
+def parse_box(text):
+    box = [int(v) for v in text.split(",")]
+    if len(box) != 4: raise argparse.ArgumentTypeError("格式應為 x,y,w,h")
+    return box
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="批次掃描對戰截圖，輸出辨識結果與推薦隊伍 (JSONL)。")
+    ap.add_argument("folder", help="截圖資料夾")
+    ap.add_argument("--box", type=parse_box, help="預設框選範圍 x,y,w,h (原圖座標)")
+    ap.add_argument("--boxes", help="各檔案框選範圍的 JSON 檔 {檔名: [x, y, w, h]}")
+    ap.add_argument("--out", default="scan_results.jsonl", help="輸出 JSONL 檔 (附加寫入)")
+    ap.add_argument("--db", default="mezastar_db.sqlite", help="卡片資料庫 (SQLite)")
+    ap.add_argument("--json", default="mezastar_db.json", help="資料庫為空時匯入的舊版 JSON 檔")
+    ap.add_argument("--icons", default="att_icon", help="圖示範本資料夾")
+    ap.add_argument("--mode", default="roi", choices=list(detector.DETECT_MODES), help="比對模式")
+    ap.add_argument("--features", default="bgr", choices=list(detector.MATCH_FEATURES), help="比對特徵")
+    ap.add_argument("--prefilter", action="store_true", help="先以色相預篩排除不可能出現的屬性")
+    ap.add_argument("--top-k", type=int, default=1, help="每張截圖列出前幾組隊伍")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="平行處理的行程數")
+    ap.add_argument("--force", action="store_true", help="重新處理已在輸出檔中的截圖")
+    args = ap.parse_args(argv)
+
+    boxes = {}
+    if args.boxes:
+        with open(args.boxes, "r", encoding="utf-8") as f:
+            boxes = json.load(f)
+    if args.box is None and not boxes: ap.error("需要 --box 或 --boxes")
+
+    cards = list(storage.CardStore(args.db, legacy_json=args.json).load())
+    if not cards: ap.error(f"{args.db} 沒有卡片資料")
+    jobs, skipped = collect_jobs(args.folder, args.box, boxes, load_done(args.out), args.force)
+    print(f"待處理 {len(jobs)} 張，略過 {skipped} 張 (卡片 {len(cards)} 張，{args.workers} 個行程)", file=sys.stderr)
+
+    init_args = (args.icons, cards, {"mode": args.mode, "features": args.features, "prefilter": args.prefilter}, args.top_k)
+    start, n_err = time.perf_counter(), 0
+    with open(args.out, "a", encoding="utf-8") as out:
+        def write(rec):
+            nonlocal n_err
+            n_err += "error" in rec
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            status = rec.get("error") or " | ".join("/".join(d) or "-" for d in rec["detected"])
+            print(f"{os.path.basename(rec['file'])}: {status} ({rec['timing']['total']:.2f}s)", file=sys.stderr)
+
+        if args.workers <= 1:
+            _init_worker(*init_args)
+            for job in jobs: write(scan_file(*job))
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=init_args) as pool:
+                futures = [pool.submit(scan_file, *job) for job in jobs]
+                for fut in as_completed(futures): write(fut.result())
+
+    print(f"完成 {len(jobs)} 張 (失敗 {n_err})，耗時 {time.perf_counter() - start:.1f} 秒 → {args.out}", file=sys.stderr)
+    return 1 if n_err else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
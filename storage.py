@@ -0,0 +1,306 @@
+"""
+卡片庫儲存層 (SQLite)。
+新增/修改/刪除時只寫入變動的那張卡片，並包在單一交易中，程式中途被中斷也不會留下寫到一半的資料。
+JSON 匯入/匯出格式與原本的 mezastar_db.json 完全相同；記憶體中的卡片為 cardmodel.Card (載入時驗證一次)。
+"""
+import bisect
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import cardmodel
+
+
+class CardList(list):
+    """
+    從 CardStore 載入的卡片清單 (依名稱排序)。
+    rowids 以 Card 的物件身分 (id) 對應到資料庫的資料列，
+    讓只寫入單張卡片時不必在卡片內容中加入額外欄位。
+    """
+
+    def __init__(self, cards=(), rowids=()):
+        super().__init__(cards)
+        self.rowids = {id(c): r for c, r in zip(self, rowids)}
+
+    def derive(self, cards):
+        """以 cards 建立新的 CardList，共用同一份 rowids 對照表 (Card 物件本身也共用)。"""
+        new = CardList(cards)
+        new.rowids = self.rowids
+        return new
+
+
+def _dump_card(card):
+    return json.dumps(card.to_dict(), ensure_ascii=False)
+
+
+class CardStore:
+    """以 SQLite 儲存卡片：每張卡片一列，內容為與 JSON 檔相同格式的 JSON 字串。"""
+
+    def __init__(self, db_path, legacy_json=None):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cards (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, data TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cards_name ON cards(name, id)")
+        # 第一次使用時，從舊的 JSON 檔匯入
+        if legacy_json and os.path.exists(legacy_json) and self.count() == 0:
+            self.import_json(legacy_json)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+    def load(self):
+        """讀取全部卡片，回傳依名稱排序的 CardList (同名依新增順序)。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM cards ORDER BY name, id").fetchall()
+        return CardList([cardmodel.Card.from_dict(json.loads(d)) for _, d in rows], [r for r, _ in rows])
+
+    # --- 單張卡片寫入 ---
+    def insert(self, cards, card):
+        """新增一張卡片 (card 應已放入 cards 清單)。"""
+        rowids = getattr(cards, "rowids", None)
+        if rowids is None: return self.replace_all(cards)
+        with self._transaction() as conn:
+            rowid = conn.execute("INSERT INTO cards (name, data) VALUES (?, ?)", (card.name, _dump_card(card))).lastrowid
+        rowids[id(card)] = rowid
+        return rowid
+
+    def update(self, cards, old_card, new_card):
+        """以 new_card 取代 old_card (兩者可為同一個物件)。"""
+        rowids = getattr(cards, "rowids", None)
+        if rowids is None or id(old_card) not in rowids: return self.replace_all(cards)
+        rowid = rowids[id(old_card)]
+        with self._transaction() as conn:
+            conn.execute("UPDATE cards SET name = ?, data = ? WHERE id = ?", (new_card.name, _dump_card(new_card), rowid))
+        del rowids[id(old_card)]
+        rowids[id(new_card)] = rowid
+        return rowid
+
+    def delete(self, cards, card):
+        """刪除一張卡片 (card 應已從 cards 清單移除)。"""
+        rowids = getattr(cards, "rowids", None)
+        if rowids is None or id(card) not in rowids: return self.replace_all(cards)
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cards WHERE id = ?", (rowids[id(card)],))
+        del rowids[id(card)]
+
+    def replace_all(self, cards):
+        """以 cards 取代資料庫全部內容 (單一交易)。"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cards")
+            new_ids = [conn.execute("INSERT INTO cards (name, data) VALUES (?, ?)", (c.name, _dump_card(c))).lastrowid for c in cards]
+        if isinstance(cards, CardList):
+            cards.rowids = {id(c): r for c, r in zip(cards, new_ids)}
+
+    # --- JSON 匯入/匯出 (與舊版 mezastar_db.json 相容) ---
+    def import_json(self, path):
+        """以 JSON 檔內容取代資料庫，回傳新的 CardList。格式不正確時拋出 cardmodel.CardFormatError。"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.replace_all(cardmodel.load_cards(data))
+        return self.load()
+
+    def export_json(self, path):
+        """把目前資料庫內容寫成 JSON 檔 (先寫暫存檔再取代，避免產生不完整的檔案)。"""
+        data = self.load()
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump([c.to_dict() for c in data], f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def open_store(db_path, legacy_json=None):
+    """取得指定資料庫的共用 CardStore (每個檔案在行程中只開啟一次)。"""
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = CardStore(db_path, legacy_json)
+        return store
+
+
+# --- 跨 Session 共用的卡片庫 ---
+class StaleWriteError(Exception):
+    """要修改/刪除的卡片已被其他使用者變更 (或刪除)。"""
+
+
+class SharedInventory:
+    """
+    行程內所有 Streamlit session 共用的一份卡片庫。
+    - 讀取：snapshot() 直接回傳目前的清單 (不複製)；清單一旦發布就不再被修改 (copy-on-write)，
+      因此呼叫端必須把它當成唯讀。
+    - 寫入：以版本號 + 目標卡片做 compare-and-swap。版本落後時只合併與目標卡片無關的變更；
+      目標卡片 (同名) 已被他人新增/修改/刪除、卡片庫被整個取代或變更紀錄已不完整時拋出 StaleWriteError。
+      整個取代 (replace_all) 時版本必須完全相同。
+    - changes_since(version) 可取得某版本之後的變更紀錄。
+    - attach() 可掛上需要跟著卡片庫增量更新的索引 (例如 battle.EncodedInventory)。
+    - view() 取得目前版本的篩選/搜尋索引 (cardmodel.InventoryView)，版本變動後第一次取用時重建。
+    """
+    LOG_SIZE = 1000
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.RLock()
+        self._cards = store.load()
+        self.version = 0
+        self._log = deque(maxlen=self.LOG_SIZE) # (version, 動作, 卡片名稱)
+        self._indexes = {}
+        self._view = None
+
+    def snapshot(self):
+        """回傳 (版本, 唯讀卡片清單)。"""
+        with self.lock:
+            return self.version, self._cards
+
+    def changes_since(self, version):
+        """
+        回傳 version 之後的變更 [(版本, 動作, 名稱), ...]，動作為 insert / update / delete / reload (整個取代)。
+        紀錄已不完整時回傳 None。
+        """
+        with self.lock:
+            if version == self.version: return []
+            if not self._log or self._log[0][0] > version + 1: return None
+            return [c for c in self._log if c[0] > version]
+
+    def attach(self, name, factory):
+        """取得 (必要時以 factory(cards) 建立) 跟著卡片庫同步更新的索引。讀取索引時請持有 lock。"""
+        with self.lock:
+            index = self._indexes.get(name)
+            if index is None:
+                index = self._indexes[name] = factory(self._cards)
+            return index
+
+    def attached_snapshot(self, name, factory):
+        """
+        回傳 (版本, attach() 索引的唯讀快照)。只在取快照時持有 lock，
+        之後以快照進行的長時間計算不會擋住其他 session 的寫入。索引須提供 snapshot()。
+        """
+        with self.lock:
+            return self.version, self.attach(name, factory).snapshot()
+
+    def view(self):
+        """回傳目前版本的 cardmodel.InventoryView (所有 session 共用，每個版本只建立一次)。"""
+        with self.lock:
+            if self._view is None or self._view.version != self.version:
+                self._view = cardmodel.InventoryView(self._cards, self.version)
+            return self._view
+
+    # --- 寫入 ---
+    def _position(self, cards, card):
+        for i, c in enumerate(cards):
+            if c is card: return i
+        return None
+
+    def _commit(self, cards, action, name):
+        self._cards = cards
+        self.version += 1
+        self._log.append((self.version, action, name))
+        return self.version
+
+    def _check_version(self, expected_version, name):
+        """expected_version 之後的變更不可碰到同名卡片，也不可整個取代卡片庫 (無法判斷時視為衝突)。"""
+        if expected_version == self.version: return
+        changes = self.changes_since(expected_version) if expected_version is not None else None
+        if changes is None or any(action == "reload" or n == name for _, action, n in changes):
+            raise StaleWriteError(f"卡片「{name}」已被其他使用者修改或刪除 (版本 {expected_version} → {self.version})")
+
+    def _check(self, expected_version, card):
+        """版本檢查 (_check_version) 通過後，目標卡片必須仍在目前的清單中，回傳其位置。"""
+        self._check_version(expected_version, card.name)
+        idx = self._position(self._cards, card)
+        if idx is None:
+            raise StaleWriteError(f"卡片「{card.name}」已被其他使用者修改或刪除 (版本 {expected_version} → {self.version})")
+        return idx
+
+    def insert(self, expected_version, card):
+        """新增卡片，回傳新版本號。其他使用者在 expected_version 之後新增了同名卡片時拋出 StaleWriteError。"""
+        with self.lock:
+            self._check_version(expected_version, card.name)
+            cards = self._cards.derive(self._cards)
+            idx = bisect.bisect_right(cards, card.name, key=lambda c: c.name)
+            cards.insert(idx, card)
+            self.store.insert(cards, card)
+            for index in self._indexes.values(): index.insert(idx, card)
+            return self._commit(cards, "insert", card.name)
+
+    def update(self, expected_version, old_card, new_card):
+        """以 new_card 取代 old_card，回傳新版本號。"""
+        with self.lock:
+            idx = self._check(expected_version, old_card)
+            if new_card.name != old_card.name: self._check_version(expected_version, new_card.name)
+            cards = self._cards.derive(self._cards[:idx] + self._cards[idx + 1:])
+            # 與資料庫的讀取順序 (名稱, 資料列) 一致：修改後保留原本的資料列
+            rowids = cards.rowids
+            key = (new_card.name, rowids.get(id(old_card), 0))
+            new_idx = bisect.bisect_left(cards, key, key=lambda c: (c.name, rowids.get(id(c), 0)))
+            cards.insert(new_idx, new_card)
+            self.store.update(cards, old_card, new_card)
+            for index in self._indexes.values():
+                index.delete(idx)
+                index.insert(new_idx, new_card)
+            return self._commit(cards, "update", new_card.name)
+
+    def delete(self, expected_version, card):
+        """刪除卡片，回傳新版本號。"""
+        with self.lock:
+            idx = self._check(expected_version, card)
+            cards = self._cards.derive(self._cards[:idx] + self._cards[idx + 1:])
+            self.store.delete(cards, card)
+            for index in self._indexes.values(): index.delete(idx)
+            return self._commit(cards, "delete", card.name)
+
+    def replace_all(self, cards, expected_version=None):
+        """
+        以 cards (Card 或 JSON dict) 取代整個卡片庫 (匯入/強制存檔)，回傳新版本號。
+        指定 expected_version 時卡片庫必須仍是該版本 (否則會蓋掉其他使用者的變更)，不符時拋出 StaleWriteError；
+        None 表示刻意覆蓋 (匯入 JSON)。
+        """
+        cards = cardmodel.load_cards(cards) # 先驗證，格式錯誤時不動到卡片庫
+        with self.lock:
+            if expected_version is not None and expected_version != self.version:
+                raise StaleWriteError(f"卡片庫已被其他使用者變更 (版本 {expected_version} → {self.version})")
+            cards = CardList(sorted(cards, key=lambda c: c.name))
+            self.store.replace_all(cards)
+            self._indexes.clear() # 索引下次取用時重建
+            return self._commit(cards, "reload", "")
+
+
+_shared = {}
+
+def open_shared_inventory(db_path, legacy_json=None):
+    """取得指定資料庫的共用卡片庫 (每個檔案在行程中只有一份)。"""
+    key = os.path.abspath(db_path)
+    store = open_store(db_path, legacy_json)
+    with _stores_lock:
+        shared = _shared.get(key)
+        if shared is None:
+            shared = _shared[key] = SharedInventory(store)
+        return shared
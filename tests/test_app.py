@@ -0,0 +1,92 @@
+import io
+import os
+import shutil
+
+import pytest
+import streamlit
+from PIL import Image
+
+from streamlit.testing.v1 import AppTest
+
+import ingest
+import storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """在暫存資料夾中執行 app.py (資料庫、快取檔案都寫在暫存資料夾)。"""
+    for name in ("app.py", "mezastar_db.json"):
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    shutil.copytree(os.path.join(ROOT, "att_icon"), tmp_path / "att_icon")
+    monkeypatch.chdir(tmp_path)
+    return AppTest.from_file(str(tmp_path / "app.py"), default_timeout=120).run()
+
+
+def click(at, label):
+    next(b for b in at.button if label in b.label).click().run()
+
+
+def test_planner_unlimited_card_reuse(app):
+    """勾選「不限次數」時，規劃會收到 card_limit=None，同一張卡片可在每一場出場。"""
+    app.sidebar.radio[0].set_value("🗓️ 多場對戰規劃").run()
+    click(app, "規劃")
+    names = [m["name"] for r in app.session_state["session_plan"]["rounds"] for m in r["members"]]
+    assert len(names) == len(set(names))
+
+    app.checkbox(key="plan_card_unlimited").check().run()
+    assert app.number_input(key="plan_card_limit").disabled
+    click(app, "規劃")
+    assert not app.exception
+    teams = [sorted(m["name"] for m in r["members"]) for r in app.session_state["session_plan"]["rounds"]]
+    assert len(teams) == 3 and teams[0] == teams[1] == teams[2]
+
+
+def test_edit_save_when_card_removed_concurrently(app, monkeypatch):
+    """更新存檔後、重新選取前，卡片被其他使用者刪除：改選第一張卡片而不是拋出例外。"""
+    update = storage.SharedInventory.update
+    def update_then_delete(self, expected_version, old_card, new_card):
+        version = update(self, expected_version, old_card, new_card)
+        self.delete(version, new_card) # 其他 session 隨即刪除了這張卡片
+        return version
+    monkeypatch.setattr(storage.SharedInventory, "update", update_then_delete)
+
+    app.radio(key="manage_sub_mode").set_value("✏️ 編輯與刪除").run()
+    app.selectbox(key="edit_select_index").set_value(2).run()
+    app.number_input(key="edit_attack_input").set_value(777)
+    click(app, "更新並存檔")
+    assert not app.exception
+    assert app.session_state["edit_select_index"] == 0
+    assert app.session_state["edit_attack_input"] == app.session_state["inventory"][0].attack
+
+
+def test_rejected_insert_does_not_ingest_images(app, monkeypatch):
+    """新增卡片因版本衝突沒有寫入時，上傳的圖片也不能送去匯入 (否則會蓋掉同名卡片的圖)。"""
+    png = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(png, "PNG")
+    file_uploader = streamlit.file_uploader
+    def fake_uploader(label, *args, **kwargs):
+        key = kwargs.get("key", "")
+        if not key.startswith("u_front_"): return file_uploader(label, *args, **kwargs)
+        upload = io.BytesIO(png.getvalue())
+        upload.name, upload.file_id = "front.png", "front"
+        streamlit.session_state[key] = upload
+        return upload
+    monkeypatch.setattr(streamlit, "file_uploader", fake_uploader)
+    submitted = []
+    monkeypatch.setattr(ingest.IngestPipeline, "submit", lambda self, items, on_stored=None: submitted.append(items))
+    insert, stale = storage.SharedInventory.insert, [True]
+    def stale_insert(self, expected_version, card):
+        if stale[0]: raise storage.StaleWriteError("卡片庫已被其他使用者變更")
+        return insert(self, expected_version, card)
+    monkeypatch.setattr(storage.SharedInventory, "insert", stale_insert)
+
+    app.run()
+    app.text_input(key="add_name_input").set_value("0-測試")
+    click(app, "新增並存檔")
+    assert app.error and not submitted
+
+    stale[0] = False
+    click(app, "新增並存檔")
+    assert [[(i.name, i.side) for i in items] for items in submitted] == [[("0-測試", "前")]]
@@ -0,0 +1,86 @@
+import itertools
+import random
+import time
+from collections import Counter
+
+import battle
+import cardmodel
+
+FIRE = [{"manual_t1": "草", "manual_t2": "無", "detected_weakness": []}] * 3
+
+
+def make_cards(specs):
+    """specs: [(名稱, 攻擊, 特殊能力, 招式屬性), ...] → 編碼後的卡片庫。"""
+    return battle.EncodedInventory(cardmodel.load_cards([
+        {"name": name, "attack": atk, "sp_attack": atk, "tag": tag, "type": "火", "type2": "無",
+         "moves": [{"name": f"{name}-1", "type": move_type, "category": "攻擊"},
+                   {"name": f"{name}-2", "type": move_type, "category": "攻擊"}]}
+        for name, atk, tag, move_type in specs
+    ]))
+
+
+def test_plan_session_card_limit():
+    """每張卡片限出場一次時第二場沒有卡片可用；card_limit=None (不限) 時每場都派出同一隊。"""
+    enc = make_cards([("A", 150, "無", "火"), ("B", 120, "無", "火"), ("C", 100, "無", "火")])
+    once = battle.plan_session(enc, [FIRE, FIRE], card_limit=1)
+    assert [len(r["members"]) for r in once["rounds"]] == [3, 0]
+
+    unlimited = battle.plan_session(enc, [FIRE, FIRE], card_limit=None)
+    teams = [sorted(m["name"] for m in r["members"]) for r in unlimited["rounds"]]
+    assert teams == [["A", "B", "C"], ["A", "B", "C"]]
+    assert unlimited["total"] == 2 * once["total"] == unlimited["bound"]
+
+
+def candidate(name, tag, score):
+    return {"name": name, "mode": "special", "tag": tag, "original_tag": tag, "move": "", "score": score, "dmg": score}
+
+
+def test_solve_teams_many_duplicate_names():
+    """大量同名候選排在前面時仍要很快求出最佳解 (同名只能出場一次)。"""
+    tags = ["無", "Z招式", "極巨化"]
+    cands = [candidate("X", tags[i % 3], 1000 - i * 0.1) for i in range(1000)]
+    cands += [candidate(f"o{i}", "無", 10 + i) for i in range(5)]
+    start = time.perf_counter()
+    teams, nodes = battle.solve_teams(cands, size=3, top_k=1)
+    assert time.perf_counter() - start < 1.0
+    assert nodes < 100
+    assert teams[0]["score"] == 1000 + 14 + 13
+    assert [m["name"] for m in teams[0]["members"]] == ["X", "o4", "o3"]
+
+
+def brute_force_session(enc, cfgs, card_limit, tag_limits, size=3):
+    """列舉每場所有合法隊伍 (含人數不足) 的所有組合，回傳符合跨場次限制的最高總分。"""
+    per_round = []
+    for cfg in cfgs:
+        cands = battle.score_candidates(enc, cfg)
+        per_round.append([team for k in range(size + 1) for team in itertools.combinations(cands, k)
+                          if len({c["name"] for c in team}) == k
+                          and len({c["tag"] for c in team if c["tag"] != "無"}) == sum(c["tag"] != "無" for c in team)])
+    best = 0.0
+    for plan in itertools.product(*per_round):
+        members = [c for team in plan for c in team]
+        if card_limit is not None and any(v > card_limit for v in Counter(c["name"] for c in members).values()): continue
+        tags = Counter(c["tag"] for c in members)
+        if any(tags[t] > limit for t, limit in (tag_limits or {}).items()): continue
+        best = max(best, sum(c["score"] for c in members))
+    return best
+
+
+def test_plan_session_duplicate_names():
+    """持有多張同名卡片時，規劃結果與上界都要與暴力法一致 (複本不能擠掉其他可用的卡片)。"""
+    enc = make_cards([("A", 150, "無", "火"), ("A", 150, "無", "火"), ("A", 140, "無", "火"), ("B", 100, "無", "火"), ("C", 90, "無", "火")])
+    plan = battle.plan_session(enc, [FIRE], card_limit=None)
+    assert sorted(m["name"] for m in plan["rounds"][0]["members"]) == ["A", "B", "C"]
+    assert plan["total"] == plan["bound"] == brute_force_session(enc, [FIRE], None, None)
+
+    rng = random.Random(0)
+    types = ["火", "水", "草", "電"]
+    for _ in range(100):
+        enc = make_cards([(rng.choice("ABCD"), rng.randint(50, 150), rng.choice(["無", "無", "Z招式", "極巨化"]), rng.choice(types))
+                          for _ in range(rng.randint(3, 6))])
+        cfgs = [[{"manual_t1": rng.choice(types), "manual_t2": "無", "detected_weakness": []}] * 3 for _ in range(rng.randint(1, 2))]
+        card_limit, tag_limits = rng.choice([1, 2, None]), rng.choice([None, {"Z招式": 1}])
+        plan = battle.plan_session(enc, cfgs, card_limit=card_limit, tag_limits=tag_limits)
+        best = brute_force_session(enc, cfgs, card_limit, tag_limits)
+        assert plan["total"] <= best + 1e-6 <= plan["bound"] + 2e-6
+        if plan["total"] == plan["bound"]: assert abs(plan["total"] - best) < 1e-6
@@ -0,0 +1,30 @@
+import io
+import os
+
+from PIL import Image
+
+import ingest
+
+
+def test_prune_keeps_reused_blob(tmp_path):
+    """沿用舊的內容檔時會更新修改時間，之後的 prune() 不會刪掉它。"""
+    store = ingest.ImageStore(str(tmp_path))
+    first = store.put("A", "前", b"png")
+    os.remove(first.path)                # 卡片圖片被換掉，內容檔已沒有別名
+    os.utime(first.blob, (0, 0))         # 而且早已超過 PRUNE_AGE
+
+    second = store.put("B", "前", b"png")
+    assert second.reused and second.blob == first.blob
+    os.remove(second.path)               # 別名隨即又被移除，剛沿用的內容檔仍在保留期限內
+    assert store.prune() == 0
+    assert os.path.exists(second.blob)
+
+
+def test_encode_png_keeps_original_resolution():
+    """預設保留原始解析度，只有指定 max_edge 時才縮小。"""
+    buf = io.BytesIO()
+    Image.new("RGB", (3000, 20), (10, 20, 30)).save(buf, "JPEG")
+    with Image.open(io.BytesIO(ingest.encode_png(buf.getvalue()))) as img:
+        assert img.size == (3000, 20)
+    with Image.open(io.BytesIO(ingest.encode_png(buf.getvalue(), max_edge=1500))) as img:
+        assert img.size == (1500, 10)
@@ -0,0 +1,36 @@
+import pytest
+
+import cardmodel
+import storage
+
+
+def card(name, attack=100):
+    return cardmodel.Card.from_dict({"name": name, "attack": attack, "tag": "無", "type": "火", "moves": []})
+
+
+@pytest.fixture
+def shared(tmp_path):
+    inv = storage.SharedInventory(storage.CardStore(str(tmp_path / "db.sqlite")))
+    inv.replace_all([card("A"), card("B")])
+    return inv
+
+
+def test_stale_writes_merge_or_reject(shared):
+    """版本落後時：與其他人的變更無關的卡片可以寫入，同一張卡片或整個取代則拒絕。"""
+    version, cards = shared.snapshot()
+    a, b = cards
+    shared.update(version, a, card("A", 120)) # 其他 session 修改 A
+
+    shared.update(version, b, card("B", 130)) # 落後一版，但 B 沒被動過：合併
+    assert [c.attack for c in shared.snapshot()[1]] == [120, 130]
+    with pytest.raises(storage.StaleWriteError):
+        shared.delete(version, a)
+    with pytest.raises(storage.StaleWriteError):
+        shared.insert(version, card("A"))
+
+    # 強制存檔 (整個取代) 不可蓋掉其他人的變更
+    with pytest.raises(storage.StaleWriteError):
+        shared.replace_all(cards, version)
+    assert [c.attack for c in shared.snapshot()[1]] == [120, 130]
+    shared.replace_all(cards, shared.version)
+    assert [c.attack for c in shared.snapshot()[1]] == [100, 100]
@@ -0,0 +1,216 @@
+"""
+對戰錄影的串流掃描 (命令列工具，不需要 Streamlit)。
+逐格讀取影片檔 (或攝影機)，只在屬性圖示列的畫面換了新內容時才辨識圖示，
+輸出有利屬性與推薦隊伍的時間軸 (JSONL，每次辨識結果改變時一行)。
+變化判斷只比較框選範圍縮小後的色彩圖 (每次取樣不到 1 毫秒)，因此能跟上影片的播放速度。
+
+用法:
+    python videoscan.py battle.mp4 --box 120,860,840,90 --out timeline.jsonl
+    python videoscan.py battle.mp4 --sample-fps 4     (沒有 --box 時使用記住的框選或自動定位圖示列)
+    python videoscan.py 0                             (攝影機 / 擷取卡編號)
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+import battle
+import detector
+import perf
+import scan
+import storage
+
+SAMPLE_FPS = 5.0        # 每秒取樣幾格 (其他格只 grab，不轉成影像)
+SIGNATURE_WIDTH = 96    # 比較變化時把圖示列縮小到這個寬度
+PIXEL_DELTA = 24        # 縮圖像素在任一色版差異超過此值才算變動
+CHANGE_SHARE = 0.02     # 變動像素超過縮圖的 2% 視為畫面有變化 (一個圖示約占 5% 以上)
+STABLE_SAMPLES = 2      # 連續幾次取樣都沒有變化才辨識 (避開切換動畫中的畫面)
+LOCATE_INTERVAL = 1.0   # 還沒找到圖示列時，每隔幾秒 (影片時間) 自動定位一次
+LOCATE_MIN_COLUMNS = 2  # 定位到的範圍至少要有幾欄辨識得到圖示才採用
+
+
+def strip_signature(crop_bgr, width=SIGNATURE_WIDTH):
+    """圖示列的縮小色彩圖 (用來判斷畫面是否改變)。"""
+    h, w = crop_bgr.shape[:2]
+    size = (width, max(1, round(h * width / w)))
+    return cv2.resize(crop_bgr, size, interpolation=cv2.INTER_AREA)
+
+
+def changed_share(a, b, delta=PIXEL_DELTA):
+    """兩張縮圖中變動像素的比例。"""
+    return float((cv2.absdiff(a, b).max(axis=2) > delta).mean())
+
+
+class StripChangeDetector:
+    """
+    判斷圖示列是否需要重新辨識：畫面連續 stable 次取樣沒有變化 (不在動畫中)，
+    且與上次辨識時的畫面不同。
+    """
+
+    def __init__(self, share=CHANGE_SHARE, stable=STABLE_SAMPLES):
+        self.share = share
+        self.stable = stable
+        self._prev = None     # 上一次取樣
+        self._analyzed = None # 上一次辨識
+        self._still = 0
+
+    def update(self, crop_bgr):
+        sig = strip_signature(crop_bgr)
+        moving = self._prev is not None and changed_share(sig, self._prev) > self.share
+        self._prev = sig
+        self._still = 0 if moving else self._still + 1
+        if self._still < self.stable: return False
+        if self._analyzed is not None and changed_share(sig, self._analyzed) <= self.share: return False
+        self._analyzed = sig
+        return True
+
+
+def open_video(source):
+    """source 為影片路徑或攝影機編號 (int)。"""
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened(): raise OSError(f"無法開啟影片: {source}")
+    return cap
+
+
+def video_size(source):
+    """影片的 (寬, 高)，無法讀取時回傳 None。"""
+    try:
+        cap = open_video(source)
+    except OSError:
+        return None
+    try:
+        w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return (w, h) if w and h else None
+    finally:
+        cap.release()
+
+
+def locate_strip(frame, groups, detect_config=None, workers=1, min_columns=LOCATE_MIN_COLUMNS):
+    """
+    自動定位圖示列 (full-width 框選)。影片中常有其他與圖示相似的色塊 (特效、背景)，
+    因此定位到的範圍內至少要有 min_columns 欄辨識得到圖示才採用，否則回傳 None。
+    """
+    box = detector.locate_icon_strip(frame, groups)
+    if box is None: return None
+    x, y, w, h = box
+    hits = detector.detect_icons(np.ascontiguousarray(frame[y:y + h, x:x + w]), groups, workers=workers, **(detect_config or {}))
+    return box if sum(bool(d) for d in detector.hits_to_columns(hits)) >= min_columns else None
+
+
+def format_time(seconds):
+    m, s = divmod(seconds, 60)
+    return f"{int(m):02d}:{s:04.1f}"
+
+
+def scan_video(source, groups, table, box=None, sample_fps=SAMPLE_FPS, detect_config=None, top_k=1, workers=1,
+               progress=None, timings=None, stats=None):
+    """
+    逐格讀取影片，產生時間軸事件 (dict)：
+    {"t": 秒, "frame": 格數, "box", "detected": 三欄有利屬性, "teams", "nodes", "timing"}。
+    只在圖示列換了新內容且辨識結果與上一個事件不同時產生事件；box 為 None 時自動定位圖示列。
+    progress(目前秒數, 總秒數或 None) 每次取樣時呼叫；timings (perf.StageTimer) 記錄各階段耗時；
+    stats (dict) 會累計 frames / samples / analyzed 次數。
+    """
+    detect_config = detect_config or {}
+    stats = {} if stats is None else stats
+    for k in ("frames", "samples", "analyzed"): stats.setdefault(k, 0)
+    cap = open_video(source)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        total = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        duration = total / fps if total > 0 else None
+        step = max(1, round(fps / sample_fps))
+        change = StripChangeDetector()
+        last_detected, next_locate, frame_idx = None, 0.0, -1
+        while True:
+            frame_idx += 1
+            with perf.timed(timings, "decode"):
+                if frame_idx % step:
+                    if not cap.grab(): break
+                    stats["frames"] += 1
+                    continue
+                ok, frame = cap.read()
+            if not ok: break
+            stats["frames"] += 1
+            stats["samples"] += 1
+            t = frame_idx / fps
+            if progress: progress(t, duration)
+            if box is None:
+                if t < next_locate: continue
+                next_locate = t + LOCATE_INTERVAL
+                with perf.timed(timings, "locate"):
+                    box = locate_strip(frame, groups, detect_config, workers)
+                if box is None: continue
+            x, y, w, h = box
+            crop = frame[y:y + h, x:x + w]
+            if crop.size == 0: continue
+            with perf.timed(timings, "change"):
+                if not change.update(crop): continue
+            stats["analyzed"] += 1
+            t0 = time.perf_counter()
+            with perf.timed(timings, "detect"):
+                hits = detector.detect_icons(np.ascontiguousarray(crop), groups, workers=workers, **detect_config)
+                detected = detector.hits_to_columns(hits)
+            t1 = time.perf_counter()
+            if detected == last_detected: continue
+            last_detected = detected
+            with perf.timed(timings, "recommend"):
+                teams, nodes = scan.recommend(table, detected, top_k) if any(detected) else ([], 0)
+            t2 = time.perf_counter()
+            yield {"t": round(t, 3), "frame": frame_idx, "box": list(box), "detected": detected, "teams": teams, "nodes": nodes,
+                   "timing": {"detect": t1 - t0, "recommend": t2 - t1}}
+    finally:
+        cap.release()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="掃描對戰錄影，輸出有利屬性與推薦隊伍的時間軸 (JSONL)。")
+    ap.add_argument("source", help="影片檔，或攝影機/擷取卡編號 (例如 0)")
+    ap.add_argument("--box", type=scan.parse_box, help="圖示列的框選範圍 x,y,w,h (原始解析度座標)")
+    ap.add_argument("--crop-boxes", default="crop_boxes.json", help="依解析度記住的框選範圍 (沒有 --box 時使用)")
+    ap.add_argument("--out", help="輸出 JSONL 檔 (預設輸出到 stdout)")
+    ap.add_argument("--db", default="mezastar_db.sqlite", help="卡片資料庫 (SQLite)")
+    ap.add_argument("--json", default="mezastar_db.json", help="資料庫為空時匯入的舊版 JSON 檔")
+    ap.add_argument("--icons", default="att_icon", help="圖示範本資料夾")
+    ap.add_argument("--mode", default="roi", choices=list(detector.DETECT_MODES), help="比對模式")
+    ap.add_argument("--features", default="bgr", choices=list(detector.MATCH_FEATURES), help="比對特徵")
+    ap.add_argument("--prefilter", action="store_true", help="先以色相預篩排除不可能出現的屬性")
+    ap.add_argument("--sample-fps", type=float, default=SAMPLE_FPS, help="每秒取樣幾格")
+    ap.add_argument("--top-k", type=int, default=1, help="每個時間點列出前幾組隊伍")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="辨識時的執行緒數")
+    args = ap.parse_args(argv)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    groups = detector.get_template_bank(args.icons).groups
+    if not groups: ap.error(f"{args.icons} 內沒有範本")
+    cards = storage.CardStore(args.db, legacy_json=args.json).load()
+    if not cards: ap.error(f"{args.db} 沒有卡片資料")
+    box = args.box
+    if box is None:
+        size = video_size(source)
+        box = detector.get_crop_box_memory(args.crop_boxes).get(size) if size else None
+
+    table = battle.EncodedInventory(cards)
+    config = {"mode": args.mode, "features": args.features, "prefilter": args.prefilter}
+    stats, start = {}, time.perf_counter()
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for event in scan_video(source, groups, table, box, args.sample_fps, config, args.top_k, args.workers, stats=stats):
+            out.write(json.dumps(event, ensure_ascii=False) + "\n")
+            out.flush()
+            team = " / ".join(m["name"] for m in event["teams"][0]["members"]) if event["teams"] else "-"
+            cols = " | ".join("/".join(d) or "-" for d in event["detected"])
+            print(f"{format_time(event['t'])}  {cols}  → {team}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout: out.close()
+    elapsed = time.perf_counter() - start
+    print(f"完成：{stats['frames']} 格，取樣 {stats['samples']} 次，辨識 {stats['analyzed']} 次，耗時 {elapsed:.1f} 秒", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())